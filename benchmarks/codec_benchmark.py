@@ -0,0 +1,51 @@
+"""
+Microbenchmark for the JSON codecs on the Eventhub message hot path.
+Compares the previous decode (`json.loads(body.decode("utf-8"), strict=False)`) and encode (`json.dumps`) against each
+available codec. Run from the repository root with `python -m benchmarks.codec_benchmark`.
+"""
+import json
+import timeit
+
+from cessoc.serialization import SERIALIZERS, JsonCodec
+
+
+MESSAGE = {
+    "alert_id": "3f0c2a4e9b8d4c6f",
+    "campus": "byu",
+    "@timestamp": "2023-09-01T12:00:00.000Z",
+    "severity": 7,
+    "tags": ["phishing", "credential-harvest", "o365"],
+    "source": {"ip": "10.20.30.40", "port": 443, "geo": {"country": "US", "city": "Provo"}},
+    "iocs": [{"type": "domain", "value": f"bad-{i}.example.com", "score": i / 10} for i in range(50)],
+}
+NUMBER = 20000
+
+
+def bench(statement, number=NUMBER):
+    """Returns the best per call time in microseconds"""
+    return min(timeit.repeat(statement, number=number, repeat=5)) / number * 1e6
+
+
+def main():
+    """Prints per message decode and encode timings"""
+    body = json.dumps(MESSAGE).encode("utf-8")
+    baseline_decode = bench(lambda: json.loads(body.decode("utf-8"), strict=False))
+    baseline_encode = bench(lambda: json.dumps(MESSAGE))
+    # the results are the output of the benchmark, so it prints instead of logging
+    print(f"{'codec':<12}{'decode us':>12}{'encode us':>12}{'decode gain':>14}{'encode gain':>14}")  # noqa: T201
+    print(f"{'baseline':<12}{baseline_decode:>12.2f}{baseline_encode:>12.2f}{'1.00x':>14}{'1.00x':>14}")  # noqa: T201
+    for name, codec_class in SERIALIZERS.items():
+        if not issubclass(codec_class, JsonCodec):
+            continue
+        try:
+            codec = codec_class()
+        except ImportError:
+            print(f"{name:<12}{'not installed':>12}")  # noqa: T201
+            continue
+        decode = bench(lambda: codec.loads(body))  # pylint: disable=cell-var-from-loop
+        encode = bench(lambda: codec.dumps(MESSAGE))  # pylint: disable=cell-var-from-loop
+        print(f"{name:<12}{decode:>12.2f}{encode:>12.2f}{baseline_decode / decode:>13.2f}x{baseline_encode / encode:>13.2f}x")  # noqa: T201
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""
+Microbenchmark for the properties object built for every message before the callback runs.
+Compares copying the properties into `extendProperties` against wrapping them in a `DeliveryContext`, by time and by
+bytes allocated per message. Run from the repository root with `python -m benchmarks.delivery_benchmark`.
+"""
+import timeit
+import tracemalloc
+
+from pika.spec import Basic, BasicProperties
+
+from cessoc.rabbitmq.delivery import DeliveryContext
+from cessoc.rabbitmq.rabbitmq import extendProperties
+
+
+PROPERTIES = BasicProperties(
+    app_id="AlertEnricher",
+    content_type="application/json",
+    content_encoding="utf-8",
+    correlation_id="3f0c2a4e9b8d4c6f",
+    reply_to="amq.rabbitmq.reply-to",
+    priority=5,
+    headers={"Reply-To-Callback": "AlertEnricher.on_enriched", "Reply-To-Headers": {"campus": "byu"}},
+)
+DELIVER = Basic.Deliver(consumer_tag="ctag", delivery_tag=1, exchange="byu", routing_key="alert.phishing")
+NUMBER = 100000
+
+
+def copy_properties():
+    """The previous per message properties, read like a typical callback does"""
+    properties = extendProperties.from_BasicProperties(oldprop=PROPERTIES, delivery_prop=DELIVER)
+    properties.routing_key, properties.headers  # pylint: disable=pointless-statement
+    return properties
+
+
+def wrap_properties():
+    """The per message properties view, read like a typical callback does"""
+    properties = DeliveryContext(PROPERTIES, DELIVER)
+    properties.routing_key, properties.headers  # pylint: disable=pointless-statement
+    return properties
+
+
+def bench(function, number=NUMBER):
+    """Returns the best per call time in microseconds"""
+    return min(timeit.repeat(function, number=number, repeat=5)) / number * 1e6
+
+
+def allocated(function, number=1000):
+    """Returns the bytes allocated per call while keeping every result alive, like messages in flight"""
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    results = [function() for _ in range(number)]
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    return sum(stat.size_diff for stat in after.compare_to(before, "filename")) / len(results)
+
+
+def main():
+    """Prints per message timings and allocations"""
+    # the results are the output of the benchmark, so it prints instead of logging
+    print(f"{'properties':<20}{'time us':>10}{'bytes':>10}")  # noqa: T201
+    for name, function in (("extendProperties", copy_properties), ("DeliveryContext", wrap_properties)):
+        print(f"{name:<20}{bench(function):>10.2f}{allocated(function):>10.0f}")  # noqa: T201
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,4 @@
 """
 The cessoc package provides the main functionality used by the cessoc engineering team.
 """
-__all__ = ["aws", "healthcheck", "humio", "openshift_healthcheck", "openshift_humio", "openshift_postgresql", "postgresql", "rabbitmq", "util"]
+__all__ = ["aws", "compression", "healthcheck", "humio", "openshift_healthcheck", "openshift_humio", "openshift_postgresql", "postgresql", "rabbitmq", "serialization", "util"]
@@ -0,0 +1,157 @@
+"""
+This module provides the compressors used for large message bodies.
+A compressed body is labelled with the compressor name as its content encoding. gzip is always available, zstd requires
+the optional zstandard dependency.
+"""
+import abc
+import functools
+import gzip
+import threading
+import zlib
+from typing import Optional, Union
+
+# content encoding of uncompressed JSON bodies, which are UTF-8 text
+PLAIN_ENCODING = "utf-8"
+# content encoding of uncompressed bodies that are not text, such as msgpack
+IDENTITY_ENCODING = "identity"
+
+
+class DecompressionError(ValueError):
+    """Raised when a body cannot be decompressed"""
+
+
+class Compressor(abc.ABC):
+    """Base compressor. The name is the content encoding compressed bodies are labelled with. Must be thread safe."""
+
+    name = ""
+
+    @abc.abstractmethod
+    def compress(self, data: bytes) -> bytes:
+        """
+        :param data: Body to compress
+
+        :returns: The compressed body
+        """
+
+    @abc.abstractmethod
+    def decompress(self, data: bytes) -> bytes:
+        """
+        :param data: Compressed body
+
+        :raises DecompressionError: if the body is corrupt or not compressed with this compressor
+        :returns: The original body
+        """
+
+
+class GzipCompressor(Compressor):
+    """Compressor backed by the standard library gzip module"""
+
+    name = "gzip"
+
+    def __init__(self, level: int = 6) -> None:
+        """:param level: Compression level from 1 (fastest) to 9 (smallest)"""
+        super().__init__()
+        self._level = level
+
+    def compress(self, data: bytes) -> bytes:
+        """The modification time is left out so the same body always compresses to the same bytes"""
+        return gzip.compress(data, compresslevel=self._level, mtime=0)
+
+    def decompress(self, data: bytes) -> bytes:
+        """Decompresses with gzip.decompress"""
+        try:
+            return gzip.decompress(data)
+        except (OSError, EOFError, zlib.error) as ex:
+            raise DecompressionError(f"Could not decompress gzip body: {ex}") from ex
+
+
+class ZstdCompressor(Compressor):
+    """
+    Compressor backed by zstandard. https://github.com/indygreg/python-zstandard
+    zstandard compressors and decompressors must not be used by several threads at once, so each thread gets its own.
+    """
+
+    name = "zstd"
+
+    def __init__(self, level: int = 3) -> None:
+        """
+        :param level: Compression level from 1 (fastest) to 22 (smallest)
+        :raises ImportError: if zstandard is not installed
+        """
+        super().__init__()
+        try:
+            import zstandard  # pylint: disable=import-outside-toplevel
+        except ImportError as ex:
+            raise ImportError("The zstd compressor requires the 'zstandard' package. Install cessoc with the 'zstd' extra") from ex
+        self._zstandard = zstandard
+        self._level = level
+        self._local = threading.local()
+
+    def compress(self, data: bytes) -> bytes:
+        """The body size is written in the frame so decompressing does not need to guess it"""
+        compressor = getattr(self._local, "compressor", None)
+        if compressor is None:
+            compressor = self._local.compressor = self._zstandard.ZstdCompressor(level=self._level)
+        return compressor.compress(data)
+
+    def decompress(self, data: bytes) -> bytes:
+        """Decompresses with the decompressor of the calling thread"""
+        decompressor = getattr(self._local, "decompressor", None)
+        if decompressor is None:
+            decompressor = self._local.decompressor = self._zstandard.ZstdDecompressor()
+        try:
+            return decompressor.decompress(data)
+        except self._zstandard.ZstdError as ex:
+            raise DecompressionError(f"Could not decompress zstd body: {ex}") from ex
+
+
+COMPRESSORS = {compressor.name: compressor for compressor in (GzipCompressor, ZstdCompressor)}
+
+
+def get_compressor(compressor: Optional[Union[str, Compressor]]) -> Optional[Compressor]:
+    """
+    :param compressor: Compressor instance or the name of a compressor ('gzip' or 'zstd'). None disables compression
+
+    :raises ValueError: if the compressor name is unknown
+    :returns: The compressor instance, None when compression is disabled
+    """
+    if compressor is None or isinstance(compressor, Compressor):
+        return compressor
+    if compressor not in COMPRESSORS:
+        raise ValueError(f"Unknown compressor '{compressor}'. Must be one of {list(COMPRESSORS)}")
+    return COMPRESSORS[compressor]()
+
+
+@functools.lru_cache(maxsize=None)
+def _decompressor(content_encoding: str) -> Compressor:
+    """Compressor reused to decompress bodies with the content encoding"""
+    return COMPRESSORS[content_encoding]()
+
+
+def supported_encodings() -> frozenset:
+    """:returns: The content encodings bodies can be received with. zstd is only included when zstandard is installed"""
+    encodings = {PLAIN_ENCODING, IDENTITY_ENCODING}
+    for name in COMPRESSORS:
+        try:
+            _decompressor(name)
+        except ImportError:
+            continue
+        encodings.add(name)
+    return frozenset(encodings)
+
+
+def decompress(data: bytes, content_encoding: Optional[str]) -> bytes:
+    """
+    :param data: Message body
+    :param content_encoding: Content encoding the body was published with. Bodies without one are not compressed
+
+    :raises DecompressionError: if the body cannot be decompressed
+    :raises ValueError: if the content encoding is unknown
+    :raises ImportError: if the content encoding needs an optional dependency that is not installed
+    :returns: The uncompressed body
+    """
+    if content_encoding is None or content_encoding in (PLAIN_ENCODING, IDENTITY_ENCODING):
+        return data
+    if content_encoding not in COMPRESSORS:
+        raise ValueError(f"Unknown content encoding '{content_encoding}'")
+    return _decompressor(content_encoding).decompress(data)
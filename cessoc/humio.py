@@ -4,14 +4,14 @@ This module is used to send data to Humio.
 # TODO add timeout for humio send # pylint: disable=fixme
 
 import os
-import json
-from typing import List, Optional
+from typing import List, Optional, Union
 import requests
 from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
 from botocore.exceptions import ClientError
 from cessoc.aws import ssm
 from cessoc.logging import cessoc_logging
+from cessoc.serialization import JsonCodec, get_codec
 
 
 def _send_humio(
@@ -83,7 +83,8 @@ def write(
     path: Optional[str] = None,
     endpoint: Optional[str] = None,
     chunk_size: Optional[int] = 200,
-    session: Optional[requests.sessions.Session] = None
+    session: Optional[requests.sessions.Session] = None,
+    codec: Optional[Union[str, JsonCodec]] = None,
 ) -> None:
     """
     Write intel data to given Humio. Events must be pre-processed (e.g. @timestamp must
@@ -96,6 +97,7 @@ def write(
     :param metadata: Optional list of dictionaries for any other information that may be valuable/necessary
     :param chunk_size: Number of events to send per POST request to Humio
     :param session: Session variable to pass in to use to connection pooling
+    :param codec: JSON codec used to encode each event. Can be 'json', 'orjson', 'msgspec' or a `JsonCodec`. Defaults to the standard library
     :raises Exception: general exception for raised exceptions from humio functions
     """
     if not isinstance(data, list):
@@ -110,12 +112,14 @@ def write(
         if metadata is not None:
             obj.update(metadata)
 
+    codec = get_codec(codec)
+
     # Break items into chunks divided by split_by
     chunks = []
     for i in range(0, len(data), chunk_size):
         chunk = []
         for event in data[i: i + chunk_size]:  # noqa:
-            chunk.append(json.dumps(event))
+            chunk.append(codec.dumps_str(event))
         chunks.append([{"messages": chunk}])
     _send_humio(chunks, endpoint, token, session)
 
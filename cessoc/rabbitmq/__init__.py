@@ -1 +1 @@
-__all__ = ["rabbitmq"]
+__all__ = ["acks", "async_eventhub", "claim_check", "confirms", "dedup", "delivery", "exchange", "executors", "metrics", "prefetch", "publisher", "queue", "rabbitmq", "reconnect", "retry", "routing", "spool"]
@@ -0,0 +1,111 @@
+"""Ack coalescing to settle many deliveries with as few AMQP frames as possible"""
+
+import threading
+from collections import OrderedDict
+from typing import Dict
+
+from pika.channel import Channel
+
+
+class AckCoalescer:
+    """
+    Collects settled delivery tags from worker threads and flushes them from the ioloop.
+
+    Deliveries are registered in the order the broker sent them. On flush, the longest run of acknowledged tags at
+    the start of that order is sent as a single `basic_ack(multiple=True)`. Tags that finished out of order are
+    settled individually so a slow message never holds back acks for the ones after it.
+    """
+
+    def __init__(self) -> None:
+        """Initialize the pending and settled delivery tag tracking"""
+        super().__init__()
+
+        # delivery tags handed to workers that have not been settled on the channel yet, in delivery order. ioloop thread only
+        self._pending: "OrderedDict[int, None]" = OrderedDict()
+
+        # delivery tags settled by workers since the last flush. value is True for ack and False for reject
+        self._settled: Dict[int, bool] = {}
+        self._flush_requested = False
+        self._lock = threading.Lock()
+
+    def delivered(self, delivery_tag: int) -> None:
+        """
+        Registers a delivery that will be settled later. Must be called from the ioloop thread.
+
+        :param delivery_tag: Delivery tag of the message
+        """
+        self._pending[delivery_tag] = None
+
+    def settle(self, delivery_tag: int, ack: bool = True) -> bool:
+        """
+        Records that a delivery has finished processing. Safe to call from any thread.
+
+        :param delivery_tag: Delivery tag of the message
+        :param ack: True to acknowledge the message, False to reject it
+
+        :returns: True when the caller must schedule a flush on the ioloop
+        """
+        with self._lock:
+            self._settled[delivery_tag] = ack
+            if self._flush_requested:
+                return False
+            self._flush_requested = True
+            return True
+
+    def flush(self, channel: Channel) -> int:
+        """
+        Sends the acks and rejects collected since the last flush. Must be called from the ioloop thread.
+
+        :param channel: The channel the deliveries were received on
+
+        :returns: The number of AMQP frames sent
+        """
+        with self._lock:
+            settled, self._settled = self._settled, {}
+            self._flush_requested = False
+
+        frames = 0
+        ack_upto = None
+        # settle the contiguous run at the head of the delivery order
+        while self._pending:
+            delivery_tag = next(iter(self._pending))
+            if delivery_tag not in settled:
+                break
+            del self._pending[delivery_tag]
+            if settled.pop(delivery_tag):
+                ack_upto = delivery_tag
+                continue
+            # a reject ends the run, multiple=True would otherwise acknowledge it
+            if ack_upto is not None:
+                channel.basic_ack(ack_upto, multiple=True)
+                frames += 1
+                ack_upto = None
+            channel.basic_reject(delivery_tag, requeue=False)
+            frames += 1
+        if ack_upto is not None:
+            channel.basic_ack(ack_upto, multiple=True)
+            frames += 1
+
+        # settle tags that finished out of order one by one
+        for delivery_tag, ack in settled.items():
+            if delivery_tag not in self._pending:
+                # delivered on a channel that has since been replaced
+                continue
+            del self._pending[delivery_tag]
+            if ack:
+                channel.basic_ack(delivery_tag)
+            else:
+                channel.basic_reject(delivery_tag, requeue=False)
+            frames += 1
+        return frames
+
+    def reset(self) -> None:
+        """Forgets all deliveries. Called when the channel the deliveries were received on is replaced."""
+        with self._lock:
+            self._settled = {}
+            self._flush_requested = False
+        self._pending.clear()
+
+    def __len__(self) -> int:
+        """Number of deliveries that have not been settled on the channel yet"""
+        return len(self._pending)
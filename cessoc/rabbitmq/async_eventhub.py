@@ -0,0 +1,105 @@
+"""Asyncio based Eventhub that runs coroutine message callbacks on the ioloop thread"""
+
+import asyncio
+import inspect
+import time
+from concurrent.futures import Future
+from typing import Callable, Dict, List, Optional, Union
+
+from pika.adapters.asyncio_connection import AsyncioConnection
+from pika.connection import Connection
+from pika.spec import BasicProperties, Basic
+
+from cessoc.rabbitmq.rabbitmq import Eventhub
+
+
+class AsyncEventhub(Eventhub):
+    """
+    Eventhub built on pika's AsyncioConnection.
+
+    Callbacks registered with `register_on_message_callback` and `register_on_reply_to_callback` may be `async def`
+    functions. They run as tasks on the event loop, so I/O bound callbacks can have as many messages in flight as
+    `prefetch_count` allows without holding a thread each. Regular functions still run on the thread pool.
+    """
+
+    def __init__(self, *args, loop: Optional[asyncio.AbstractEventLoop] = None, **kwargs) -> None:
+        """
+        Accepts the same parameters as `Eventhub`.
+
+        :param loop: Event loop to run the connection and callbacks on. A new event loop is created when not set
+        """
+        super().__init__(*args, **kwargs)
+
+        self._loop = loop if loop else asyncio.new_event_loop()
+
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        """The event loop the connection and coroutine callbacks run on"""
+        return self._loop
+
+    def _connect(self, username: str, password: str) -> Connection:
+        """Configures and starts the connection the the MQ on the event loop."""
+        parameters = self._connection_parameters(username, password)
+        self._logger.info("Connecting to %s", parameters.host)
+        return AsyncioConnection(
+            parameters=parameters,
+            on_open_callback=self._on_connection_open,
+            on_open_error_callback=self._on_connection_open_error,
+            on_close_callback=self._on_connection_closed,
+            custom_ioloop=self._loop,
+        )
+
+    def _submit_callback(
+        self, cb: Callable, basic_deliver: Basic.Deliver, properties: BasicProperties, body: bytes, reply_expected=True, queue_name: str = ""
+    ) -> Union[asyncio.Task, Future]:
+        """Starts processing the message as a task on the event loop, or on the thread pool for regular functions"""
+        if not asyncio.iscoroutinefunction(cb):
+            return super()._submit_callback(cb, basic_deliver, properties, body, reply_expected, queue_name)
+        return self._loop.create_task(self._async_callback_wrapper(cb, basic_deliver, properties, body, reply_expected, queue_name))
+
+    async def _async_callback_wrapper(
+        self, cb: Callable, basic_deliver: Basic.Deliver, properties: BasicProperties, body: bytes, reply_expected=True, queue_name: str = ""
+    ) -> None:
+        """
+        Coroutine version of `_callback_wrapper`. Awaits the message callback and sends the reply to if requested.
+        Decoding the message and encoding the reply can call S3, so they run in the default executor of the event loop.
+        """
+        try:
+            dedup_key = self._dedup_key_of(properties, queue_name)
+            # dedup stores can block, they are only called from the thread pool
+            if dedup_key is not None and await self._loop.run_in_executor(None, self._is_duplicate, basic_deliver, dedup_key, queue_name):
+                return
+            # fetching a claim checked body from S3 and decoding it would block the event loop
+            decoded = await self._loop.run_in_executor(None, self._decode_message, basic_deliver, properties, body)
+            # measure execution time of the event, wall clock since the task yields while awaiting I/O
+            start_time = time.perf_counter()
+
+            response = await cb(*decoded)
+
+            elapsed = time.perf_counter() - start_time
+            self._logger.debug("Processing event took %s seconds", elapsed)
+            self._metrics.handler_seconds.observe(elapsed, queue=queue_name, routing_key=basic_deliver.routing_key)
+
+            # so does encoding the reply, which may compress it and store it in S3
+            await self._loop.run_in_executor(None, self._on_callback_success, basic_deliver, properties, response, reply_expected, queue_name)
+            if dedup_key is not None:
+                await self._loop.run_in_executor(None, self._remember_processed, dedup_key)
+        except Exception as ex:  # pylint: disable=broad-except
+            self._on_callback_error(basic_deliver, ex, queue_name, properties, body)
+        finally:
+            self._metrics.in_flight.dec()
+
+    async def _on_reply_to(self, properties: BasicProperties, body: Union[Dict, List]) -> None:
+        """
+        Called when the message is a reply to. Awaits the reply to callback based on the Reply-To-Callback header.
+        Regular functions run in the default executor of the event loop so they do not block it.
+        """
+        callback = self._reply_to_callback(properties, body)
+        if callback is None:
+            return None
+        if asyncio.iscoroutinefunction(callback):
+            return await callback(properties, body)
+        result = await self._loop.run_in_executor(None, callback, properties, body)
+        if inspect.isawaitable(result):
+            result = await result
+        return result
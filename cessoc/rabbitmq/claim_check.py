@@ -0,0 +1,165 @@
+"""Claim check store that keeps large message bodies in S3 while the message only carries a reference to them"""
+
+import os
+import threading
+import uuid
+from typing import Any, Dict, List, Optional, Tuple
+
+import boto3
+from botocore.exceptions import ClientError
+
+# message header with the s3://bucket/key reference of a body stored in S3. The message body itself is empty
+CLAIM_CHECK_HEADER = "Claim-Check"
+# ID of the lifecycle rule that expires stored bodies
+LIFECYCLE_RULE_ID = "cessoc-claim-check-expiration"
+
+
+class ClaimCheckException(Exception):
+    """Raised when a body cannot be stored in or fetched from S3"""
+
+
+class ClaimCheckStore:
+    """
+    Stores message bodies in S3 under a key prefix and fetches them by reference.
+
+    Bodies are written to the ETL bucket `ces-soc-etl-{STAGE}-{CAMPUS}` unless another bucket is given. Stored bodies
+    are not deleted when their message is consumed, since a message can be routed to several queues or redelivered.
+    Use `configure_lifecycle` to let S3 expire them instead.
+
+    References are only followed into the bucket and prefix of the store, since they come from the message headers
+    and any producer could otherwise make a consumer read whatever its credentials reach.
+
+    The S3 client is created on first use and not pickled, so a store can be passed to worker processes. Thread safe.
+    """
+
+    def __init__(
+        self,
+        bucket: Optional[str] = None,
+        prefix: str = "claim-check/",
+        region_name: Optional[str] = "us-west-2",
+        endpoint_url: Optional[str] = None,
+        client: Any = None,
+    ) -> None:
+        """
+        :param bucket: The bucket bodies are stored in. Defaults to the ETL bucket of the STAGE and CAMPUS environment variables
+        :param prefix: Prefix of the keys bodies are stored under
+        :param region_name: Region name of the bucket
+        :param endpoint_url: S3 endpoint to use instead of AWS, such as a local S3 stand-in for testing
+        :param client: S3 client to use instead of creating one with boto3
+        """
+        super().__init__()
+
+        self.bucket = bucket if bucket is not None else f"ces-soc-etl-{os.getenv('STAGE')}-{os.getenv('CAMPUS')}"
+        self.prefix = prefix
+        self.region_name = region_name
+        self.endpoint_url = endpoint_url
+        self._client = client
+        self._client_lock = threading.Lock()
+
+    @property
+    def client(self) -> Any:
+        """The S3 client, created on first use"""
+        if self._client is None:
+            with self._client_lock:
+                if self._client is None:
+                    self._client = boto3.client("s3", region_name=self.region_name, endpoint_url=self.endpoint_url)
+        return self._client
+
+    def put(self, body: bytes) -> str:
+        """
+        :param body: Message body to store
+
+        :raises ClaimCheckException: if the body could not be stored
+        :returns: The reference to send in the claim check header
+        """
+        key = f"{self.prefix}{uuid.uuid4().hex}"
+        try:
+            self.client.put_object(Bucket=self.bucket, Key=key, Body=body)
+        except ClientError as ex:
+            raise ClaimCheckException(f"Could not store message body in s3://{self.bucket}/{key}: {ex}") from ex
+        return f"s3://{self.bucket}/{key}"
+
+    def get(self, reference: str) -> bytes:
+        """
+        :param reference: Reference from the claim check header
+
+        :raises ClaimCheckException: if the reference is outside the store or the body could not be fetched, for example because it expired
+        :returns: The stored message body
+        """
+        bucket, key = self._parse_own_reference(reference)
+        try:
+            return self.client.get_object(Bucket=bucket, Key=key)["Body"].read()
+        except ClientError as ex:
+            raise ClaimCheckException(f"Could not fetch message body from {reference}: {ex}") from ex
+
+    def delete(self, reference: str) -> None:
+        """
+        Deletes a stored body. Only safe once every queue the message was routed to has processed it.
+
+        :param reference: Reference from the claim check header
+
+        :raises ClaimCheckException: if the reference is outside the store or the body could not be deleted
+        """
+        bucket, key = self._parse_own_reference(reference)
+        try:
+            self.client.delete_object(Bucket=bucket, Key=key)
+        except ClientError as ex:
+            raise ClaimCheckException(f"Could not delete message body {reference}: {ex}") from ex
+
+    def _parse_own_reference(self, reference: str) -> Tuple[str, str]:
+        """
+        :raises ClaimCheckException: if the reference does not point to a body stored under the bucket and prefix of the store
+        :returns: The bucket and key
+        """
+        bucket, key = parse_reference(reference)
+        if bucket != self.bucket or not key.startswith(self.prefix) or ".." in key.split("/"):
+            raise ClaimCheckException(f"Claim check reference '{reference}' is outside s3://{self.bucket}/{self.prefix}")
+        return bucket, key
+
+    def configure_lifecycle(self, expiration_days: int) -> None:
+        """
+        Expires bodies under the prefix after the given number of days with a bucket lifecycle rule.
+        Other lifecycle rules on the bucket are kept.
+
+        :param expiration_days: Days after which S3 deletes stored bodies. Should be longer than messages can wait in a queue
+
+        :raises ClaimCheckException: if the lifecycle configuration could not be read or written
+        """
+        try:
+            rules: List[Dict] = self.client.get_bucket_lifecycle_configuration(Bucket=self.bucket)["Rules"]
+        except ClientError as ex:
+            if ex.response.get("Error", {}).get("Code") != "NoSuchLifecycleConfiguration":
+                raise ClaimCheckException(f"Could not read the lifecycle configuration of {self.bucket}: {ex}") from ex
+            rules = []
+        rules = [rule for rule in rules if rule.get("ID") != LIFECYCLE_RULE_ID]
+        rules.append(
+            {"ID": LIFECYCLE_RULE_ID, "Filter": {"Prefix": self.prefix}, "Status": "Enabled", "Expiration": {"Days": expiration_days}}
+        )
+        try:
+            self.client.put_bucket_lifecycle_configuration(Bucket=self.bucket, LifecycleConfiguration={"Rules": rules})
+        except ClientError as ex:
+            raise ClaimCheckException(f"Could not write the lifecycle configuration of {self.bucket}: {ex}") from ex
+
+    def __getstate__(self) -> Dict:
+        """The client and its lock are created again after unpickling"""
+        state = self.__dict__.copy()
+        state["_client"] = None
+        del state["_client_lock"]
+        return state
+
+    def __setstate__(self, state: Dict) -> None:
+        self.__dict__.update(state)
+        self._client_lock = threading.Lock()
+
+
+def parse_reference(reference: str) -> Tuple[str, str]:
+    """
+    :param reference: Reference in the form s3://bucket/key
+
+    :raises ClaimCheckException: if the reference is not an S3 reference
+    :returns: The bucket and key
+    """
+    if not reference.startswith("s3://") or "/" not in reference[5:]:
+        raise ClaimCheckException(f"Invalid claim check reference '{reference}'")
+    bucket, key = reference[5:].split("/", 1)
+    return bucket, key
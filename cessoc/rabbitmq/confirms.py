@@ -0,0 +1,119 @@
+"""Publisher confirm tracking to resolve per-message futures on broker ack/nack"""
+
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Any, Dict, Optional, Tuple
+
+from pika.frame import Method
+from pika.spec import Basic
+
+
+class MessageNackedException(Exception):
+    """Raised on a publish future when the broker refused to take responsibility for the message"""
+
+
+class MessageReturnedException(Exception):
+    """Raised on a publish future when a mandatory message could not be routed to any queue"""
+
+
+class ConfirmTracker:
+    """
+    Tracks messages published on a channel in confirm mode. https://www.rabbitmq.com/confirms.html#publisher-confirms
+
+    The broker numbers every message published on the channel starting at 1, so every publish must be registered
+    with `published`, including the ones nobody is waiting on. Must only be used from the ioloop thread.
+    """
+
+    def __init__(self) -> None:
+        """Initialize the pending confirm tracking"""
+        super().__init__()
+
+        # the delivery tag the broker will assign to the next published message
+        self._next_delivery_tag = 1
+
+        # futures waiting for a confirm, keyed by delivery tag, in publish order
+        self._pending: "OrderedDict[int, Future]" = OrderedDict()
+
+        # the value each pending future is resolved with and its correlation ID, keyed by delivery tag
+        self._results: Dict[int, Tuple[Any, Optional[str]]] = {}
+
+        # delivery tag of each pending message, keyed by correlation ID
+        self._correlation_ids: Dict[str, int] = {}
+
+    def published(self, future: Optional[Future] = None, result: Any = None, correlation_id: Optional[str] = None) -> int:
+        """
+        Registers a message that was just published on the channel.
+
+        :param future: Future to resolve when the broker confirms the message. None if nobody is waiting on it
+        :param result: Value to resolve the future with on ack
+        :param correlation_id: The message correlation ID, used to match returned messages
+
+        :returns: The delivery tag assigned to the message
+        """
+        delivery_tag = self._next_delivery_tag
+        self._next_delivery_tag += 1
+        if future is not None:
+            self._pending[delivery_tag] = future
+            self._results[delivery_tag] = (result, correlation_id)
+            if correlation_id:
+                self._correlation_ids[correlation_id] = delivery_tag
+        return delivery_tag
+
+    def on_confirm(self, method_frame: Method) -> None:
+        """
+        Resolves the futures covered by a Basic.Ack or Basic.Nack from the broker.
+
+        :param method_frame: The confirm frame received from the broker
+        """
+        acked = isinstance(method_frame.method, Basic.Ack)
+        delivery_tag = method_frame.method.delivery_tag
+        if method_frame.method.multiple:
+            while self._pending and next(iter(self._pending)) <= delivery_tag:
+                self._resolve(next(iter(self._pending)), acked)
+        elif delivery_tag in self._pending:
+            self._resolve(delivery_tag, acked)
+
+    def returned(self, correlation_id: Optional[str], reason: str) -> None:
+        """
+        Fails the future of a message the broker returned as unroutable. The broker still acks returned messages.
+
+        :param correlation_id: The correlation ID of the returned message
+        :param reason: The reply text sent by the broker
+        """
+        delivery_tag = self._correlation_ids.get(correlation_id)
+        if delivery_tag is None or delivery_tag not in self._pending:
+            return
+        future = self._pending[delivery_tag]
+        if not future.done():
+            future.set_exception(MessageReturnedException(reason))
+
+    def fail_all(self, reason: Any) -> None:
+        """
+        Fails every pending future and restarts delivery tag numbering. Called when the channel closes.
+
+        :param reason: Why the messages will never be confirmed
+        """
+        pending, self._pending = self._pending, OrderedDict()
+        self._results = {}
+        self._correlation_ids = {}
+        self._next_delivery_tag = 1
+        for future in pending.values():
+            if not future.done():
+                future.set_exception(MessageNackedException(f"Channel closed before the message was confirmed: {reason}"))
+
+    def _resolve(self, delivery_tag: int, acked: bool) -> None:
+        """Removes the delivery tag from the pending map and resolves its future"""
+        future = self._pending.pop(delivery_tag)
+        result, correlation_id = self._results.pop(delivery_tag)
+        self._correlation_ids.pop(correlation_id, None)
+        if future.done():
+            # already failed by a basic.return
+            return
+        if acked:
+            future.set_result(result)
+        else:
+            future.set_exception(MessageNackedException(f"Broker nacked message with delivery tag {delivery_tag}"))
+
+    def __len__(self) -> int:
+        """Number of messages waiting for a confirm"""
+        return len(self._pending)
@@ -0,0 +1,162 @@
+"""Stores of processed message keys, used to acknowledge redelivered duplicates without running their callback again"""
+
+import abc
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Optional
+
+import boto3
+
+from cessoc import timestamps
+
+# expired rows are deleted from the SQLite store after this many adds
+SQLITE_PURGE_INTERVAL = 1000
+
+
+class DedupStore(abc.ABC):
+    """Base store of the keys of messages that were processed. Must be thread safe."""
+
+    @abc.abstractmethod
+    def seen(self, key: str) -> bool:
+        """
+        :param key: Key of the message
+
+        :returns: True if a message with the key was processed and its entry has not expired
+        """
+
+    @abc.abstractmethod
+    def add(self, key: str) -> None:
+        """
+        Remembers that the message with the key was processed
+
+        :param key: Key of the message
+        """
+
+
+class MemoryDedupStore(DedupStore):
+    """
+    Bounded in-memory store. Keys expire ttl seconds after they are added, and the least recently used keys are
+    dropped once max_entries are stored. Only catches duplicates redelivered to the same process.
+    """
+
+    def __init__(self, max_entries: int = 100000, ttl: float = 3600) -> None:
+        """
+        :param max_entries: Most keys held at once
+        :param ttl: Seconds a key is remembered
+        """
+        super().__init__()
+
+        if max_entries < 1:
+            raise ValueError("max_entries must be at least 1")
+        self.max_entries = max_entries
+        self.ttl = ttl
+        # expiry time of each key, least recently used first
+        self._entries: "OrderedDict[str, float]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def seen(self, key: str) -> bool:
+        """Expired keys are dropped when they are looked up"""
+        with self._lock:
+            expires_at = self._entries.get(key)
+            if expires_at is None:
+                return False
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                return False
+            self._entries.move_to_end(key)
+            return True
+
+    def add(self, key: str) -> None:
+        """Drops the least recently used keys beyond max_entries"""
+        with self._lock:
+            self._entries[key] = time.monotonic() + self.ttl
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def __len__(self) -> int:
+        """:returns: The number of keys held, expired ones included until they are looked up or dropped"""
+        return len(self._entries)
+
+
+class SqliteDedupStore(DedupStore):
+    """Store in a local SQLite file, so keys survive a restart of the consumer. Shared by processes on the same host."""
+
+    def __init__(self, path: str, ttl: float = 86400) -> None:
+        """
+        :param path: Path of the database file, created if it does not exist
+        :param ttl: Seconds a key is remembered
+        """
+        super().__init__()
+
+        self.path = path
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._adds = 0
+        self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("CREATE TABLE IF NOT EXISTS processed (key TEXT PRIMARY KEY, expires_at REAL NOT NULL)")
+
+    def seen(self, key: str) -> bool:
+        """Looks the key up in the database"""
+        with self._lock:
+            row = self._connection.execute("SELECT expires_at FROM processed WHERE key = ?", (key,)).fetchone()
+        return row is not None and row[0] > time.time()
+
+    def add(self, key: str) -> None:
+        """Deletes expired keys every SQLITE_PURGE_INTERVAL adds"""
+        now = time.time()
+        with self._lock:
+            self._connection.execute("INSERT OR REPLACE INTO processed (key, expires_at) VALUES (?, ?)", (key, now + self.ttl))
+            self._adds += 1
+            if self._adds % SQLITE_PURGE_INTERVAL == 0:
+                self._connection.execute("DELETE FROM processed WHERE expires_at <= ?", (now,))
+
+    def close(self) -> None:
+        """Closes the database"""
+        with self._lock:
+            self._connection.close()
+
+
+class DynamoDBDedupStore(DedupStore):
+    """
+    Store in the `cessoc.timestamps` DynamoDB table, shared by every replica of a service.
+
+    Keys are stored with a prefix so they do not collide with timestamps, and carry an `expires_at` epoch second
+    attribute. Enable it as the time to live attribute of the table to let DynamoDB delete expired keys.
+    """
+
+    def __init__(self, ttl: float = 86400, table_name: Optional[str] = None, prefix: str = "dedup:", table: Any = None) -> None:
+        """
+        :param ttl: Seconds a key is remembered
+        :param table_name: The table to use. Defaults to the timestamps table of the STAGE environment variable
+        :param prefix: Prefix of the stored keys
+        :param table: DynamoDB table resource to use instead of creating one with boto3
+        """
+        super().__init__()
+
+        self.ttl = ttl
+        self.table_name = table_name
+        self.prefix = prefix
+        self._table = table
+        self._table_lock = threading.Lock()
+
+    @property
+    def table(self) -> Any:
+        """The table resource, created on first use"""
+        if self._table is None:
+            with self._table_lock:
+                if self._table is None:
+                    self._table = boto3.resource("dynamodb").Table(self.table_name or timestamps.table_name())
+        return self._table
+
+    def seen(self, key: str) -> bool:
+        """Keys DynamoDB has not deleted yet are checked against their expiry"""
+        item = self.table.get_item(Key={"key": self.prefix + key}).get("Item")
+        return item is not None and item["expires_at"] > time.time()
+
+    def add(self, key: str) -> None:
+        """DynamoDB numbers cannot be floats, the expiry is rounded down to the second"""
+        self.table.put_item(Item={"key": self.prefix + key, "expires_at": int(time.time() + self.ttl)})
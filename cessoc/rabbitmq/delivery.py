@@ -0,0 +1,94 @@
+"""Read-only view of the properties and delivery information passed to message callbacks"""
+
+from typing import Any, Tuple
+
+from pika.spec import Basic, BasicProperties
+
+# the BasicProperties attributes read through a DeliveryContext
+PROPERTY_NAMES = (
+    "content_type",
+    "content_encoding",
+    "headers",
+    "delivery_mode",
+    "priority",
+    "correlation_id",
+    "reply_to",
+    "expiration",
+    "message_id",
+    "timestamp",
+    "type",
+    "user_id",
+    "app_id",
+    "cluster_id",
+)
+
+
+class DeliveryContext:
+    """
+    The message properties together with the exchange and routing key the message was delivered with.
+
+    Message callbacks receive one for every message. Property reads such as `headers`, `correlation_id` or `priority`
+    are passed through to the `BasicProperties` pika decoded, nothing is copied. Picklable, so it can be passed to
+    worker processes.
+    """
+
+    __slots__ = ("_properties", "_deliver")
+
+    def __init__(self, properties: BasicProperties, deliver: Basic.Deliver) -> None:
+        """
+        :param properties: The properties the message was published with
+        :param deliver: The Basic.Deliver frame the message arrived with
+        """
+        _set_properties(self, properties)
+        _set_deliver(self, deliver)
+
+    @property
+    def exchange(self) -> str:
+        """The exchange the message was published to"""
+        return self._deliver.exchange
+
+    @property
+    def routing_key(self) -> str:
+        """The routing key the message was published with"""
+        return self._deliver.routing_key
+
+    @property
+    def delivery_tag(self) -> int:
+        """The delivery tag of the message on the channel it arrived on"""
+        return self._deliver.delivery_tag
+
+    @property
+    def redelivered(self) -> bool:
+        """True if the message was delivered before and not acknowledged"""
+        return self._deliver.redelivered
+
+    @property
+    def properties(self) -> BasicProperties:
+        """The properties the message was published with"""
+        return self._properties
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        raise AttributeError(f"'{type(self).__name__}' object is read-only")
+
+    def __delattr__(self, name: str) -> None:
+        raise AttributeError(f"'{type(self).__name__}' object is read-only")
+
+    def __reduce__(self) -> Tuple[type, Tuple[BasicProperties, Basic.Deliver]]:
+        """Pickles the wrapped properties and deliver frame"""
+        return type(self), (self._properties, self._deliver)
+
+    def __repr__(self) -> str:
+        return f"<{type(self).__name__}(exchange={self.exchange!r}, routing_key={self.routing_key!r}, properties={self._properties!r})>"
+
+
+def _property(name: str) -> property:
+    """Property that reads the message property with the same name"""
+    return property(lambda self: getattr(self._properties, name), doc=f"The {name} message property")
+
+
+# the slot descriptors set the attributes without going through the read-only __setattr__
+_set_properties = DeliveryContext._properties.__set__  # pylint: disable=no-member
+_set_deliver = DeliveryContext._deliver.__set__  # pylint: disable=no-member
+# explicit properties are much faster to read than a __getattr__ fallback, which only runs after a failed lookup
+for _name in PROPERTY_NAMES:
+    setattr(DeliveryContext, _name, _property(_name))
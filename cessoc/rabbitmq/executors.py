@@ -0,0 +1,341 @@
+"""Executors that decide the order deliveries are processed in on top of the Eventhub thread pool"""
+
+import heapq
+import itertools
+import multiprocessing
+import queue
+import signal
+import threading
+import time
+import traceback
+import zlib
+from collections import deque
+from concurrent.futures import Executor, Future
+from multiprocessing.connection import Connection
+from multiprocessing.process import BaseProcess
+from typing import Any, Callable, Deque, List, Optional, Tuple
+
+from cessoc.rabbitmq.metrics import Gauge
+
+
+class WorkerCrashedException(Exception):
+    """Set on the future of a submission whose worker process died while running it"""
+
+
+class RemoteTraceback(Exception):
+    """Cause of exceptions raised in a worker process, carries the formatted traceback from the worker"""
+
+    def __str__(self) -> str:
+        return self.args[0]
+
+
+class OrderedExecutor:
+    """
+    Runs work with the same key serially, in submission order, while work with different keys runs in parallel.
+
+    Keys are hashed onto a fixed number of lanes. Each lane holds a queue and occupies at most one thread of the
+    underlying executor at a time, so the lane count caps how many keys are processed at once. Submissions are never
+    refused, since that would reorder them. A lane holding max_lane_depth waiting submissions is full, callers check
+    `full` and stop submitting until `on_available` is called.
+    """
+
+    def __init__(
+        self, executor: Executor, lanes: int, max_lane_depth: int = 100, on_available: Optional[Callable[[], None]] = None
+    ) -> None:
+        """
+        :param executor: Executor the lanes run on
+        :param lanes: Number of lanes keys are spread over
+        :param max_lane_depth: Waiting submissions that make a lane full
+        :param on_available: Called from the worker thread when a lane drops below max_lane_depth waiting submissions
+        """
+        super().__init__()
+
+        if lanes < 1:
+            raise ValueError("lanes must be at least 1")
+        self._executor = executor
+        self._max_lane_depth = max_lane_depth
+        self._on_available = on_available
+        self._lanes: List[Deque[Tuple[Future, Callable, tuple]]] = [deque() for _ in range(lanes)]
+        self._running = [False] * lanes
+        self._lock = threading.Lock()
+
+    def lane(self, key: Any) -> int:
+        """:returns: The index of the lane the key is processed on. Stable across processes, unlike hash()"""
+        return zlib.crc32(str(key).encode("utf-8")) % len(self._lanes)
+
+    def submit(self, key: Any, fn: Callable, *args) -> Future:
+        """
+        Queues fn(*args) behind earlier submissions with the same key, even if the lane is full.
+
+        :raises RuntimeError: if the underlying executor has been shut down
+        :returns: Future resolved with the result of fn
+        """
+        index = self.lane(key)
+        future: Future = Future()
+        with self._lock:
+            lane = self._lanes[index]
+            lane.append((future, fn, args))
+            if self._running[index]:
+                return future
+            self._running[index] = True
+
+        try:
+            self._executor.submit(self._run_lane, index)
+        except RuntimeError:
+            with self._lock:
+                lane.remove((future, fn, args))
+                self._running[index] = False
+            raise
+        return future
+
+    def full(self, key: Any = None) -> bool:
+        """
+        :param key: Only check the lane of this key. Checks every lane when None
+
+        :returns: True if the lane holds max_lane_depth or more waiting submissions
+        """
+        with self._lock:
+            if key is not None:
+                return len(self._lanes[self.lane(key)]) >= self._max_lane_depth
+            return any(len(lane) >= self._max_lane_depth for lane in self._lanes)
+
+    def _run_lane(self, index: int) -> None:
+        """Runs the submissions of the lane until it is empty"""
+        lane = self._lanes[index]
+        while True:
+            with self._lock:
+                if not lane:
+                    self._running[index] = False
+                    return
+                future, fn, args = lane.popleft()
+                available = len(lane) == self._max_lane_depth - 1
+            if available and self._on_available is not None:
+                self._on_available()
+            # skips submissions cancelled while waiting
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                result = fn(*args)
+            except BaseException as ex:  # pylint: disable=broad-except
+                future.set_exception(ex)
+            else:
+                future.set_result(result)
+
+    def __len__(self) -> int:
+        """:returns: The number of submissions waiting across all lanes"""
+        with self._lock:
+            return sum(len(lane) for lane in self._lanes)
+
+
+class PriorityExecutor:
+    """
+    Runs the highest priority submission first, in arrival order within a priority.
+
+    Every submission schedules one job on the underlying executor. Jobs do not carry work, each one runs whichever
+    submission has the highest priority when a thread becomes free, so priorities are honoured however the underlying
+    executor queues its jobs. With aging, waiting submissions gain one priority level every `aging_seconds` so low
+    priorities are not starved by a steady stream of high priority ones.
+    """
+
+    def __init__(self, executor: Executor, aging_seconds: Optional[float] = None, depth_gauge: Optional[Gauge] = None) -> None:
+        """
+        :param executor: Executor the submissions run on
+        :param aging_seconds: Seconds of waiting that raise a submission by one priority level. None disables aging
+        :param depth_gauge: Gauge with a 'priority' label set to the number of waiting submissions per priority
+        """
+        super().__init__()
+
+        self._executor = executor
+        self._aging_seconds = aging_seconds
+        self._depth_gauge = depth_gauge
+        # (sort key, arrival sequence, priority, future, fn, args)
+        self._heap: List[Tuple[float, int, int, Future, Callable, tuple]] = []
+        self._sequence = itertools.count()
+        self._lock = threading.Lock()
+
+    def _sort_key(self, priority: int) -> float:
+        """
+        Smaller keys run first. Aging raises every waiting submission at the same rate, so comparing
+        priority + waited / aging_seconds only depends on the arrival time and the heap never needs reordering.
+        """
+        if self._aging_seconds is None:
+            return -priority
+        return time.monotonic() / self._aging_seconds - priority
+
+    def submit(self, priority: Optional[int], fn: Callable, *args) -> Future:
+        """
+        Queues fn(*args) by priority.
+
+        :param priority: Priority of the submission, higher runs first. None is treated as 0
+        :raises RuntimeError: if the underlying executor has been shut down
+        :returns: Future resolved with the result of fn
+        """
+        priority = priority or 0
+        future: Future = Future()
+        item = (self._sort_key(priority), next(self._sequence), priority, future, fn, args)
+        with self._lock:
+            heapq.heappush(self._heap, item)
+        self._update_depth(priority, 1)
+        try:
+            self._executor.submit(self._run_next)
+        except RuntimeError:
+            with self._lock:
+                # a job submitted earlier may have already taken it
+                if item in self._heap:
+                    self._heap.remove(item)
+                    heapq.heapify(self._heap)
+            self._update_depth(priority, -1)
+            raise
+        return future
+
+    def _run_next(self) -> None:
+        """Runs the submission with the highest priority"""
+        with self._lock:
+            _, _, priority, future, fn, args = heapq.heappop(self._heap)
+        self._update_depth(priority, -1)
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            result = fn(*args)
+        except BaseException as ex:  # pylint: disable=broad-except
+            future.set_exception(ex)
+        else:
+            future.set_result(result)
+
+    def _update_depth(self, priority: int, change: int) -> None:
+        """Updates the queue depth gauge of the priority"""
+        if self._depth_gauge is not None:
+            self._depth_gauge.inc(change, priority=str(priority))
+
+    def __len__(self) -> int:
+        """:returns: The number of waiting submissions"""
+        with self._lock:
+            return len(self._heap)
+
+
+def _process_worker(conn: Connection) -> None:
+    """Worker process loop. Runs one (fn, args) job at a time and sends back ('ok', result) or ('error', exception, traceback)"""
+    # the parent decides when to stop, an interrupt sent to the process group must not kill in-flight work
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    while True:
+        try:
+            job = conn.recv()
+        except EOFError:
+            return
+        if job is None:
+            return
+        fn, args = job
+        try:
+            reply = ("ok", fn(*args))
+        except BaseException as ex:  # pylint: disable=broad-except
+            reply = ("error", ex, traceback.format_exc())
+        try:
+            conn.send(reply)
+        except Exception as ex:  # pylint: disable=broad-except
+            # the result or exception could not be pickled, nothing was written yet
+            conn.send(("error", RuntimeError(f"Could not send the result to the parent process: {ex}"), traceback.format_exc()))
+
+
+class PreforkExecutor:
+    """
+    Runs submissions in a pool of worker processes, for CPU bound callbacks that do not benefit from threads.
+
+    Each worker process has its own pipe and a thread in this process that feeds it one submission at a time. Unlike
+    ProcessPoolExecutor, a worker that dies only fails the submission it was running, the worker is replaced and the
+    rest of the pool keeps going. Functions and arguments must be picklable, so functions must be defined at module level.
+    """
+
+    def __init__(self, processes: int, mp_context: str = "spawn") -> None:
+        """
+        :param processes: Number of worker processes
+        :param mp_context: multiprocessing start method. spawn is the default since forking a process with running threads is unsafe
+        """
+        super().__init__()
+
+        if processes < 1:
+            raise ValueError("processes must be at least 1")
+        self._context = multiprocessing.get_context(mp_context)
+        self._jobs: "queue.SimpleQueue[Optional[Tuple[Future, Callable, tuple]]]" = queue.SimpleQueue()
+        self._shutdown = False
+        self._shutdown_lock = threading.Lock()
+        self._dispatchers = [
+            threading.Thread(target=self._dispatch, name=f"prefork-dispatcher-{index}", daemon=True) for index in range(processes)
+        ]
+        for dispatcher in self._dispatchers:
+            dispatcher.start()
+
+    def _start_worker(self) -> Tuple[BaseProcess, Connection]:
+        """Starts a worker process connected by a pipe"""
+        parent_conn, child_conn = self._context.Pipe()
+        process = self._context.Process(target=_process_worker, args=(child_conn,), daemon=True)
+        process.start()
+        child_conn.close()
+        return process, parent_conn
+
+    def _dispatch(self) -> None:
+        """Feeds submissions to one worker process, replacing it if it dies"""
+        process, conn = self._start_worker()
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                try:
+                    conn.send(None)
+                except OSError:
+                    pass
+                process.join()
+                conn.close()
+                return
+
+            future, fn, args = job
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                conn.send((fn, args))
+                reply = conn.recv()
+            except (EOFError, OSError):
+                process.join()
+                future.set_exception(WorkerCrashedException(f"Worker process {process.pid} exited with code {process.exitcode}"))
+                conn.close()
+                process, conn = self._start_worker()
+                continue
+            except Exception as ex:  # pylint: disable=broad-except
+                # the job could not be pickled, or the reply could not be unpickled
+                future.set_exception(ex)
+                continue
+
+            if reply[0] == "ok":
+                future.set_result(reply[1])
+            else:
+                ex = reply[1]
+                ex.__cause__ = RemoteTraceback(reply[2])
+                future.set_exception(ex)
+
+    def submit(self, fn: Callable, *args) -> Future:
+        """
+        Queues fn(*args) to run in a worker process.
+
+        :raises RuntimeError: if the executor has been shut down
+        :returns: Future resolved with the result of fn, or WorkerCrashedException if the worker died running it
+        """
+        future: Future = Future()
+        with self._shutdown_lock:
+            if self._shutdown:
+                raise RuntimeError("cannot schedule new futures after shutdown")
+            self._jobs.put((future, fn, args))
+        return future
+
+    def shutdown(self, wait: bool = True) -> None:
+        """
+        Stops the workers once the queued submissions have run.
+
+        :param wait: Block until the worker processes have exited
+        """
+        with self._shutdown_lock:
+            if self._shutdown:
+                return
+            self._shutdown = True
+            for _ in self._dispatchers:
+                self._jobs.put(None)
+        if wait:
+            for dispatcher in self._dispatchers:
+                dispatcher.join()
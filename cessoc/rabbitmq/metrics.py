@@ -0,0 +1,282 @@
+"""Lightweight metrics with Prometheus text exposition for Eventhub services"""
+
+import abc
+import bisect
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Sequence, Tuple
+
+
+# seconds, from fast in-memory handlers to slow enrichment calls
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+# compressed size over original size
+COMPRESSION_RATIO_BUCKETS = (0.05, 0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 1.0)
+
+
+def _escape(value: str) -> str:
+    """Escapes a label value for the Prometheus text format"""
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    """Formats label names and values as {name="value",...}"""
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric(abc.ABC):
+    """Base class for metrics with labels. Label values are passed as keyword arguments."""
+
+    metric_type = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> None:
+        """
+        :param name: Metric name
+        :param documentation: Help text of the metric
+        :param labelnames: Names of the labels every sample has
+        """
+        super().__init__()
+
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        """Label values in label name order"""
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    @abc.abstractmethod
+    def _samples(self) -> List[str]:
+        """:returns: The sample lines of the metric in Prometheus text format"""
+
+    def render(self) -> str:
+        """:returns: The metric in Prometheus text format"""
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.metric_type}"]
+        lines.extend(self._samples())
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    """Monotonically increasing value"""
+
+    metric_type = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> None:
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        """
+        :param amount: Amount to add
+        :param labels: Label values of the sample
+        """
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def get(self, **labels: str) -> float:
+        """:returns: The current value of the sample"""
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            values = list(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {value}" for key, value in values]
+
+
+class Gauge(Counter):
+    """Value that can go up and down"""
+
+    metric_type = "gauge"
+
+    def set(self, value: float, **labels: str) -> None:
+        """
+        :param value: New value
+        :param labels: Label values of the sample
+        """
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def dec(self, amount: float = 1, **labels: str) -> None:
+        """
+        :param amount: Amount to subtract
+        :param labels: Label values of the sample
+        """
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    """Distribution of observed values in cumulative buckets"""
+
+    metric_type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS) -> None:
+        """:param buckets: Upper bounds of the buckets, in increasing order"""
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+        # per label values: count per bucket with a final +Inf bucket, sum of observations
+        self._values: Dict[Tuple[str, ...], Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        """
+        :param value: Observed value
+        :param labels: Label values of the sample
+        """
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            if key not in self._values:
+                self._values[key] = ([0] * (len(self.buckets) + 1), [0.0])
+            counts, total = self._values[key]
+            counts[index] += 1
+            total[0] += value
+
+    def count(self, **labels: str) -> int:
+        """:returns: The number of observations of the sample"""
+        with self._lock:
+            counts, _ = self._values.get(self._key(labels), ([0], [0.0]))
+            return sum(counts)
+
+    def totals(self) -> Tuple[int, float]:
+        """:returns: The number and sum of observations across all label values"""
+        with self._lock:
+            return sum(sum(counts) for counts, _ in self._values.values()), sum(total[0] for _, total in self._values.values())
+
+    def _samples(self) -> List[str]:
+        lines = []
+        with self._lock:
+            values = [(key, list(counts), total[0]) for key, (counts, total) in self._values.items()]
+        for key, counts, total in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = 'le="+Inf"' if bound == float("inf") else f'le="{bound!r}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {cumulative}")
+        return lines
+
+
+class MetricsRegistry:
+    """Collection of metrics rendered together"""
+
+    def __init__(self) -> None:
+        """Initialize an empty registry"""
+        super().__init__()
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric: _Metric) -> _Metric:
+        """Adds the metric, returning the existing one if a metric with the same name is registered"""
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        """:returns: A new or the already registered counter"""
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        """:returns: A new or the already registered gauge"""
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        """:returns: A new or the already registered histogram"""
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        """:returns: Every metric in Prometheus text format"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return "\n".join(metric.render() for metric in metrics) + "\n"
+
+
+class EventhubMetrics:
+    """The metrics recorded by an Eventhub"""
+
+    def __init__(self, registry: Optional[MetricsRegistry] = None) -> None:
+        """:param registry: Registry to add the metrics to. A new registry is created when not set"""
+        super().__init__()
+
+        self.registry = registry if registry is not None else MetricsRegistry()
+        labels = ("queue", "routing_key")
+        self.received = self.registry.counter("cessoc_eventhub_messages_received_total", "Messages delivered to the service", labels)
+        self.acked = self.registry.counter("cessoc_eventhub_messages_acked_total", "Messages acknowledged after processing", labels)
+        self.rejected = self.registry.counter("cessoc_eventhub_messages_rejected_total", "Messages rejected", labels)
+        self.replies = self.registry.counter("cessoc_eventhub_replies_sent_total", "Replies sent to requesters", labels)
+        self.retried = self.registry.counter("cessoc_eventhub_messages_retried_total", "Failed messages sent to a retry queue", labels)
+        self.dedup_hits = self.registry.counter("cessoc_eventhub_dedup_hits_total", "Messages acknowledged without processing because they were processed before", ("queue",))
+        self.dedup_misses = self.registry.counter("cessoc_eventhub_dedup_misses_total", "Messages looked up in the dedup store and not found", ("queue",))
+        self.handler_seconds = self.registry.histogram("cessoc_eventhub_handler_seconds", "Wall clock time spent in message callbacks", labels)
+        self.queued_seconds = self.registry.histogram("cessoc_eventhub_queued_seconds", "Time messages waited for a worker before their callback started", ("queue",))
+        self.in_flight = self.registry.gauge("cessoc_eventhub_in_flight", "Messages handed to workers that have not finished yet")
+        self.ioloop_lag = self.registry.gauge("cessoc_eventhub_ioloop_lag_seconds", "How late the last ioloop lag probe timer fired")
+        self.drain_seconds = self.registry.gauge("cessoc_eventhub_drain_seconds", "How long the last shutdown waited for in-flight messages")
+        self.prefetch_count = self.registry.gauge("cessoc_eventhub_prefetch_count", "Prefetch count the consumers are using")
+        self.priority_queue_depth = self.registry.gauge("cessoc_eventhub_priority_queue_depth", "Messages waiting for a worker per message priority", ("priority",))
+        self.reconnects = self.registry.counter("cessoc_eventhub_reconnects_total", "Attempts to reconnect to the broker after the connection was lost")
+        self.publish_buffer_depth = self.registry.gauge("cessoc_eventhub_publish_buffer_depth", "Publishes waiting for the channel to open")
+        self.publishes_dropped = self.registry.counter("cessoc_eventhub_publishes_dropped_total", "Publishes dropped because the channel was closed and the publish buffer or spool was full")
+        self.topology_seconds = self.registry.gauge("cessoc_eventhub_topology_seconds", "How long declaring the exchanges, queues and bindings took the last time the channel opened")
+        self.startup_seconds = self.registry.gauge("cessoc_eventhub_startup_seconds", "Seconds from the connection opening until every consumer was started, the last time the service became ready")
+        self.spool_depth = self.registry.gauge("cessoc_eventhub_spool_depth", "Publishes in the disk spool waiting to be sent or confirmed")
+        self.compressed_bytes_in = self.registry.counter("cessoc_eventhub_compression_input_bytes_total", "Bytes of published bodies before compression, of bodies over the compression threshold")
+        self.compressed_bytes_out = self.registry.counter("cessoc_eventhub_compression_output_bytes_total", "Bytes of the same bodies as published, compressed or not")
+        self.compression_ratio = self.registry.histogram(
+            "cessoc_eventhub_compression_ratio", "Compressed size over original size of published bodies over the compression threshold", buckets=COMPRESSION_RATIO_BUCKETS
+        )
+        self.claim_checks_stored = self.registry.counter("cessoc_eventhub_claim_checks_stored_total", "Published bodies stored in S3 with only a claim check sent to the broker")
+        self.claim_check_bytes = self.registry.counter("cessoc_eventhub_claim_check_bytes_total", "Bytes of published bodies stored in S3")
+        self.claim_checks_fetched = self.registry.counter("cessoc_eventhub_claim_checks_fetched_total", "Received bodies fetched from S3 by their claim check")
+
+
+class MetricsServer:
+    """Serves the registry at /metrics on a background thread"""
+
+    def __init__(self, registry: MetricsRegistry, port: int, host: str = "0.0.0.0") -> None:  # nosec
+        """
+        :param registry: Registry to serve
+        :param port: Port to listen on. 0 picks a free port
+        :param host: Address to listen on
+        """
+        super().__init__()
+
+        class Handler(BaseHTTPRequestHandler):
+            """Responds to GET /metrics"""
+
+            def do_GET(self) -> None:  # pylint: disable=invalid-name
+                """Renders the registry"""
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = registry.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *_unused) -> None:
+                """Scrapes are not logged"""
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, name="metrics-server", daemon=True)
+
+    @property
+    def port(self) -> int:
+        """The port the server is listening on"""
+        return self._server.server_address[1]
+
+    def start(self) -> None:
+        """Starts serving on the background thread"""
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stops serving and closes the socket"""
+        self._server.shutdown()
+        self._server.server_close()
@@ -0,0 +1,111 @@
+"""Adaptive prefetch count tuning for Eventhub consumers"""
+
+import threading
+from typing import Optional
+
+
+class PrefetchTuner:
+    """
+    Adjusts the prefetch count with additive increase, multiplicative decrease (AIMD).
+
+    Every interval the Eventhub reports the handler latency and the time messages waited for a worker. The prefetch
+    count shrinks multiplicatively when prefetched messages wait locally for a large share of their processing time
+    (the service hoards messages other replicas could process) or when handler latency climbs well above the lowest
+    latency seen (downstream services are congested). It grows additively while every prefetched message is in use and
+    throughput is holding up, so workers are not left waiting on the network round trip to the broker.
+    """
+
+    def __init__(
+        self,
+        initial: int,
+        minimum: int = 1,
+        maximum: int = 100,
+        increase: int = 1,
+        decrease_factor: float = 0.5,
+        max_wait_ratio: float = 0.5,
+        latency_tolerance: float = 2.0,
+    ) -> None:
+        """
+        :param initial: Prefetch count to start with, clamped to the bounds
+        :param minimum: Lowest prefetch count
+        :param maximum: Highest prefetch count
+        :param increase: Added to the prefetch count when workers are saturated
+        :param decrease_factor: The prefetch count is multiplied by this when backing off
+        :param max_wait_ratio: Back off when messages wait for a worker longer than this share of their handler latency
+        :param latency_tolerance: Back off when handler latency exceeds this multiple of the lowest latency seen
+        """
+        super().__init__()
+
+        if not 1 <= minimum <= maximum:
+            raise ValueError("Prefetch bounds must satisfy 1 <= minimum <= maximum")
+        if not 0 < decrease_factor < 1:
+            raise ValueError("decrease_factor must be between 0 and 1")
+        self.minimum = minimum
+        self.maximum = maximum
+        self._current = max(minimum, min(maximum, initial))
+        self._increase = increase
+        self._decrease_factor = decrease_factor
+        self._max_wait_ratio = max_wait_ratio
+        self._latency_tolerance = latency_tolerance
+
+        self._lock = threading.Lock()
+        self._peak_in_flight = 0
+        # histogram totals at the previous update, to compute per interval averages
+        self._handler_count = 0
+        self._handler_sum = 0.0
+        self._queued_count = 0
+        self._queued_sum = 0.0
+        self._last_completed = 0
+        self._baseline_latency: Optional[float] = None
+
+    @property
+    def current(self) -> int:
+        """The prefetch count to use"""
+        return self._current
+
+    def record_in_flight(self, in_flight: float) -> None:
+        """
+        Called when a message is delivered.
+
+        :param in_flight: Messages currently being processed
+        """
+        with self._lock:
+            self._peak_in_flight = max(self._peak_in_flight, in_flight)
+
+    def update(self, handler_count: int, handler_sum: float, queued_count: int, queued_sum: float) -> int:
+        """
+        Evaluates the interval since the previous update.
+
+        :param handler_count: Total messages processed
+        :param handler_sum: Total seconds spent in callbacks
+        :param queued_count: Total messages that started on a worker
+        :param queued_sum: Total seconds messages waited for a worker
+        :returns: The new prefetch count
+        """
+        with self._lock:
+            completed = handler_count - self._handler_count
+            latency = (handler_sum - self._handler_sum) / completed if completed else 0.0
+            started = queued_count - self._queued_count
+            wait = (queued_sum - self._queued_sum) / started if started else 0.0
+            saturated = self._peak_in_flight >= self._current
+            self._handler_count, self._handler_sum = handler_count, handler_sum
+            self._queued_count, self._queued_sum = queued_count, queued_sum
+            self._peak_in_flight = 0
+            if completed == 0:
+                # idle, or every worker is stuck on a slow message. neither says anything about the right prefetch
+                return self._current
+
+            # the baseline creeps up 1% per interval so a permanent change in latency is eventually accepted
+            if self._baseline_latency is None or latency < self._baseline_latency:
+                self._baseline_latency = latency
+            else:
+                self._baseline_latency *= 1.01
+            hoarding = wait > self._max_wait_ratio * latency
+            congested = latency > self._latency_tolerance * self._baseline_latency
+
+            if hoarding or congested:
+                self._current = max(self.minimum, int(self._current * self._decrease_factor))
+            elif saturated and completed >= 0.9 * self._last_completed:
+                self._current = min(self.maximum, self._current + self._increase)
+            self._last_completed = completed
+            return self._current
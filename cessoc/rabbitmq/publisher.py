@@ -0,0 +1,386 @@
+"""Reusable publisher for ETLs that send many messages to the eventhub"""
+
+import os
+import queue
+import ssl
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple, Union
+
+import pika
+from pika.adapters.blocking_connection import BlockingChannel, BlockingConnection
+
+from cessoc.aws import ssm
+from cessoc.compression import decompress
+from cessoc.logging import cessoc_logging
+from cessoc.serialization import JsonCodec, get_codec
+
+
+# RabbitMQ pseudo-queue that routes replies straight back to the consuming channel. https://www.rabbitmq.com/direct-reply-to.html
+DIRECT_REPLY_TO = "amq.rabbitmq.reply-to"
+
+
+class Publisher:
+    """
+    Publishes messages to the eventhub over a pool of reusable connections.
+
+    Credentials and the endpoint are fetched from parameter store once, connections and channels are kept open between
+    calls and exchanges are only passively declared the first time they are used. Each pooled connection is used by
+    one thread at a time, so a Publisher can be shared between threads.
+
+    Requires access to `/ces/eventhub/secrets/edm/credentials` and `/ces/eventhub/config/mq_endpoint` in parameter store
+    unless `json_credentials` and `endpoint` are given.
+    """
+
+    def __init__(
+        self,
+        service_name: str,
+        exchange: Optional[str] = None,
+        json_credentials: Optional[Dict] = None,
+        endpoint: Optional[str] = None,
+        pool_size: int = 4,
+        heartbeat: int = 60,
+        codec: Optional[Union[str, JsonCodec]] = None,
+        confirm_delivery: bool = False,
+    ) -> None:
+        """
+        :param service_name: Name of the service, used as the connection name and the message app ID
+        :param exchange: Default exchange to publish to. If not set then the campus environment variable will be used
+        :param json_credentials: Dict with the MQ `username` and `password`. Fetched from parameter store when not set
+        :param endpoint: The MQ endpoint. Fetched from parameter store when not set
+        :param pool_size: Most connections open at once, which is also how many threads can publish at the same time
+        :param heartbeat: The number of seconds in between heartbeats
+        :param codec: JSON codec used to encode message bodies. Defaults to the standard library
+        :param confirm_delivery: Wait for the broker to confirm each message. Unroutable messages then raise `UnroutableError`
+        """
+        super().__init__()
+
+        self._logger = cessoc_logging.getLogger("cessoc")
+        self.service_name = service_name
+        self.exchange = exchange
+        self.heartbeat = heartbeat
+        self.confirm_delivery = confirm_delivery
+        self._codec = get_codec(codec)
+
+        # fetched on first use and cached for the lifetime of the publisher
+        self._json_credentials = json_credentials
+        self._endpoint = endpoint
+        self._settings_lock = threading.Lock()
+
+        # idle connections, most recently used first. the semaphore bounds how many are checked out or idle at once
+        self._pool: "queue.LifoQueue[Tuple[BlockingConnection, BlockingChannel]]" = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(pool_size)
+
+        # exchanges that have already been passively declared
+        self._declared_exchanges: Set[str] = set()
+
+    def __enter__(self) -> "Publisher":
+        return self
+
+    def __exit__(self, *_unused) -> None:
+        self.close()
+
+    def publish(
+        self,
+        routing_key: str,
+        body: Union[Dict, List],
+        exchange: Optional[str] = None,
+        correlation_id: Optional[str] = None,
+        headers: Optional[Dict] = None,
+        priority: Optional[int] = None,
+    ) -> str:
+        """
+        Publishes one message.
+
+        :param routing_key: The routing key to send the message to
+        :param body: The body of the message to send
+        :param exchange: The exchange to publish to. Defaults to the publisher exchange
+        :param correlation_id: The message correlation ID to use
+        :param headers: Headers to add to the message properties
+        :param priority: The priority of the message
+
+        :returns: The correlation ID of the message
+        """
+        return self.publish_many(routing_key, [body], exchange, headers=headers, priority=priority, correlation_ids=[correlation_id])[0]
+
+    def publish_many(
+        self,
+        routing_key: str,
+        bodies: Iterable[Union[Dict, List]],
+        exchange: Optional[str] = None,
+        headers: Optional[Dict] = None,
+        priority: Optional[int] = None,
+        correlation_ids: Optional[List[Optional[str]]] = None,
+    ) -> List[str]:
+        """
+        Publishes every message over one pooled connection.
+
+        :param routing_key: The routing key to send the messages to
+        :param bodies: The bodies of the messages to send
+        :param exchange: The exchange to publish to. Defaults to the publisher exchange
+        :param headers: Headers to add to the properties of every message
+        :param priority: The priority of the messages
+        :param correlation_ids: The correlation ID to use for each message. Generated when not set
+
+        :returns: The correlation IDs of the messages, in order
+        """
+        exchange = self._exchange(exchange)
+        bodies = list(bodies)
+        if correlation_ids is None:
+            correlation_ids = [None] * len(bodies)
+        correlation_ids = [correlation_id or uuid.uuid4().hex for correlation_id in correlation_ids]
+        published = 0
+
+        def publish(channel: BlockingChannel) -> None:
+            nonlocal published
+            self._ensure_exchange(channel, exchange)
+            # resumes where it left off when retried on a new connection
+            for body, correlation_id in zip(bodies[published:], correlation_ids[published:]):
+                try:
+                    channel.basic_publish(
+                        exchange,
+                        routing_key,
+                        self._codec.dumps(body),
+                        self._properties(correlation_id, headers=headers, priority=priority),
+                        mandatory=True,
+                    )
+                except pika.exceptions.UnroutableError:
+                    self._logger.error("Message was unroutable")
+                published += 1
+
+        self._with_channel(publish)
+        self._logger.info(
+            "Published %s messages to exchange '%s' with routing key '%s'", len(bodies), exchange, routing_key
+        )
+        return correlation_ids
+
+    def request(
+        self,
+        routing_key: str,
+        body: Union[Dict, List],
+        exchange: Optional[str] = None,
+        timeout: float = 300,
+        priority: Optional[int] = None,
+    ) -> Optional[Any]:
+        """
+        Publishes a request and blocks until its reply is received.
+
+        :param routing_key: The routing key to send the request to
+        :param body: The body of the request
+        :param exchange: The exchange to publish to. Defaults to the publisher exchange
+        :param timeout: Seconds to wait for the reply
+        :param priority: The priority of the request
+
+        :returns: The decoded reply, None if it timed out
+        """
+        return self.request_many(routing_key, [body], exchange, timeout=timeout, priority=priority)[0]
+
+    def request_many(
+        self,
+        routing_key: str,
+        bodies: Iterable[Union[Dict, List]],
+        exchange: Optional[str] = None,
+        timeout: float = 300,
+        priority: Optional[int] = None,
+    ) -> List[Optional[Any]]:
+        """
+        Publishes several requests at once and blocks until all of their replies are received or the timeout passes.
+
+        Replies come back through RabbitMQ direct reply-to on the same pooled connection and are matched to their
+        request by correlation ID, so no reply queue is declared and the broker is not polled. If the connection is lost
+        the requests not sent yet are sent on a new one. Requests already sent are not sent again, their replies are lost
+        with the connection so they return None.
+
+        :param routing_key: The routing key to send the requests to
+        :param bodies: The bodies of the requests
+        :param exchange: The exchange to publish to. Defaults to the publisher exchange
+        :param timeout: Seconds to wait for all of the replies
+        :param priority: The priority of the requests
+
+        :returns: The decoded replies in the order of the requests, None for requests that timed out
+        """
+        exchange = self._exchange(exchange)
+        bodies = list(bodies)
+        correlation_ids = [uuid.uuid4().hex for _ in bodies]
+        pending = set(correlation_ids)
+        replies: Dict[str, Any] = {}
+        published = 0
+
+        def on_reply(_unused_channel, _unused_method, properties: pika.BasicProperties, reply_body: bytes) -> None:
+            if properties.correlation_id not in pending:
+                self._logger.debug("Ignoring reply with unknown correlation id: %s", properties.correlation_id)
+                return
+            self._logger.info("Reply received with correlation id: %s", properties.correlation_id)
+            pending.discard(properties.correlation_id)
+            # replies from an Eventhub with compression enabled may be compressed
+            replies[properties.correlation_id] = self._codec.loads(decompress(reply_body, properties.content_encoding))
+
+        def request(channel: BlockingChannel) -> None:
+            nonlocal published
+            # retried on a new connection. direct reply-to replies only come back on the channel that sent the request
+            lost = pending.intersection(correlation_ids[:published])
+            if lost:
+                self._logger.warning("Connection lost before %s replies were received", len(lost))
+                pending.difference_update(lost)
+            self._ensure_exchange(channel, exchange)
+            # the reply consumer must exist before publishing with direct reply-to, replies are not acknowledged
+            consumer_tag = channel.basic_consume(DIRECT_REPLY_TO, on_reply, auto_ack=True)
+            try:
+                # Removing the Reply-To-Callback header errors out the replying EDM
+                headers = {"Reply-To-Callback": "inline_blocking"}
+                # resumes where it left off when retried on a new connection
+                for body, correlation_id in zip(bodies[published:], correlation_ids[published:]):
+                    try:
+                        channel.basic_publish(
+                            exchange,
+                            routing_key,
+                            self._codec.dumps(body),
+                            self._properties(correlation_id, reply_to=DIRECT_REPLY_TO, headers=headers, priority=priority),
+                            mandatory=True,
+                        )
+                    except pika.exceptions.UnroutableError:
+                        self._logger.error("Message was unroutable")
+                        pending.discard(correlation_id)
+                    published += 1
+
+                deadline = time.monotonic() + timeout
+                while pending:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    # returns as soon as a reply has been dispatched or the time limit passes
+                    channel.connection.process_data_events(time_limit=remaining)
+            finally:
+                if channel.is_open:
+                    channel.basic_cancel(consumer_tag)
+
+        self._with_channel(request)
+        for correlation_id in correlation_ids:
+            if correlation_id not in replies:
+                self._logger.error("Message timed out before a reply was received, correlation id: %s", correlation_id)
+        return [replies.get(correlation_id) for correlation_id in correlation_ids]
+
+    def close(self) -> None:
+        """Closes every idle pooled connection"""
+        while True:
+            try:
+                connection, _ = self._pool.get_nowait()
+            except queue.Empty:
+                return
+            self._close(connection)
+
+    def _exchange(self, exchange: Optional[str]) -> str:
+        """Returns the exchange to publish to"""
+        if exchange is not None:
+            return exchange
+        if self.exchange is not None:
+            return self.exchange
+        # if there is no exchange, use the campus environment variable
+        return os.getenv("CAMPUS").lower()
+
+    def _properties(
+        self, correlation_id: str, reply_to: Optional[str] = None, headers: Optional[Dict] = None, priority: Optional[int] = None
+    ) -> pika.BasicProperties:
+        """Builds the message properties"""
+        return pika.BasicProperties(
+            app_id=self.service_name,
+            user_id=self._settings()[0]["username"],
+            content_type="application/json",
+            content_encoding="utf-8",
+            reply_to=reply_to,
+            correlation_id=correlation_id,
+            priority=priority,
+            headers=headers,
+        )
+
+    def _settings(self) -> Tuple[Dict, str]:
+        """Returns the cached credentials and endpoint, fetching them from parameter store the first time"""
+        with self._settings_lock:
+            if not self._json_credentials:
+                self._json_credentials = ssm.get_value("/ces/eventhub/secrets/edm/credentials")
+            if not self._endpoint:
+                self._endpoint = ssm.get_value("/ces/eventhub/config/mq_endpoint")
+            return self._json_credentials, self._endpoint
+
+    def _connect(self) -> Tuple[BlockingConnection, BlockingChannel]:
+        """Opens a new connection and channel"""
+        json_credentials, endpoint = self._settings()
+        credentials = pika.PlainCredentials(json_credentials["username"], json_credentials["password"])
+        connection = pika.BlockingConnection(
+            pika.ConnectionParameters(
+                endpoint,
+                credentials=credentials,
+                heartbeat=self.heartbeat,
+                ssl_options=pika.SSLOptions(context=ssl.create_default_context()),
+                client_properties={"connection_name": self.service_name},
+            )
+        )
+        channel = connection.channel()
+        if self.confirm_delivery:
+            channel.confirm_delivery()
+        self._logger.debug("Opened pooled connection to %s", endpoint)
+        return connection, channel
+
+    @contextmanager
+    def _acquire(self) -> Iterator[Tuple[BlockingConnection, BlockingChannel]]:
+        """Checks a healthy connection out of the pool, opening one if none are idle"""
+        self._slots.acquire()  # pylint: disable=consider-using-with
+        connection = None
+        broken = False
+        try:
+            while connection is None:
+                try:
+                    connection, channel = self._pool.get_nowait()
+                except queue.Empty:
+                    connection, channel = self._connect()
+                    break
+                try:
+                    # services heartbeats missed while idle and surfaces connections the broker has closed
+                    connection.process_data_events(time_limit=0)
+                except pika.exceptions.AMQPError:
+                    self._close(connection)
+                    connection = None
+                    continue
+                if connection.is_closed or channel.is_closed:
+                    self._close(connection)
+                    connection = None
+            yield connection, channel
+        except (pika.exceptions.AMQPConnectionError, pika.exceptions.AMQPChannelError):
+            broken = True
+            raise
+        finally:
+            if connection is not None:
+                if broken:
+                    # don't return broken connections to the pool
+                    self._close(connection)
+                else:
+                    self._pool.put((connection, channel))
+            self._slots.release()
+
+    def _with_channel(self, fn: Callable[[BlockingChannel], None]) -> None:
+        """Runs the function with a pooled channel, retrying once on a new connection if the connection was lost"""
+        try:
+            with self._acquire() as (_, channel):
+                fn(channel)
+        except (pika.exceptions.AMQPConnectionError, pika.exceptions.ChannelWrongStateError) as ex:
+            self._logger.warning("Pooled connection failed, retrying on a new connection: %s", ex)
+            with self._acquire() as (_, channel):
+                fn(channel)
+
+    def _ensure_exchange(self, channel: BlockingChannel, exchange: str) -> None:
+        """Passively declares the exchange the first time it is used"""
+        if exchange in self._declared_exchanges:
+            return
+        channel.exchange_declare(exchange, exchange_type="direct", passive=True, durable=True)
+        self._declared_exchanges.add(exchange)
+
+    @staticmethod
+    def _close(connection: BlockingConnection) -> None:
+        """Closes the connection, ignoring errors from connections that are already broken"""
+        try:
+            if connection.is_open:
+                connection.close()
+        except pika.exceptions.AMQPError:
+            pass
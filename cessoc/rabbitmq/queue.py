@@ -2,16 +2,32 @@
 
 from typing import List, Dict, Callable, Optional, Tuple, Union, Any
 from cessoc.rabbitmq.exchange import Exchange, ExchangeType
+from cessoc.rabbitmq.routing import RoutingIndex
 
 
 class QueueArguments:
     """Defines pika queue arguments attributes"""
 
-    def __init__(self, max_priority: Optional[int] = None) -> None:
-        """:param max_priority: Max priority of the queue. https://www.rabbitmq.com/priority.html"""
+    def __init__(
+        self,
+        max_priority: Optional[int] = None,
+        message_ttl: Optional[int] = None,
+        dead_letter_exchange: Optional[str] = None,
+        dead_letter_routing_key: Optional[str] = None,
+    ) -> None:
+        """
+        :param max_priority: Max priority of the queue. https://www.rabbitmq.com/priority.html
+        :param message_ttl: Milliseconds a message can wait in the queue before it expires. https://www.rabbitmq.com/ttl.html
+        :param dead_letter_exchange: Exchange rejected and expired messages are republished to. An empty string is the
+            default exchange. https://www.rabbitmq.com/dlx.html
+        :param dead_letter_routing_key: Routing key dead-lettered messages are republished with. Defaults to their own routing key
+        """
         super().__init__()
 
         self.max_priority = max_priority
+        self.message_ttl = message_ttl
+        self.dead_letter_exchange = dead_letter_exchange
+        self.dead_letter_routing_key = dead_letter_routing_key
 
     def __eq__(self, value: Any) -> bool:
         """
@@ -20,7 +36,12 @@ class QueueArguments:
         :returns: result of value check
         """
         if isinstance(value, QueueArguments):
-            return self is value or (self.max_priority == value.max_priority)
+            return self is value or (self.max_priority, self.message_ttl, self.dead_letter_exchange, self.dead_letter_routing_key) == (
+                value.max_priority,
+                value.message_ttl,
+                value.dead_letter_exchange,
+                value.dead_letter_routing_key,
+            )
         return False
 
     @property
@@ -29,6 +50,12 @@ class QueueArguments:
         attrs = {}
         if self.max_priority:
             attrs["x-max-priority"] = self.max_priority
+        if self.message_ttl is not None:
+            attrs["x-message-ttl"] = self.message_ttl
+        if self.dead_letter_exchange is not None:
+            attrs["x-dead-letter-exchange"] = self.dead_letter_exchange
+        if self.dead_letter_routing_key is not None:
+            attrs["x-dead-letter-routing-key"] = self.dead_letter_routing_key
         return attrs
 
     @property
@@ -42,6 +69,17 @@ class QueueArguments:
             raise ValueError("Max priority must be between 1 and 255")
         self._max_priority = value
 
+    @property
+    def message_ttl(self) -> Union[int, None]:
+        """Milliseconds a message can wait in the queue before it expires. https://www.rabbitmq.com/ttl.html"""
+        return self._message_ttl
+
+    @message_ttl.setter
+    def message_ttl(self, value: Optional[int]) -> None:
+        if value is not None and value < 0:
+            raise ValueError("Message TTL cannot be negative")
+        self._message_ttl = value
+
 
 class Queue:
     """Defines pika queue attributes"""
@@ -146,6 +184,9 @@ class QueueDefinitionManager:
 
         self.queue_bindings: Dict[str, List[Queue]] = {self.default_exchange: []}
 
+        # compiled routing indexes keyed by queue name, built on first use
+        self._routing_indexes: Dict[str, RoutingIndex] = {}
+
     def register_exchange(self, exchange: Union[Exchange, List[Exchange]]) -> None:
         """
         Registers a new exchange
@@ -221,8 +262,21 @@ class QueueDefinitionManager:
                         )
                     )
         self.queues[queue.name] = queue
+        self._routing_indexes.pop(queue.name, None)
         if exchanges:
             for e in exchanges:
                 self.queue_bindings[e].append(queue)
         else:
             self.queue_bindings[self.default_exchange].append(queue)
+
+    def routing_index(self, queue: Queue) -> RoutingIndex:
+        """
+        Returns the compiled routing index for the queue bindings. The index is cached until the queue is registered again.
+
+        :param queue: The registered queue
+        """
+        index = self._routing_indexes.get(queue.name)
+        if index is None:
+            index = RoutingIndex(queue.bindings)
+            self._routing_indexes[queue.name] = index
+        return index
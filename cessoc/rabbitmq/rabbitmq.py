@@ -1,5 +1,6 @@
 import ssl
 import functools
+import inspect
 import json
 import threading
 import os
@@ -7,23 +8,82 @@ import signal
 import time
 import traceback
 import uuid
+import warnings
+from concurrent.futures import CancelledError, Future
 from concurrent.futures.thread import ThreadPoolExecutor
-from typing import List, Dict, Callable, Union, Optional, Tuple
+from collections import deque
+from typing import Any, Deque, List, Dict, Callable, Iterable, NamedTuple, Set, Union, Optional, Tuple
 import pika
 
+from pika.adapters.select_connection import IOLoop
 from pika.channel import Channel
 from pika.connection import Connection
 from pika.spec import BasicProperties, Basic
 from pika.frame import Method
 
+from cessoc.rabbitmq.acks import AckCoalescer
+from cessoc.rabbitmq.claim_check import CLAIM_CHECK_HEADER, ClaimCheckException, ClaimCheckStore
+from cessoc.rabbitmq.confirms import ConfirmTracker, MessageNackedException, MessageReturnedException
+from cessoc.rabbitmq.dedup import DedupStore
+from cessoc.rabbitmq.delivery import PROPERTY_NAMES, DeliveryContext
 from cessoc.rabbitmq.queue import Queue, QueueDefinitionManager, QueueArguments
 from cessoc.rabbitmq.exchange import Exchange, ExchangeType
-from cessoc.aws import ssm
+from cessoc.rabbitmq.executors import OrderedExecutor, PreforkExecutor, PriorityExecutor
+from cessoc.rabbitmq.metrics import EventhubMetrics, MetricsServer
+from cessoc.rabbitmq.prefetch import PrefetchTuner
+from cessoc.rabbitmq.publisher import Publisher
+from cessoc.rabbitmq.reconnect import Backoff, BufferedPublish, PublishBuffer
+from cessoc.rabbitmq.retry import RETRY_ATTEMPT_HEADER, RETRY_EXCHANGE_HEADER, RETRY_ROUTING_KEY_HEADER, RetryPolicy
+from cessoc.rabbitmq.spool import Spool, SpoolFullException, SpoolPosition
+from cessoc.compression import IDENTITY_ENCODING, PLAIN_ENCODING, Compressor, DecompressionError, decompress, get_compressor, supported_encodings
+from cessoc.serialization import JSON_CONTENT_TYPE, SERIALIZERS, DeserializationError, JsonCodec, Serializer, get_codec, get_serializers
 from cessoc.logging import cessoc_logging
 
 
+# Reply-To-Callback header sent with requests from `Eventhub.request`. Replies are matched by correlation ID instead
+REQUEST_REPLY_CALLBACK = "Eventhub.request"
+# seconds between ioloop lag probes
+LAG_PROBE_INTERVAL = 1.0
+# seconds between adaptive prefetch adjustments
+PREFETCH_TUNE_INTERVAL = 5.0
+# seconds to wait before reopening a channel the broker closed
+CHANNEL_REOPEN_DELAY = 1.0
+# most spooled publishes sent per ioloop turn, and most waiting for a confirm at once
+SPOOL_REPLAY_BATCH = 500
+# times the broker may nack a spooled publish before it is dropped, so one it keeps refusing does not block the spool
+SPOOL_MAX_NACKS = 5
+# connection errors that retrying will not fix
+FATAL_CONNECTION_ERRORS = (pika.exceptions.ProbableAuthenticationError, pika.exceptions.ProbableAccessDeniedError)
+# message errors that retrying will not fix, the body cannot be decoded
+UNRETRYABLE_ERRORS = (UnicodeDecodeError, json.JSONDecodeError, DecompressionError, DeserializationError)
+
+
+class RequestLimitException(Exception):
+    """Raised on a request future when too many requests are already waiting for a reply"""
+
+
+class EncodedBody(NamedTuple):
+    """A message encoded for publishing, with the properties that describe the body"""
+
+    body: bytes
+    content_type: str
+    content_encoding: str
+    # reference to the body in S3 when it was offloaded, the body is empty then
+    claim_check: Optional[str]
+
+
+class PendingRequest(NamedTuple):
+    """A request waiting for its reply"""
+
+    future: Future
+    # timeout handle on the ioloop, None until the request is published
+    timer: Any
+
+
 # https://stackoverflow.com/questions/3464061/cast-base-class-to-derived-class-python-or-more-pythonic-way-of-extending-class
 class extendProperties(BasicProperties):
+    """Copy of the message properties with the exchange and routing key. Kept for compatibility, callbacks now receive a `DeliveryContext`"""
+
     def __init__(self):
         super().__init__()
         self.exchange = None
@@ -38,6 +98,32 @@ class extendProperties(BasicProperties):
         newProperty.routing_key = delivery_prop.routing_key
         return newProperty
 
+
+@functools.lru_cache(maxsize=None)
+def _worker_serializers(codec: Union[str, JsonCodec]) -> Dict[str, Serializer]:
+    """Built in serializers reused by a worker process, JSON decoded with the codec"""
+    return get_serializers(codec)
+
+
+def _process_callback(
+    cb: Callable, serializer: Union[str, JsonCodec, Serializer], claim_check: ClaimCheckStore, properties: DeliveryContext, body: bytes
+) -> Tuple[Any, float]:
+    """
+    Runs in a worker process. Fetches a claim checked body, decompresses and decodes the message body and calls the message callback.
+
+    :param serializer: Serializer for the content type of the message, or the JSON codec to pick a built in serializer with
+    :param claim_check: Store to fetch the body from when the message carries a claim check
+
+    :returns: The callback response and the seconds it took
+    """
+    start_time = time.perf_counter()
+    if properties.headers and CLAIM_CHECK_HEADER in properties.headers:
+        body = claim_check.get(properties.headers[CLAIM_CHECK_HEADER])
+    if not isinstance(serializer, Serializer):
+        serializer = _worker_serializers(serializer)[properties.content_type]
+    response = cb(properties, serializer.loads(decompress(body, properties.content_encoding)))
+    return response, time.perf_counter() - start_time
+
 # FROM EDM SECTION
 
 
@@ -50,7 +136,93 @@ class Eventhub:
         virtual_host: str = pika.ConnectionParameters.DEFAULT_VIRTUAL_HOST,
         connection_name: Optional[str] = None,
         heartbeat=10,
+        coalesce_acks: bool = False,
+        ack_flush_interval_ms: int = 0,
+        publisher_confirms: bool = False,
+        json_codec: Optional[Union[str, JsonCodec]] = None,
+        max_pending_requests: int = 1000,
+        metrics_port: Optional[int] = None,
+        shutdown_deadline: Optional[float] = None,
+        ordering_lanes: Optional[int] = None,
+        max_lane_depth: int = 100,
+        priority_scheduling: bool = False,
+        priority_aging_seconds: Optional[float] = 10,
+        process_workers: Optional[int] = None,
+        adaptive_prefetch: bool = False,
+        min_prefetch: int = 1,
+        max_prefetch: Optional[int] = None,
+        consumer_channels: int = 1,
+        reconnect_delay: float = 1.0,
+        max_reconnect_delay: float = 60.0,
+        max_reconnect_attempts: Optional[int] = None,
+        publish_buffer_size: int = 1000,
+        spool: Optional[Spool] = None,
+        compression: Optional[Union[str, Compressor]] = None,
+        compression_threshold: int = 4096,
+        serializers: Optional[Iterable[Serializer]] = None,
+        content_type: str = JSON_CONTENT_TYPE,
+        claim_check: Optional[ClaimCheckStore] = None,
+        claim_check_threshold: int = 1024 * 1024,
+        dedup: Optional[DedupStore] = None,
+        dedup_key: Optional[Callable[[BasicProperties], Optional[str]]] = None,
     ) -> None:
+        """
+        :param prefetch_count: How many messages and threads this service will process at once
+        :param virtual_host: The MQ broker virtual host
+        :param connection_name: Name used to distinguish this connection from others, defaults to the class name
+        :param heartbeat: The number of seconds in between heartbeats
+        :param coalesce_acks: Collect finished deliveries and settle them in batches, using `basic_ack(multiple=True)` when they are contiguous.
+            Turned on by `register_on_batch_callback`
+        :param ack_flush_interval_ms: When coalescing acks, how long to collect finished deliveries before flushing. 0 flushes on the next ioloop tick
+        :param publisher_confirms: Put the channel in confirm mode. `publish_message_with_callbacks` then returns a Future resolved on broker ack/nack
+        :param json_codec: Codec used to decode message bodies and encode published messages. Can be 'json', 'orjson', 'msgspec' or a `JsonCodec`. Defaults to the standard library
+        :param max_pending_requests: Most requests sent with `request` that can wait for a reply at once
+        :param metrics_port: Serve the metrics in Prometheus text format at http://0.0.0.0:<metrics_port>/metrics while running. Not served when None
+        :param shutdown_deadline: Default seconds `stop` waits for in-flight messages before requeueing them. None waits until they finish
+        :param ordering_lanes: Number of lanes messages of callbacks registered with an `ordering_key` are spread over. Defaults to the prefetch count
+        :param max_lane_depth: Messages waiting in one ordering lane that pause the consumer of the queue, until the lane
+            drains. The broker keeps the rest of the queue in order meanwhile
+        :param priority_scheduling: Start prefetched messages waiting for a worker thread by message priority instead of arrival order.
+            Only matters when more messages are prefetched than there are threads, for example when consuming several queues
+        :param priority_aging_seconds: With priority scheduling, seconds of waiting that raise a message by one priority level. None disables aging
+        :param process_workers: Number of worker processes for callbacks registered with execution_mode='process'. Defaults to the CPU count
+        :param adaptive_prefetch: Adjust the prefetch count at runtime from handler latency and throughput, starting from prefetch_count.
+            The thread pool is sized for max_prefetch
+        :param min_prefetch: Lowest prefetch count with adaptive prefetch
+        :param max_prefetch: Highest prefetch count with adaptive prefetch. Defaults to 4 times prefetch_count
+        :param consumer_channels: Number of channels queues are consumed on, separate from the channel used for publishing and replies.
+            Queues are spread over them round robin, each channel has its own prefetch and is reopened on its own if the broker closes it
+        :param reconnect_delay: Seconds to wait before the first reconnect attempt after the connection is lost or cannot be opened.
+            The delay doubles with every failed attempt, with jitter so replicas do not reconnect all at once
+        :param max_reconnect_delay: Most seconds to wait between reconnect attempts
+        :param max_reconnect_attempts: Consecutive failed reconnect attempts before the service stops. None keeps trying.
+            Authentication and access errors always stop the service
+        :param publish_buffer_size: Most publishes held in memory while the publish channel is closed, sent in order once it reopens.
+            Publishes beyond it are dropped. 0 disables the buffer
+        :param spool: Disk spool publishes are written to instead of the in-memory buffer, so they survive long outages
+            and restarts. Spooled publishes are replayed in order once the channel reopens. With publisher confirms they
+            stay in the spool until the broker confirms them, and new publishes are spooled behind them meanwhile. A spooled
+            publish the broker nacks SPOOL_MAX_NACKS times is dropped. Publishes sent while the channel is open are not
+            spooled, so ones still waiting for their confirm when the connection is lost fail instead of being replayed
+        :param compression: Compress published bodies larger than compression_threshold. Can be 'gzip', 'zstd' or a `Compressor`.
+            Compressed bodies are labelled with the compressor name as their content encoding, so every consumer must run
+            a cessoc version that decompresses them. Bodies that do not get smaller are sent uncompressed. None disables compression
+        :param compression_threshold: Bytes an encoded body must exceed to be compressed
+        :param serializers: Serializers for content types besides the built in 'application/json' and 'application/msgpack',
+            or to replace them. Messages with a content type that has no serializer are rejected. Custom serializers used
+            by callbacks with execution_mode='process' must be picklable
+        :param content_type: Content type messages are published with unless a publish asks for another. Replies are sent
+            with the content type of the request. 'application/msgpack' requires the msgpack package
+        :param claim_check: Store published bodies larger than claim_check_threshold in S3 and send only a reference in the
+            'Claim-Check' header. Received claim checks are fetched before the callback runs, with a default store when
+            this is not set. None does not offload published bodies
+        :param claim_check_threshold: Bytes an encoded and compressed body must exceed to be offloaded
+        :param dedup: Store of processed messages. Messages already processed, such as unacknowledged messages redelivered
+            after a restart, are acknowledged without running their callback again. Applies to thread and coroutine
+            callbacks, checked on the worker. None disables deduplication
+        :param dedup_key: Returns the key a message is deduplicated by from its properties, None to always process it.
+            Defaults to the correlation ID. Keys are scoped to the queue, so a message routed to several queues is processed in each
+        """
         self.parameters: Dict = {}
 
         # This line should come after the config manager is intialized because the config_manager configures the root logger
@@ -59,6 +231,12 @@ class Eventhub:
         # how many messages and threads this service will process at once
         self._prefetch_count = prefetch_count
 
+        # adjusts the channel prefetch count at runtime, None when the prefetch count is fixed
+        self._prefetch_tuner: Optional[PrefetchTuner] = None
+        self._prefetch_timer = None
+        if adaptive_prefetch:
+            self._prefetch_tuner = PrefetchTuner(prefetch_count, min_prefetch, max_prefetch or prefetch_count * 4)
+
         # the MQ broker virtual host
         self.virtual_host = virtual_host
 
@@ -76,8 +254,43 @@ class Eventhub:
 
         # pika connection https://www.rabbitmq.com/connections.html
         self._connection: Connection = None
-        # pika channel https://www.rabbitmq.com/channels.html
+        # ioloop shared by every connection, so timers and threadsafe callbacks survive reconnects
+        self._ioloop: Optional[IOLoop] = None
+        # credentials to reconnect with and the delay between failed attempts
+        self._credentials: Tuple[str, str] = ("", "")
+        self._reconnect_backoff = Backoff(reconnect_delay, max_reconnect_delay)
+        self._max_reconnect_attempts = max_reconnect_attempts
+        self._reconnect_timer = None
+        self._lag_probe_timer = None
+        # pika channel https://www.rabbitmq.com/channels.html used to declare topology, publish and reply
         self._channel: Channel = None
+        # channels queues are consumed on, so acks do not compete with publishes and a channel error only affects its own queues
+        if consumer_channels < 1:
+            raise ValueError("consumer_channels must be at least 1")
+        self._consumer_channels: List[Optional[Channel]] = [None] * consumer_channels
+        # the channel each consumer was started on. deliveries must be settled on the channel they arrived on
+        self._channels_by_consumer_tag: Dict[str, Channel] = {}
+        # index of the consumer channel each queue is consumed on, and queues waiting for their channel to open
+        self._queue_channels: Dict[str, int] = {}
+        self._pending_consumers: Dict[int, List[Queue]] = {}
+        # declarations sent on the publish channel that have not been confirmed yet. publishes wait until it reaches zero
+        self._topology_pending = 0
+        self._topology_declared = False
+        # consumers the service needs to be ready and how many are running, so readiness is checked without a scan of every queue
+        self._consumers_expected = 0
+        self._consumers_started = 0
+        # when the connection and the publish channel last opened, to report how long setup took
+        self._connection_opened_at: Optional[float] = None
+        self._topology_started_at: Optional[float] = None
+        # publishes made while the publish channel is closed or declaring the topology, None when buffering is disabled
+        self._publish_buffer: Optional[PublishBuffer] = PublishBuffer(publish_buffer_size) if publish_buffer_size > 0 else None
+        # disk spool used instead of the buffer, the replayed publishes waiting for a confirm and the futures of spooled publishes
+        self._spool = spool
+        self._spool_unconfirmed: Deque[Tuple[SpoolPosition, Future]] = deque()
+        self._spool_futures: Dict[SpoolPosition, Future] = {}
+        # times the broker nacked each spooled publish that is not committed yet
+        self._spool_nacks: Dict[SpoolPosition, int] = {}
+        self._spool_timer = None
 
         # is the service currently trying to close
         self._closing = False
@@ -95,9 +308,28 @@ class Eventhub:
         self._on_ready_callbacks: List[Callable] = []
 
         # thread pool manager, max threads is configured with the prefect count
-        self._thread_pool_executor = ThreadPoolExecutor(max_workers=self._prefetch_count)
-        # list of running threads
-        self._tasks: List = []
+        self._thread_pool_executor = ThreadPoolExecutor(max_workers=self._max_prefetch())
+        # runs messages with the same ordering key serially on the thread pool
+        self._ordered_executor = OrderedExecutor(
+            self._thread_pool_executor, ordering_lanes or self._prefetch_count, max_lane_depth, self._on_lane_available
+        )
+        # queues whose consumer is cancelled until the ordering lanes have room again
+        self._paused_queues: Set[str] = set()
+        # running tasks and the delivery tags they settle. guarded by the condition, which is notified when the last task finishes
+        self._tasks: Dict[Any, List[Basic.Deliver]] = {}
+        self._tasks_condition = threading.Condition()
+        # set by stop while waiting for the running tasks to finish
+        self._draining = False
+        self._drain_started: Optional[float] = None
+        self._drain_timer = None
+        self._shutdown_deadline = shutdown_deadline
+
+        # deliveries waiting to be handed to a batch callback and their flush timers, keyed by queue name and binding key
+        self._batches: Dict[Tuple[str, str], List[Tuple[Basic.Deliver, BasicProperties, bytes]]] = {}
+        self._batch_timers: Dict[Tuple[str, str], Any] = {}
+
+        # retry policies of the queues registered with one, keyed by queue name
+        self._retry_policies: Dict[str, RetryPolicy] = {}
 
         # dictionary for callbacks that process reply to messages, key should be the __qualname__ of the method
         self._reply_to_callbacks: Dict[str, Callable] = {}
@@ -109,34 +341,96 @@ class Eventhub:
             signal.signal(signal.SIGINT, self._shutdown_interupt_cb)
             signal.signal(signal.SIGTERM, self._shutdown_interupt_cb)
 
+        # collect finished deliveries from worker threads so they can be settled in batches, one coalescer per consumer channel
+        self._coalesce_acks = coalesce_acks
+        self._ack_coalescers: Dict[Channel, AckCoalescer] = {}
+        self._ack_flush_interval_ms = ack_flush_interval_ms
+
+        # tracks published messages waiting for a broker ack/nack, None when publisher confirms are disabled
+        self._confirm_tracker: Optional[ConfirmTracker] = ConfirmTracker() if publisher_confirms else None
+
+        # decodes message bodies and encodes published messages, by content type. JSON bodies use the codec
+        self._codec = get_codec(json_codec)
+        self._serializers = get_serializers(self._codec, serializers or ())
+        self._custom_content_types = {serializer.content_type for serializer in serializers or ()}
+        if content_type not in self._serializers:
+            raise ValueError(f"No serializer for content type '{content_type}'. Must be one of {sorted(self._serializers)}")
+        self._content_type = content_type
+        # stores large published bodies in S3, None when offloading is disabled. claim checks are fetched either way
+        self._claim_check = claim_check
+        self._claim_check_threshold = claim_check_threshold
+        self._claim_check_reader = claim_check if claim_check is not None else ClaimCheckStore()
+        # remembers processed messages so redelivered duplicates are skipped, None when deduplication is disabled
+        self._dedup = dedup
+        self._dedup_key = dedup_key
+        # compresses large published bodies, None when compression is disabled. received bodies are decompressed either way
+        self._compressor = get_compressor(compression)
+        self._compression_threshold = compression_threshold
+        self._content_encodings = supported_encodings()
+
         self._thread_local = threading.local()
         self._campus = os.environ.get("CAMPUS")
         self._reply_queue_name = None
 
+        # requests waiting for a reply, keyed by correlation ID. resolved from worker threads so guarded by a lock
+        self._pending_requests: Dict[str, PendingRequest] = {}
+        self._pending_requests_lock = threading.Lock()
+        self._max_pending_requests = max_pending_requests
+
+        # message counters and timings, recorded from the ioloop and worker threads
+        self._metrics = EventhubMetrics()
+        self._metrics_port = metrics_port
+        self._metrics_server: Optional[MetricsServer] = None
+        self._metrics.prefetch_count.set(self._prefetch_tuner.current if self._prefetch_tuner else self._prefetch_count)
+
+        # starts waiting messages by priority on the thread pool, None when priority scheduling is disabled
+        self._priority_executor: Optional[PriorityExecutor] = None
+        if priority_scheduling:
+            self._priority_executor = PriorityExecutor(self._thread_pool_executor, priority_aging_seconds, self._metrics.priority_queue_depth)
+
+        # runs CPU bound callbacks in worker processes, started when the first one is registered
+        self._process_executor: Optional[PreforkExecutor] = None
+        self._process_workers = process_workers
+
+    def _max_prefetch(self) -> int:
+        """The most messages that can be prefetched at once"""
+        return self._prefetch_tuner.maximum if self._prefetch_tuner is not None else self._prefetch_count
+
+    @property
+    def metrics(self) -> EventhubMetrics:
+        """Message counters and timings. Services can add their own metrics to `metrics.registry` to serve them alongside"""
+        return self._metrics
+
     def _connect(self, username: str, password: str) -> Connection:
         """Configures and starts the connection the the MQ."""
+        parameters = self._connection_parameters(username, password)
+        self._logger.info("Connecting to %s", parameters.host)
+        if self._ioloop is None:
+            self._ioloop = IOLoop()
+        return pika.SelectConnection(
+            parameters=parameters,
+            on_open_callback=self._on_connection_open,
+            on_open_error_callback=self._on_connection_open_error,
+            on_close_callback=self._on_connection_closed,
+            custom_ioloop=self._ioloop,
+        )
+
+    def _connection_parameters(self, username: str, password: str) -> pika.ConnectionParameters:
+        """Builds the parameters used to connect to the MQ."""
         self.username = username
         credentials = pika.PlainCredentials(username, password)
         # the SSLOptions tell the pika library to connect using amqps
-        # the service will shut down after all the connection_attempts have failed
+        # failed attempts are retried with backoff by _schedule_reconnect, not by pika
         parameters = pika.ConnectionParameters(
             host=self.mq_endpoint,
             virtual_host=self.virtual_host,
             heartbeat=self.heartbeat,
-            connection_attempts=3,
-            retry_delay=10,
+            connection_attempts=1,
             credentials=credentials,
             ssl_options=pika.SSLOptions(context=ssl.create_default_context()),
             client_properties={"connection_name": self.connection_name},
         )
-
-        self._logger.info("Connecting to %s", parameters.host)
-        return pika.SelectConnection(
-            parameters=parameters,
-            on_open_callback=self._on_connection_open,
-            on_open_error_callback=self._on_connection_open_error,
-            on_close_callback=self._on_connection_closed,
-        )
+        return parameters
 
     def _close_connection(self) -> None:
         """Cleanly close the connection to the MQ."""
@@ -150,25 +444,142 @@ class Eventhub:
     def _on_connection_open(self, _unused_connection: Connection) -> None:
         """Called when a new connection to the MQ has been established. Starts opening a channel."""
         self._logger.info("Connection opened")
+        self._connection_opened_at = time.perf_counter()
+        self._reconnect_backoff.reset()
+        self._schedule_lag_probe()
+        # the broker opens channels in order, so the consumer channels are open before the queues are declared
+        for index in range(len(self._consumer_channels)):
+            self._open_consumer_channel(index)
         self._open_channel()
+        if self._prefetch_tuner is not None:
+            self._prefetch_timer = self._connection.ioloop.call_later(PREFETCH_TUNE_INTERVAL, self._tune_prefetch)
+
+    def _schedule_lag_probe(self) -> None:
+        """Schedules a timer that measures how late the ioloop runs it"""
+        expected = time.perf_counter() + LAG_PROBE_INTERVAL
+        self._lag_probe_timer = self._connection.ioloop.call_later(LAG_PROBE_INTERVAL, functools.partial(self._on_lag_probe, expected))
+
+    def _on_lag_probe(self, expected: float) -> None:
+        """Records the ioloop lag and schedules the next probe while the connection is open"""
+        self._lag_probe_timer = None
+        self._metrics.ioloop_lag.set(max(0.0, time.perf_counter() - expected))
+        if not self._closing and self._connection.is_open:
+            self._schedule_lag_probe()
 
     def _on_connection_open_error(self, _unused_connection: Connection, err: Exception) -> None:
-        """Called when a connection cannot be established to the MQ. Stops the ioloop."""
-        self._logger.error("Connection open failed. Stopping execution.")
-        self._logger.error(err)
-        self.stop()
+        """Called when a connection cannot be established to the MQ. Retries with backoff unless the error is fatal."""
+        self._logger.error("Connection open failed: %r", err)
+        if isinstance(err, FATAL_CONNECTION_ERRORS):
+            self._logger.error("Connection was refused by the broker. Stopping execution.")
+            self.stop()
+        elif not self._closing:
+            self._schedule_reconnect()
+
+    def _schedule_reconnect(self) -> None:
+        """Reconnects after the backoff delay, or stops once max_reconnect_attempts consecutive attempts have failed"""
+        if self._max_reconnect_attempts is not None and self._reconnect_backoff.attempts >= self._max_reconnect_attempts:
+            self._logger.error("Could not reconnect after %s attempts. Stopping execution.", self._reconnect_backoff.attempts)
+            self.stop()
+            return
+        delay = self._reconnect_backoff.next_delay()
+        self._logger.warning("Reconnecting in %.1f seconds", delay)
+        self._reconnect_timer = self._connection.ioloop.call_later(delay, self._reconnect)
+
+    def _reconnect(self) -> None:
+        """Opens a new connection on the same ioloop. Topology, consumers and buffered publishes are restored once it opens."""
+        self._reconnect_timer = None
+        if self._closing:
+            return
+        self._metrics.reconnects.inc()
+        self._connection = self._connect(*self._credentials)
 
     def _on_connection_closed(self, _unused_connection: Connection, reason: Exception) -> None:
-        """Called when an established connection to the MQ has been closed cleanly."""
+        """Called when an established connection to the MQ has been closed. Reconnects unless the service is stopping."""
         self._logger.warning("Connection closed: %s", reason)
+        for timer in (self._lag_probe_timer, self._prefetch_timer):
+            if timer is not None:
+                self._connection.ioloop.remove_timeout(timer)
+        self._lag_probe_timer = self._prefetch_timer = None
         self._channel = None
-        self._connection.ioloop.stop()
+        self._topology_declared = False
+        self._consumer_channels = [None] * len(self._consumer_channels)
+        self._channels_by_consumer_tag = {}
+        self._ack_coalescers = {}
+        self._pending_consumers = {}
+        self._paused_queues = set()
+        self._drop_batches()
+        for queue in self._queue_manager.queues.values():
+            # consumers end with the connection
+            queue.consumer_tag = None
+        self._consumers_started = 0
+        if self._confirm_tracker is not None:
+            self._confirm_tracker.fail_all(reason)
+        if self._closing:
+            self._connection.ioloop.stop()
+        else:
+            self._schedule_reconnect()
 
     def _open_channel(self) -> None:
         """Opens a new channel to the MQ. Starts exchange setup."""
         self._logger.debug("Creating a new channel")
         self._connection.channel(on_open_callback=self._on_channel_open)
 
+    def _reopen_channel(self) -> None:
+        """Reopens the publish channel unless the service is stopping"""
+        if not self._closing and self._connection.is_open:
+            self._open_channel()
+
+    def _open_consumer_channel(self, index: int) -> None:
+        """Opens a consumer channel. Starts consuming the queues waiting for it."""
+        self._logger.debug("Creating consumer channel %s", index)
+        self._connection.channel(on_open_callback=functools.partial(self._on_consumer_channel_open, index=index))
+
+    def _reopen_consumer_channel(self, index: int) -> None:
+        """Reopens a consumer channel unless the service is stopping"""
+        if not self._closing and self._connection.is_open:
+            self._open_consumer_channel(index)
+
+    def _on_consumer_channel_open(self, channel: Channel, index: int) -> None:
+        """Called when a consumer channel has been opened. Starts consuming the queues assigned to it that are declared."""
+        self._logger.info("Consumer channel %s opened", index)
+        self._consumer_channels[index] = channel
+        channel.add_on_close_callback(functools.partial(self._on_consumer_channel_closed, index=index))
+        channel.add_on_cancel_callback(self._on_consumer_cancelled)
+        if self._coalesce_acks:
+            # created before the first delivery, so every delivery on the channel is registered before it can be settled
+            self._ack_coalescers[channel] = AckCoalescer()
+        # the channel handles its calls in order, so consumers started right after are covered by the QoS without waiting for it
+        channel.basic_qos(prefetch_count=self._max_prefetch(), callback=functools.partial(self._on_basic_qos_ok, index=index))
+        if self._prefetch_tuner is not None:
+            channel.basic_qos(prefetch_count=self._prefetch_tuner.current, global_qos=True)
+        for queue in self._pending_consumers.pop(index, []):
+            self._request_consumer(queue)
+
+    def _on_consumer_channel_closed(self, channel: Channel, reason: Exception, index: int) -> None:
+        """
+        Called when a consumer channel has been closed. Unsettled deliveries on it are redelivered by the broker.
+        Reopens the channel and consumes its queues again, the other channels are not affected.
+        """
+        self._logger.warning("Consumer channel %s was closed: %s", index, reason)
+        self._consumer_channels[index] = None
+        self._ack_coalescers.pop(channel, None)
+        self._drop_batches(index)
+        for consumer_tag, consumer_channel in list(self._channels_by_consumer_tag.items()):
+            if consumer_channel is channel:
+                del self._channels_by_consumer_tag[consumer_tag]
+        for queue in self._queue_manager.queues.values():
+            if self._queue_channels.get(queue.name) != index:
+                continue
+            if queue.consumer_tag is not None or queue.name in self._paused_queues:
+                # paused queues consume again on the new channel, their waiting deliveries are redelivered
+                self._paused_queues.discard(queue.name)
+                self._consumer_stopped(queue)
+                self._pending_consumers.setdefault(index, []).append(queue)
+        for cb in self._on_channel_closed_callbacks:
+            cb(reason)
+        if not self._closing:
+            self._connection.ioloop.call_later(CHANNEL_REOPEN_DELAY, functools.partial(self._reopen_consumer_channel, index))
+
     def _on_channel_open(self, channel: Channel) -> None:
         """
         Called when a channel has been successfully opened to the MQ. Calls the after
@@ -177,28 +588,69 @@ class Eventhub:
         self._logger.info("Channel opened")
         self._channel = channel
         self._channel.add_on_close_callback(self._on_channel_closed)
-        self._channel.add_on_cancel_callback(self._on_consumer_cancelled)
         self._channel.add_on_return_callback(self._on_message_reject_cb)
+        if self._confirm_tracker is not None:
+            self._confirm_tracker.fail_all("channel reopened")
+            self._channel.confirm_delivery(self._on_delivery_confirmation)
         self._after_channel_open()
-
-        # setup exchanges
-        for exchange in self._queue_manager.exchanges.values():
-            self._setup_exchange(exchange)
-
-        # setup default exchange queues
-        for queue in self._queue_manager.queue_bindings[self._queue_manager.default_exchange]:
-            self._setup_queue(queue)
+        self._declare_topology()
 
         # must be called here if no queues are being registered
         if self._is_ready():
             self._on_ready()
 
+    def _declare_topology(self) -> None:
+        """
+        Declares every registered exchange, queue and binding in one pass. The broker handles the declarations on a
+        channel in order, so bindings are sent without waiting for their exchange and queue to be confirmed. Queues start
+        consuming as soon as they are confirmed, buffered publishes are sent once everything is.
+        """
+        self._topology_declared = False
+        self._topology_pending = 0
+        self._topology_started_at = time.perf_counter()
+        for exchange in self._queue_manager.exchanges.values():
+            self._setup_exchange(exchange)
+
+        # a queue registered with several exchanges is declared once and bound to each of them
+        queues: Dict[str, Queue] = {}
+        exchanges: Dict[str, List[Exchange]] = {}
+        for exchange_name, bound_queues in self._queue_manager.queue_bindings.items():
+            for queue in bound_queues:
+                queues.setdefault(queue.name, queue)
+                if exchange_name != self._queue_manager.default_exchange:
+                    exchanges.setdefault(queue.name, []).append(self._queue_manager.exchanges[exchange_name])
+        self._consumers_expected = sum(1 for queue in queues.values() if queue.consume)
+        for name, queue in queues.items():
+            self._setup_queue(queue, exchanges.get(name, []))
+
+        if self._topology_pending == 0:
+            self._on_topology_declared()
+
+    def _on_topology_ok(self) -> None:
+        """Called when a declaration is confirmed"""
+        self._topology_pending -= 1
+        if self._topology_pending == 0:
+            self._on_topology_declared()
+
+    def _on_topology_declared(self) -> None:
+        """Called when every exchange, queue and binding is confirmed. Sends the buffered publishes."""
+        topology_seconds = time.perf_counter() - self._topology_started_at
+        self._metrics.topology_seconds.set(topology_seconds)
+        self._logger.info("Topology declared in %.3f seconds", topology_seconds)
+        self._topology_declared = True
+        self._flush_publish_buffer()
+
     def _on_channel_closed(self, channel: Channel, reason: Exception):
-        """Called when a channel has been cleanly closed."""
+        """Called when the publish channel has been closed. Reopens it, consumers keep running on their own channels."""
         self._logger.warning("Channel %i was closed: %s", channel, reason)
+        self._channel = None
+        self._topology_declared = False
+        if self._confirm_tracker is not None:
+            self._confirm_tracker.fail_all(reason)
         for cb in self._on_channel_closed_callbacks:
             cb(reason)
-        self._close_connection()
+        if not self._closing:
+            self._connection.ioloop.call_later(CHANNEL_REOPEN_DELAY, self._reopen_channel)
 
     def register_on_channel_closed_callback(self, callback: Callable):
         """Register a new callback for unexpected channel closures. Method should accept 1 parameter of type 'Exception'"""
@@ -219,47 +671,130 @@ class Eventhub:
             method.routing_key,
             properties.correlation_id,
         )
+        if self._confirm_tracker is not None:
+            self._confirm_tracker.returned(properties.correlation_id, method.reply_text)
+
+    def _on_delivery_confirmation(self, method_frame: Method) -> None:
+        """Called when the broker acks or nacks messages published while in confirm mode."""
+        self._confirm_tracker.on_confirm(method_frame)
 
-    def stop(self, task_check: int = 2) -> None:
+    def stop(self, task_check: Optional[int] = None, *, deadline: Optional[float] = None) -> None:
         """
         Stops this service and the ioloop. Cleanly closes all connections, channels, and queues.
+        Messages already being processed are finished first, the connection closes as soon as the last one is settled.
 
-        :param task_check: Seconds to wait before checking if all tasks have finished
+        :param task_check: Deprecated and ignored. The tasks are no longer polled, the last one to finish closes the connection
+        :param deadline: Seconds to wait for messages being processed. Unfinished messages are requeued once it passes.
+            Defaults to the shutdown_deadline the Eventhub was created with
         """
+        if task_check is not None:
+            warnings.warn("The task_check parameter of Eventhub.stop is deprecated and ignored", DeprecationWarning, stacklevel=2)
+        if self._draining:
+            return
         self._logger.info("Stopping")
 
         self._closing = True
         # stop consuming so we don't receive any new messages
         self._stop_consuming_all()
+        # hand partially filled batches to their callbacks before the thread pool stops accepting work
+        self._flush_all_batches()
         self._thread_pool_executor.shutdown(wait=False)
-        # wait until all threads have returned
-        if len(self._tasks) != 0:
-            self._logger.info("Pending tasks to complete before shutdown: %s", len(self._tasks))
-            # call in 2 seconds, gives the threads time to ack or reply to messages they've already received
-            self._connection.ioloop.call_later(task_check, self.stop)
-        else:
+        if self._process_executor is not None:
+            self._process_executor.shutdown(wait=False)
+
+        self._drain_started = time.perf_counter()
+        with self._tasks_condition:
+            pending = len(self._tasks)
+            # the last task to finish schedules _final_stop
+            self._draining = pending != 0
+        if not pending:
             # finish closing connections
             self._connection.ioloop.add_callback_threadsafe(self._final_stop)
+            return
+
+        self._logger.info("Pending tasks to complete before shutdown: %s", pending)
+        deadline = deadline if deadline is not None else self._shutdown_deadline
+        if deadline is not None:
+            cb = functools.partial(self._start_drain_timer, deadline)
+            self._connection.ioloop.add_callback_threadsafe(cb)
+
+    def _start_drain_timer(self, deadline: float) -> None:
+        """Starts the drain deadline timer on the ioloop thread"""
+        if self._draining:
+            self._drain_timer = self._connection.ioloop.call_later(deadline, self._on_drain_deadline)
+
+    def _on_drain_deadline(self) -> None:
+        """Requeues the deliveries of tasks that did not finish before the drain deadline and stops"""
+        self._drain_timer = None
+        with self._tasks_condition:
+            if not self._draining:
+                return
+            self._draining = False
+            unfinished = list(self._tasks.items())
+        self._logger.warning("Shutdown deadline reached, requeueing the messages of %s unfinished tasks", len(unfinished))
+        # send what finished in time before giving up on the rest
+        self._flush_acks()
+        for task, deliveries in unfinished:
+            task.cancel()
+            for basic_deliver in deliveries:
+                channel = self._channel_for(basic_deliver)
+                if channel is not None:
+                    self._requeue_message(basic_deliver.delivery_tag, channel)
+        for coalescer in self._ack_coalescers.values():
+            # anything settled from now on belongs to a requeued delivery
+            coalescer.reset()
+        self._final_stop()
+
+    def wait_until_idle(self, timeout: Optional[float] = None) -> bool:
+        """
+        Blocks until no messages are being processed. Must not be called from the ioloop thread.
+
+        :param timeout: Most seconds to wait, None waits until idle
+        :returns: True if idle, False if the timeout passed first
+        """
+        with self._tasks_condition:
+            return self._tasks_condition.wait_for(lambda: not self._tasks, timeout)
 
     def _final_stop(self) -> None:
         """Called once all messages have been properly processed"""
+        if self._drain_timer is not None:
+            self._connection.ioloop.remove_timeout(self._drain_timer)
+            self._drain_timer = None
+        for timer in (self._reconnect_timer, self._spool_timer):
+            if timer is not None:
+                self._connection.ioloop.remove_timeout(timer)
+        self._reconnect_timer = self._spool_timer = None
+        if self._drain_started is not None:
+            drain_seconds = time.perf_counter() - self._drain_started
+            self._metrics.drain_seconds.set(drain_seconds)
+            self._logger.info("Drained in-flight messages in %.3f seconds", drain_seconds)
+        self._flush_acks()
+        self._fail_pending_requests("Eventhub stopped before a reply was received")
+        self._fail_publish_buffer("Eventhub stopped before the channel reopened")
+        if self._spool is not None:
+            self._close_spool()
         self._close_connection()
         self._connection.ioloop.stop()
+        if self._metrics_server is not None:
+            self._metrics_server.stop()
+            self._metrics_server = None
         self._logger.info("Stopped")
 
     def _stop_consuming_all(self) -> None:
         """Cancels all consumers."""
-        if self._channel:
-            for queue in self._queue_manager.queues.values():
-                # only cancel consumers that are still listening
-                if queue.consumer_tag:
-                    self._stop_consuming(queue)
+        for queue in self._queue_manager.queues.values():
+            # only cancel consumers that are still listening
+            if queue.consumer_tag:
+                self._stop_consuming(queue)
 
     def _stop_consuming(self, queue: Queue) -> None:
         """Cancels the consumer tag"""
+        channel = self._channels_by_consumer_tag.get(queue.consumer_tag)
+        if channel is None or not channel.is_open:
+            return
         self._logger.debug("Canceling consumer %s", queue.consumer_tag)
         cb = functools.partial(self._on_cancelok, queue=queue)
-        self._channel.basic_cancel(queue.consumer_tag, cb)
+        channel.basic_cancel(queue.consumer_tag, cb)
 
     def stop_consuming(self, queue_name: str) -> None:
         """Cancels the consumer tag by queue name and thread safe"""
@@ -269,12 +804,13 @@ class Eventhub:
     def _on_cancelok(self, _unused_frame: Method, queue: Queue) -> None:
         """Called when a consumer is canceld."""
         self._logger.info("RabbitMQ acknowledged the cancellation of the consumer: %s", queue.consumer_tag)
-        queue.consumer_tag = None
+        self._consumer_stopped(queue)
 
     def _setup_exchange(self, exchange: Exchange) -> None:
         """Set up an exchange."""
         self._logger.info("Declaring exchange: %s", exchange.name)
         cb = functools.partial(self._on_exchange_declareok, exchange=exchange)
+        self._topology_pending += 1
         self._channel.exchange_declare(
             exchange=exchange.name,
             exchange_type=str(exchange.exchange_type.value),
@@ -287,13 +823,13 @@ class Eventhub:
     def _on_exchange_declareok(self, _unused_frame: Method, exchange: Exchange) -> None:
         """Called when an exchanges is successfully declared."""
         self._logger.debug("Exchange declared: %s", exchange.name)
-        for queue in self._queue_manager.queue_bindings[exchange.name]:
-            self._setup_queue(queue, exchange)
+        self._on_topology_ok()
 
-    def _setup_queue(self, queue: Queue, exchange: Optional[Exchange] = None) -> None:
-        """Set up a queue."""
+    def _setup_queue(self, queue: Queue, exchanges: List[Exchange]) -> None:
+        """Set up a queue and, if it will be consumed, bind it to the exchanges."""
         self._logger.info("Declaring queue %s", queue.name)
-        cb = functools.partial(self._on_queue_declare_ok, queue=queue, exchange=exchange)
+        cb = functools.partial(self._on_queue_declare_ok, queue=queue)
+        self._topology_pending += 1
         self._channel.queue_declare(
             queue=queue.name,
             passive=queue.passive,
@@ -303,14 +839,13 @@ class Eventhub:
             arguments=queue.arguments,
             callback=cb,
         )
-
-    def _on_queue_declare_ok(self, _unused_frame: Method, queue: Queue, exchange: Optional[Exchange] = None) -> None:
-        """Called when a queue has been successfully declared. Defines queue binding to an exchange."""
         if queue.consume is False:
             # nothing more to do since we won't be consuming
             return
 
-        if exchange is not None:
+        if not exchanges:
+            self._logger.info("Queue %s bound to the default exchange using the name as the routing key", queue.name)
+        for exchange in exchanges:
             # bind to exchange with routing keys
             if queue.bindings is None or len(queue.bindings) == 0:
                 raise AttributeError(
@@ -319,52 +854,107 @@ class Eventhub:
             for key in queue.bindings:
                 self._logger.info("Binding queue %s to exchange %s with routing key %s", queue.name, exchange.name, key)
                 cb = functools.partial(self._on_bindok, queue=queue, routing_key=key)
+                self._topology_pending += 1
                 self._channel.queue_bind(queue.name, exchange.name, routing_key=key, callback=cb)
-        else:
-            # bind to default exchange
-            self._logger.info("Queue %s bound to the default exchange using the name as the routing key", queue.name)
-        self._set_qos(queue)
+
+    def _on_queue_declare_ok(self, _unused_frame: Method, queue: Queue) -> None:
+        """Called when a queue has been successfully declared. Starts consuming it."""
+        self._logger.debug("Queue declared: %s", queue.name)
+        if queue.consume:
+            self._request_consumer(queue)
+        self._on_topology_ok()
 
     def _on_bindok(self, _unused_frame: Method, queue, routing_key: str) -> None:
         """Called when a queue has been successfully bound to an exchange"""
         self._logger.debug("Queue bound '%s' with routing key '%s'", queue.name, routing_key)
+        self._on_topology_ok()
 
-    def _set_qos(self, queue: Queue) -> None:
-        """Sets the prefect count for the queue"""
-        cb = functools.partial(self._on_basic_qos_ok, queue=queue)
-        self._channel.basic_qos(prefetch_count=self._prefetch_count, callback=cb)
+    def _consumer_channel_index(self, queue: Queue) -> int:
+        """The index of the consumer channel the queue is consumed on. Queues are assigned round robin in the order they are set up"""
+        if queue.name not in self._queue_channels:
+            self._queue_channels[queue.name] = len(self._queue_channels) % len(self._consumer_channels)
+        return self._queue_channels[queue.name]
 
-    def _on_basic_qos_ok(self, _unused_frame: Method, queue: Queue) -> None:
-        """Called when the prefect count for a queue has been successfully set. Starting consuming of the queue."""
-        self._logger.debug("QOS set to: %d", self._prefetch_count)
-        self._start_consuming(queue)
+    def _request_consumer(self, queue: Queue, notify_ready: bool = True) -> None:
+        """
+        Starts consuming the queue on its consumer channel. Waits for the channel if it is not open yet.
 
-    def _start_consuming(self, queue: Queue) -> None:
-        """Starts consuming the queue."""
+        :param notify_ready: Run the ready callbacks if this was the last consumer to start
+        """
+        if queue.consumer_tag is not None:
+            # already consuming, the publish channel was reopened
+            return
+        index = self._consumer_channel_index(queue)
+        channel = self._consumer_channels[index]
+        if channel is None or not channel.is_open:
+            pending = self._pending_consumers.setdefault(index, [])
+            if queue not in pending:
+                pending.append(queue)
+            return
+        self._start_consuming(queue, notify_ready)
+
+    def _on_basic_qos_ok(self, _unused_frame: Method, index: int) -> None:
+        """Called when the prefect count of a consumer channel has been successfully set."""
+        self._logger.debug("QOS of consumer channel %s set to: %d", index, self._max_prefetch())
+
+    def _tune_prefetch(self) -> None:
+        """
+        Lets the tuner evaluate the last interval and applies the new prefetch count. Consumers get the maximum prefetch
+        and the adaptive count is set as the channel wide (global) limit of each consumer channel, which RabbitMQ applies
+        to existing consumers immediately, unlike per consumer limits that only apply to consumers started afterwards.
+        """
+        self._prefetch_timer = None
+        if self._closing or not self._connection.is_open:
+            return
+        previous = self._prefetch_tuner.current
+        prefetch = self._prefetch_tuner.update(*self._metrics.handler_seconds.totals(), *self._metrics.queued_seconds.totals())
+        if prefetch != previous:
+            self._logger.info("Adjusting prefetch count from %s to %s", previous, prefetch)
+            for channel in self._consumer_channels:
+                if channel is not None and channel.is_open:
+                    channel.basic_qos(prefetch_count=prefetch, global_qos=True)
+            self._metrics.prefetch_count.set(prefetch)
+        self._prefetch_timer = self._connection.ioloop.call_later(PREFETCH_TUNE_INTERVAL, self._tune_prefetch)
+
+    def _start_consuming(self, queue: Queue, notify_ready: bool = True) -> None:
+        """
+        Starts consuming the queue on its consumer channel.
+
+        :param notify_ready: Run the ready callbacks if this was the last consumer to start
+        """
         self._logger.info("Starting consumer for queue %s", queue.name)
+        channel = self._consumer_channels[self._consumer_channel_index(queue)]
+        if channel is None or not channel.is_open:
+            # consuming starts once it reopens
+            self._request_consumer(queue)
+            return
         cb = functools.partial(self._on_message, queue=queue)
-        queue.consumer_tag = self._channel.basic_consume(queue.name, cb)
+        queue.consumer_tag = channel.basic_consume(queue.name, cb)
+        self._consumers_started += 1
+        self._channels_by_consumer_tag[queue.consumer_tag] = channel
         self._logger.debug("Started consumer %s with tag %s", queue.name, queue.consumer_tag)
 
-        if self._is_ready():
+        if notify_ready and self._is_ready():
             self._on_ready()
 
-    def _is_ready(self):
+    def _is_ready(self) -> bool:
         """Check if the service has started all consumers and is ready to receive"""
-        for definition in self._queue_manager.queues.values():
-            # check if not ready, all definitions that will consume and don't have a consumer tag means we're not ready
-            if definition.consume and definition.consumer_tag is None:
-                return False
-        return True
+        return self._consumers_started >= self._consumers_expected
+
+    def _consumer_stopped(self, queue: Queue) -> None:
+        """Clears the consumer tag of a queue whose consumer ended"""
+        if queue.consumer_tag is not None:
+            queue.consumer_tag = None
+            self._consumers_started -= 1
 
     def start_consuming(self, queue_name: str) -> None:
         """Starts the consumer tag by queue name and thread safe"""
-        cb = functools.partial(self._start_consuming, queue_definition=self._queue_manager.queues[queue_name])
+        cb = functools.partial(self._request_consumer, queue=self._queue_manager.queues[queue_name])
         self._connection.ioloop.add_callback_threadsafe(cb)
 
     def _on_message(
         self,
-        _unused_channel: Channel,
+        channel: Channel,
         basic_deliver: Basic.Deliver,
         properties: BasicProperties,
         body: bytes,
@@ -372,104 +962,563 @@ class Eventhub:
     ) -> None:
         """Called when a new message is received. Checks the content encoding and content type. Starts a new thread to process the message."""
         self._logger.debug("Received message # %s from %s", basic_deliver.delivery_tag, properties.app_id)
-
-        if properties.content_encoding != "utf-8":
+        headers = properties.headers
+        if headers and RETRY_ROUTING_KEY_HEADER in headers and basic_deliver.exchange == "" and basic_deliver.routing_key == queue.name:
+            # expired from a retry queue, route it by the exchange and routing key it was first delivered with
+            basic_deliver.exchange = headers.get(RETRY_EXCHANGE_HEADER, "")
+            basic_deliver.routing_key = headers[RETRY_ROUTING_KEY_HEADER]
+        self._metrics.received.inc(queue=queue.name, routing_key=basic_deliver.routing_key)
+        if self._prefetch_tuner is not None:
+            self._prefetch_tuner.record_in_flight(self._metrics.in_flight.get() + 1)
+
+        if properties.content_encoding not in self._content_encodings:
             self._logger.error(
-                "Rejecting message. Content encoding type must be 'utf-8' not '%s'", properties.content_encoding
+                "Rejecting message. Content encoding type must be one of %s not '%s'", sorted(self._content_encodings), properties.content_encoding
             )
-            self._reject_message(basic_deliver.delivery_tag)
+            self._reject_message(basic_deliver.delivery_tag, channel)
+            self._metrics.rejected.inc(queue=queue.name, routing_key=basic_deliver.routing_key)
             return
-        if properties.content_type != "application/json":
+        if properties.content_type not in self._serializers:
             self._logger.error(
-                "Rejecting message. Content type must be 'application/json' not '%s'", properties.content_type
+                "Rejecting message. Content type must be one of %s not '%s'", sorted(self._serializers), properties.content_type
             )
-            self._reject_message(basic_deliver.delivery_tag)
+            self._reject_message(basic_deliver.delivery_tag, channel)
+            self._metrics.rejected.inc(queue=queue.name, routing_key=basic_deliver.routing_key)
             return
 
         # check if the queue has bindings
         if queue.bindings is None:
             # this code should not be reachable since a check should be done before consuming from a queue with no bindings
             self._logger.error("Rejecting message. Queue %s has no bindings specified", queue.name)
-            self._reject_message(basic_deliver.delivery_tag)
+            self._reject_message(basic_deliver.delivery_tag, channel)
+            self._metrics.rejected.inc(queue=queue.name, routing_key=basic_deliver.routing_key)
             return
 
-        # ensure the queue has bindings for the routing key
-        if basic_deliver.routing_key not in queue.bindings:
+        # ensure the queue has bindings for the routing key, including topic wildcard bindings
+        binding_key = self._queue_manager.routing_index(queue).match(basic_deliver.routing_key)
+        if binding_key is None:
             self._logger.error(
                 "Rejecting message. Received message on routing key '%s' but no binding was specified",
                 basic_deliver.routing_key,
             )
-            self._reject_message(basic_deliver.delivery_tag)
+            self._reject_message(basic_deliver.delivery_tag, channel)
+            self._metrics.rejected.inc(queue=queue.name, routing_key=basic_deliver.routing_key)
             return
 
-        if type(queue.bindings[basic_deliver.routing_key]) is dict:
-            task = self._thread_pool_executor.submit(
-                self._callback_wrapper, queue.bindings[basic_deliver.routing_key]["function"], basic_deliver, properties, body, queue.bindings[basic_deliver.routing_key]["sends_reply"]
-            )
+        binding = queue.bindings[binding_key]
+        if type(binding) is dict and "max_batch" in binding:
+            self._add_to_batch(channel, queue, binding_key, binding, basic_deliver, properties, body)
+            return
+        coalescer = self._coalescer_for(channel)
+        if coalescer is not None:
+            # before the task is submitted, it may finish before this returns
+            coalescer.delivered(basic_deliver.delivery_tag)
+        if type(binding) is dict and binding.get("execution_mode") == "process":
+            task = self._submit_process(binding, basic_deliver, properties, body, queue.name)
+        elif type(binding) is dict and binding.get("ordering_key") is not None:
+            task = self._submit_ordered(binding, basic_deliver, properties, body, queue)
+        elif type(binding) is dict:
+            task = self._submit_callback(binding["function"], basic_deliver, properties, body, binding["sends_reply"], queue.name)
         else:
-            task = self._thread_pool_executor.submit(
-                self._callback_wrapper, queue.bindings[basic_deliver.routing_key], basic_deliver, properties, body
-            )
-        # track threads and their state
-        self._tasks.append(task)
+            task = self._submit_callback(binding, basic_deliver, properties, body, queue_name=queue.name)
+        self._metrics.in_flight.inc()
+        self._track_task(task, [basic_deliver])
+
+    def _submit_callback(
+        self, cb: Callable, basic_deliver: Basic.Deliver, properties: BasicProperties, body: bytes, reply_expected=True, queue_name: str = ""
+    ) -> Future:
+        """Starts processing the message on the thread pool, by message priority when priority scheduling is enabled"""
+        args = (cb, basic_deliver, properties, body, reply_expected, queue_name, time.perf_counter())
+        if self._priority_executor is not None:
+            return self._priority_executor.submit(properties.priority, self._callback_wrapper, *args)
+        return self._thread_pool_executor.submit(self._callback_wrapper, *args)
+
+    def _submit_process(
+        self, binding: Dict, basic_deliver: Basic.Deliver, properties: BasicProperties, body: bytes, queue_name: str
+    ) -> Future:
+        """Starts processing the message in a worker process. The raw body is decoded there, the result is handled here."""
+        # built in serializers and named codecs are created in the worker, custom serializers and codecs must be picklable
+        if properties.content_type in self._custom_content_types:
+            serializer = self._serializers[properties.content_type]
+        else:
+            serializer = self._codec.name if self._codec.name in SERIALIZERS else self._codec
+        submitted_at = time.perf_counter()
+        context = DeliveryContext(properties, basic_deliver)
+        task = self._process_executor.submit(_process_callback, binding["function"], serializer, self._claim_check_reader, context, body)
+        cb = functools.partial(
+            self._on_process_done,
+            basic_deliver=basic_deliver,
+            properties=properties,
+            body=body,
+            reply_expected=binding["sends_reply"],
+            queue_name=queue_name,
+            submitted_at=submitted_at,
+        )
+        task.add_done_callback(cb)
+        return task
+
+    def _on_process_done(
+        self,
+        task: Future,
+        basic_deliver: Basic.Deliver,
+        properties: BasicProperties,
+        body: bytes,
+        reply_expected: bool,
+        queue_name: str,
+        submitted_at: float,
+    ) -> None:
+        """Called on the dispatcher thread when a worker process finished the message. Sends the reply and settles the message."""
+        try:
+            response, elapsed = task.result()
+            self._logger.debug("Processing event took %s seconds", elapsed)
+            self._metrics.handler_seconds.observe(elapsed, queue=queue_name, routing_key=basic_deliver.routing_key)
+            self._metrics.queued_seconds.observe(max(0.0, time.perf_counter() - submitted_at - elapsed), queue=queue_name)
+            self._on_callback_success(basic_deliver, properties, response, reply_expected, queue_name)
+        except CancelledError:
+            # cancelled at the shutdown deadline, the message was requeued
+            pass
+        except Exception as ex:  # pylint: disable=broad-except
+            self._on_callback_error(basic_deliver, ex, queue_name, properties, body)
+        finally:
+            self._metrics.in_flight.dec()
+
+    def _submit_ordered(self, binding: Dict, basic_deliver: Basic.Deliver, properties: BasicProperties, body: bytes, queue: Queue) -> Future:
+        """
+        Starts processing the message on the lane of its ordering key, after earlier messages with the same key.
+        Messages without a key are processed unordered. Pauses the consumer of the queue once the lane is full.
+
+        :returns: The task processing the message
+        """
+        key = self._ordering_key(binding["ordering_key"], properties, body)
+        if key is None:
+            return self._submit_callback(binding["function"], basic_deliver, properties, body, binding["sends_reply"], queue.name)
+        task = self._ordered_executor.submit(
+            key, self._callback_wrapper, binding["function"], basic_deliver, properties, body, binding["sends_reply"], queue.name, time.perf_counter()
+        )
+        if self._ordered_executor.full(key):
+            self._pause_consumer(queue)
+        return task
+
+    def _pause_consumer(self, queue: Queue) -> None:
+        """
+        Cancels the consumer of the queue until the ordering lanes have room again. Requeueing would put the message at
+        the head of the queue, ahead of messages with the same key the broker has not delivered yet. Deliveries already
+        received stay unacknowledged on the channel and are settled as usual.
+        """
+        if queue.name in self._paused_queues or queue.consumer_tag is None:
+            return
+        channel = self._channels_by_consumer_tag.get(queue.consumer_tag)
+        if channel is None or not channel.is_open:
+            return
+        self._logger.warning("Ordering lane is full, pausing consumer of queue %s", queue.name)
+        self._paused_queues.add(queue.name)
+        channel.basic_cancel(queue.consumer_tag, functools.partial(self._on_pause_cancelok, queue=queue))
+
+    def _on_pause_cancelok(self, _unused_frame: Method, queue: Queue) -> None:
+        """Called when the consumer of a paused queue is cancelled. Consumes again if the lanes drained meanwhile."""
+        self._consumer_stopped(queue)
+        if queue.name not in self._paused_queues:
+            self._resume_consumer(queue)
+
+    def _on_lane_available(self) -> None:
+        """Called from a worker thread when an ordering lane has room again"""
+        if self._paused_queues:
+            self._connection.ioloop.add_callback_threadsafe(self._resume_paused_consumers)
+
+    def _resume_paused_consumers(self) -> None:
+        """Consumes the paused queues again once no ordering lane is full"""
+        if not self._paused_queues or self._ordered_executor.full():
+            return
+        paused, self._paused_queues = self._paused_queues, set()
+        for name in paused:
+            queue = self._queue_manager.queues[name]
+            if queue.consumer_tag is None:
+                # otherwise the cancel is not confirmed yet and the queue is resumed once it is
+                self._resume_consumer(queue)
+
+    def _resume_consumer(self, queue: Queue) -> None:
+        """Consumes a paused queue again without running the ready callbacks"""
+        if self._closing:
+            return
+        self._logger.info("Ordering lanes drained, resuming consumer of queue %s", queue.name)
+        self._request_consumer(queue, notify_ready=False)
+
+    def _ordering_key(self, ordering_key: Union[str, Callable], properties: BasicProperties, body: bytes) -> Any:
+        """
+        Extracts the ordering key of a message. A str names a header, or a top level body field if the header is missing.
+        A callable is called with the properties and the decoded body. Returns None if the key cannot be extracted.
+        """
+        if not callable(ordering_key) and properties.headers and ordering_key in properties.headers:
+            return properties.headers[ordering_key]
+        if properties.headers and CLAIM_CHECK_HEADER in properties.headers:
+            # fetching the body from S3 would block the ioloop
+            self._logger.debug("Could not extract ordering key from a claim checked body")
+            return None
+        try:
+            message = self._loads(properties, body)
+            if callable(ordering_key):
+                return ordering_key(properties, message)
+            return message.get(ordering_key) if isinstance(message, dict) else None
+        except Exception as ex:  # pylint: disable=broad-except
+            # the worker rejects messages that cannot be decoded
+            self._logger.debug("Could not extract ordering key: %s", ex)
+            return None
+
+    def _add_to_batch(
+        self,
+        channel: Channel,
+        queue: Queue,
+        binding_key: str,
+        binding: Dict,
+        basic_deliver: Basic.Deliver,
+        properties: BasicProperties,
+        body: bytes,
+    ) -> None:
+        """Adds the message to the batch for its binding. Hands the batch to the callback once full or after max_wait_ms."""
+        # registered right away so a multiple ack of a later delivery on the channel does not cover it while it waits
+        coalescer = self._coalescer_for(channel)
+        if coalescer is not None:
+            coalescer.delivered(basic_deliver.delivery_tag)
+        key = (queue.name, binding_key)
+        batch = self._batches.setdefault(key, [])
+        batch.append((basic_deliver, properties, body))
+        if len(batch) >= binding["max_batch"]:
+            self._flush_batch(key, binding)
+        elif len(batch) == 1:
+            cb = functools.partial(self._on_batch_timeout, key, binding)
+            self._batch_timers[key] = self._connection.ioloop.call_later(binding["max_wait_ms"] / 1000, cb)
+
+    def _on_batch_timeout(self, key: Tuple[str, str], binding: Dict) -> None:
+        """Called when a batch has waited max_wait_ms without filling up"""
+        self._batch_timers.pop(key, None)
+        self._flush_batch(key, binding)
+
+    def _flush_batch(self, key: Tuple[str, str], binding: Dict) -> None:
+        """Starts processing the batch on the thread pool"""
+        timer = self._batch_timers.pop(key, None)
+        if timer is not None:
+            self._connection.ioloop.remove_timeout(timer)
+        batch = self._batches.pop(key, None)
+        if not batch:
+            return
+        self._logger.debug("Processing batch of %s messages for %s", len(batch), key)
+        task = self._thread_pool_executor.submit(self._batch_callback_wrapper, binding["function"], batch, key[0], time.perf_counter())
+        self._metrics.in_flight.inc(len(batch))
+        self._track_task(task, [basic_deliver for basic_deliver, _, _ in batch])
+
+    def _flush_all_batches(self) -> None:
+        """Starts processing every partially filled batch"""
+        for queue_name, binding_key in list(self._batches):
+            self._flush_batch((queue_name, binding_key), self._queue_manager.queues[queue_name].bindings[binding_key])
+
+    def _drop_batches(self, channel_index: Optional[int] = None) -> None:
+        """
+        Forgets batched deliveries from channels that have closed. The broker redelivers them.
+
+        :param channel_index: Only drop batches of queues consumed on this consumer channel. Drops every batch when None
+        """
+        for key in list(self._batches):
+            if channel_index is not None and self._queue_channels.get(key[0]) != channel_index:
+                continue
+            timer = self._batch_timers.pop(key, None)
+            if timer is not None:
+                self._connection.ioloop.remove_timeout(timer)
+            del self._batches[key]
+
+    def _batch_callback_wrapper(
+        self, cb: Callable, batch: List[Tuple[Basic.Deliver, BasicProperties, bytes]], queue_name: str = "", submitted_at: Optional[float] = None
+    ) -> None:
+        """
+        Decodes every message in the batch and calls the batch callback with the list of (properties, message) pairs.
+        Messages that cannot be decoded are rejected and left out of the list. The callback may return the indexes of
+        the items that failed, only those are rejected. If the callback raises or returns anything else, the whole
+        batch is rejected.
+        """
+        try:
+            if submitted_at is not None:
+                self._metrics.queued_seconds.observe(time.perf_counter() - submitted_at, queue=queue_name)
+            items = []
+            delivered = []
+            for basic_deliver, properties, body in batch:
+                try:
+                    items.append(self._decode_message(basic_deliver, properties, body))
+                    delivered.append(basic_deliver)
+                except Exception as ex:  # pylint: disable=broad-except
+                    self._on_callback_error(basic_deliver, ex, queue_name)
+            if not items:
+                return
+
+            start_time = time.perf_counter()
+            try:
+                failed = set(cb(items) or ())
+                if any(isinstance(index, bool) or not isinstance(index, int) or not 0 <= index < len(items) for index in failed):
+                    raise TypeError(f"Batch callback must return the indexes of the failed items, got {sorted(failed, key=repr)}")
+            except Exception as ex:  # pylint: disable=broad-except
+                self._logger.error("Error handling batch callback, rejecting %s messages: %s", len(items), ex)
+                self._logger.error("%s", traceback.format_exc())
+                failed = set(range(len(items)))
+            elapsed = time.perf_counter() - start_time
+            self._logger.debug("Processing batch of %s events took %s seconds", len(items), elapsed)
+            self._metrics.handler_seconds.observe(elapsed, queue=queue_name, routing_key=delivered[0].routing_key)
+
+            if failed:
+                self._logger.error("Rejecting %s of %s messages that failed in the batch callback", len(failed), len(items))
+            for index, basic_deliver in enumerate(delivered):
+                ack = index not in failed
+                counter = self._metrics.acked if ack else self._metrics.rejected
+                counter.inc(queue=queue_name, routing_key=basic_deliver.routing_key)
+                self._settle_threadsafe(basic_deliver, ack=ack)
+        finally:
+            self._metrics.in_flight.dec(len(batch))
+
+    def _track_task(self, task: Future, deliveries: List[Basic.Deliver]) -> None:
+        """Tracks the task until it finishes, along with the deliveries it settles"""
+        with self._tasks_condition:
+            self._tasks[task] = deliveries
         task.add_done_callback(self._notify_thread_done)
 
-    def _notify_thread_done(self, task) -> None:
-        """Called when a thread finishes"""
-        self._logger.info("Thread finished")
-        self._tasks.remove(task)
+    def _notify_thread_done(self, task: Future) -> None:
+        """Called when a task finishes. Finishes stopping once the last task is done while draining."""
+        with self._tasks_condition:
+            self._tasks.pop(task, None)
+            if self._tasks:
+                return
+            self._tasks_condition.notify_all()
+            finish = self._draining
+            self._draining = False
+        if finish:
+            self._connection.ioloop.add_callback_threadsafe(self._final_stop)
 
     def _callback_wrapper(
-        self, cb: Callable, basic_deliver: Basic.Deliver, properties: BasicProperties, body: bytes, reply_expected=True
+        self,
+        cb: Callable,
+        basic_deliver: Basic.Deliver,
+        properties: BasicProperties,
+        body: bytes,
+        reply_expected=True,
+        queue_name: str = "",
+        submitted_at: Optional[float] = None,
     ) -> None:
         """Used to help with error handling of the message. Decodes the message body and calls the message callback. Sends reply to if requested."""
         try:
-            # measure execution time of the event
-            start_time = time.process_time()
-
-            newProperties = extendProperties.from_BasicProperties(oldprop=properties, delivery_prop=basic_deliver)
-            response = cb(newProperties, json.loads(body.decode("utf-8"), strict=False))
-
-            end_time = time.process_time()
-            self._logger.debug("Processing event took %s seconds", (end_time - start_time))
-
-            if response and properties.reply_to:
-                reply_to_headers = None
-                if "Reply-To-Headers" in properties.headers:
-                    reply_to_headers = properties.headers["Reply-To-Headers"]
-                reply_cb = functools.partial(
-                    self._publish_message,
-                    message=response,
-                    routing_key=properties.reply_to,
-                    reply_to_callback=properties.headers["Reply-To-Callback"],
-                    reply_to_headers=reply_to_headers,
-                    correlation_id=properties.correlation_id,
-                )
-                self._connection.ioloop.add_callback_threadsafe(reply_cb)
-            elif response and not properties.reply_to:
-                self._logger.warning("Callback returned data but no reply to was requested")
-            elif not response and reply_expected and properties.reply_to:
-                self._logger.error("Reply-to was requested but no data was returned from the callback")
+            if submitted_at is not None:
+                self._metrics.queued_seconds.observe(time.perf_counter() - submitted_at, queue=queue_name)
+            dedup_key = self._dedup_key_of(properties, queue_name)
+            if dedup_key is not None and self._is_duplicate(basic_deliver, dedup_key, queue_name):
+                return
+            # measure wall clock execution time of the event, including time spent waiting on I/O
+            start_time = time.perf_counter()
+
+            response = cb(*self._decode_message(basic_deliver, properties, body))
+
+            elapsed = time.perf_counter() - start_time
+            self._logger.debug("Processing event took %s seconds", elapsed)
+            self._metrics.handler_seconds.observe(elapsed, queue=queue_name, routing_key=basic_deliver.routing_key)
+
+            self._on_callback_success(basic_deliver, properties, response, reply_expected, queue_name)
+            if dedup_key is not None:
+                self._remember_processed(dedup_key)
+        except Exception as ex:  # pylint: disable=broad-except
+            self._on_callback_error(basic_deliver, ex, queue_name, properties, body)
+        finally:
+            self._metrics.in_flight.dec()
 
-            cb = functools.partial(self._acknowledge_message, delivery_tag=basic_deliver.delivery_tag)
-            self._connection.ioloop.add_callback_threadsafe(cb)
-        except UnicodeDecodeError as ex:
+    def _dedup_key_of(self, properties: BasicProperties, queue_name: str) -> Optional[str]:
+        """:returns: The key the message is deduplicated by, scoped to the queue. None when deduplication is disabled or the message has no key"""
+        if self._dedup is None:
+            return None
+        key = self._dedup_key(properties) if self._dedup_key is not None else properties.correlation_id
+        return f"{queue_name}:{key}" if key else None
+
+    def _is_duplicate(self, basic_deliver: Basic.Deliver, dedup_key: str, queue_name: str) -> bool:
+        """
+        Acknowledges the message if it was processed before. A store that cannot be reached counts as a miss, so
+        messages are processed rather than held up.
+
+        :returns: True if the message is a duplicate and was acknowledged
+        """
+        try:
+            seen = self._dedup.seen(dedup_key)
+        except Exception as ex:  # pylint: disable=broad-except
+            self._logger.warning("Could not look up message in the dedup store, processing it: %s", ex)
+            seen = False
+        if not seen:
+            self._metrics.dedup_misses.inc(queue=queue_name)
+            return False
+        self._logger.info("Acknowledging duplicate message %s without processing it", dedup_key)
+        self._metrics.dedup_hits.inc(queue=queue_name)
+        self._settle_threadsafe(basic_deliver, ack=True)
+        self._metrics.acked.inc(queue=queue_name, routing_key=basic_deliver.routing_key)
+        return True
+
+    def _remember_processed(self, dedup_key: str) -> None:
+        """Adds the processed message to the dedup store"""
+        try:
+            self._dedup.add(dedup_key)
+        except Exception as ex:  # pylint: disable=broad-except
+            self._logger.warning("Could not add message to the dedup store: %s", ex)
+
+    def _on_callback_success(
+        self, basic_deliver: Basic.Deliver, properties: BasicProperties, response: Any, reply_expected: bool, queue_name: str = ""
+    ) -> None:
+        """Sends the reply to if requested and acknowledges the message"""
+        if self._reply_threadsafe(properties, response, reply_expected):
+            self._metrics.replies.inc(queue=queue_name, routing_key=basic_deliver.routing_key)
+        self._settle_threadsafe(basic_deliver, ack=True)
+        self._metrics.acked.inc(queue=queue_name, routing_key=basic_deliver.routing_key)
+
+    def _decode_message(self, basic_deliver: Basic.Deliver, properties: BasicProperties, body: bytes) -> Tuple[DeliveryContext, Union[Dict, List]]:
+        """Builds the properties and the decoded message body that are passed to the message callback"""
+        return DeliveryContext(properties, basic_deliver), self._loads(properties, body)
+
+    def _loads(self, properties: BasicProperties, body: bytes) -> Union[Dict, List]:
+        """
+        Fetches the body from S3 if the message carries a claim check, decompresses it by its content encoding and
+        decodes it by its content type, as JSON if it has none. Called on the worker thread.
+        """
+        if properties.headers and CLAIM_CHECK_HEADER in properties.headers:
+            body = self._claim_check_reader.get(properties.headers[CLAIM_CHECK_HEADER])
+            self._metrics.claim_checks_fetched.inc()
+        serializer = self._serializers[properties.content_type or JSON_CONTENT_TYPE]
+        return serializer.loads(decompress(body, properties.content_encoding))
+
+    def _on_callback_error(
+        self,
+        basic_deliver: Basic.Deliver,
+        ex: Exception,
+        queue_name: str = "",
+        properties: Optional[BasicProperties] = None,
+        body: Optional[bytes] = None,
+    ) -> None:
+        """
+        Logs why the message could not be processed. Sends it to a retry queue if its queue has a retry policy and
+        attempts are left, rejects it otherwise.
+
+        :param properties: The message properties, needed to retry the message
+        :param body: The raw message body, needed to retry the message
+        """
+        if isinstance(ex, UnicodeDecodeError):
             self._logger.error("Could not decode message: %s", ex)
-            cb = functools.partial(self._reject_message, delivery_tag=basic_deliver.delivery_tag)
-            self._connection.ioloop.add_callback_threadsafe(cb)
-        except json.JSONDecodeError as ex:
+        elif isinstance(ex, DecompressionError):
+            self._logger.error("Could not decompress message: %s", ex)
+        elif isinstance(ex, DeserializationError):
+            self._logger.error("Could not load message: %s", ex)
+        elif isinstance(ex, ClaimCheckException):
+            self._logger.error("Could not fetch claim checked message: %s", ex)
+        elif isinstance(ex, json.JSONDecodeError):
             self._logger.error("Could not load message json: %s", ex)
-            cb = functools.partial(self._reject_message, delivery_tag=basic_deliver.delivery_tag)
-            self._connection.ioloop.add_callback_threadsafe(cb)
-        except Exception as ex:  # pylint: disable=broad-except
+        else:
             self._logger.error("Error handling callback: %s", ex)
-            self._logger.error("%s", traceback.format_exc())
-            cb = functools.partial(self._reject_message, delivery_tag=basic_deliver.delivery_tag)
-            self._connection.ioloop.add_callback_threadsafe(cb)
+            self._logger.error("%s", "".join(traceback.format_exception(type(ex), ex, ex.__traceback__)))
+        policy = self._retry_policies.get(queue_name)
+        if policy is not None and body is not None and not isinstance(ex, UNRETRYABLE_ERRORS):
+            if self._retry_threadsafe(basic_deliver, properties, body, policy, queue_name):
+                return
+        self._settle_threadsafe(basic_deliver, ack=False)
+        self._metrics.rejected.inc(queue=queue_name, routing_key=basic_deliver.routing_key)
+
+    def _retry_threadsafe(
+        self, basic_deliver: Basic.Deliver, properties: BasicProperties, body: bytes, policy: RetryPolicy, queue_name: str
+    ) -> bool:
+        """
+        Publishes the failed message to the retry queue of its attempt. The message is acknowledged once the retry is published.
+
+        :returns: False if the message has no attempts left
+        """
+        headers = dict(properties.headers or {})
+        attempt = int(headers.get(RETRY_ATTEMPT_HEADER, 0)) + 1
+        if attempt >= policy.max_attempts:
+            self._logger.error("Giving up on message after %s attempts", attempt)
+            return False
+        headers[RETRY_ATTEMPT_HEADER] = attempt
+        headers[RETRY_EXCHANGE_HEADER] = basic_deliver.exchange
+        headers[RETRY_ROUTING_KEY_HEADER] = basic_deliver.routing_key
+        retry_properties = pika.BasicProperties(**{name: getattr(properties, name) for name in PROPERTY_NAMES})
+        retry_properties.headers = headers
+        # the broker refuses a user ID that is not the one this connection authenticated with
+        retry_properties.user_id = self.username
+        publish = BufferedPublish("", policy.retry_queue_name(queue_name, attempt), body, retry_properties, True, None)
+        self._logger.warning("Retrying message in %s seconds, attempt %s of %s", policy.delay(attempt), attempt + 1, policy.max_attempts)
+        cb = functools.partial(self._publish_retry, publish, basic_deliver, queue_name)
+        self._connection.ioloop.add_callback_threadsafe(cb)
+        return True
+
+    def _publish_retry(self, publish: BufferedPublish, basic_deliver: Basic.Deliver, queue_name: str) -> None:
+        """
+        Publishes the retry. With publisher confirms the failed message is only acknowledged once the broker has the retry.
+        Without them it is acknowledged once the retry is sent or buffered, and rejected if the retry was dropped.
+        """
+        if self._confirm_tracker is not None:
+            publish = publish._replace(future=Future())
+            publish.future.add_done_callback(functools.partial(self._on_retry_confirm, basic_deliver=basic_deliver, queue_name=queue_name))
+            self._send(publish)
+            return
+        if not self._send(publish):
+            self._logger.error("Could not publish retry, rejecting message")
+            self._settle_threadsafe(basic_deliver, ack=False)
+            self._metrics.rejected.inc(queue=queue_name, routing_key=basic_deliver.routing_key)
+            return
+        self._settle_threadsafe(basic_deliver, ack=True)
+        self._metrics.retried.inc(queue=queue_name, routing_key=basic_deliver.routing_key)
+
+    def _on_retry_confirm(self, future: Future, basic_deliver: Basic.Deliver, queue_name: str) -> None:
+        """Acknowledges the failed message once its retry is confirmed, rejects it if the retry could not be published"""
+        if future.exception() is not None:
+            self._logger.error("Could not publish retry, rejecting message: %s", future.exception())
+            self._settle_threadsafe(basic_deliver, ack=False)
+            self._metrics.rejected.inc(queue=queue_name, routing_key=basic_deliver.routing_key)
+            return
+        self._settle_threadsafe(basic_deliver, ack=True)
+        self._metrics.retried.inc(queue=queue_name, routing_key=basic_deliver.routing_key)
+
+    def _reply_threadsafe(self, properties: BasicProperties, response: Optional[Union[Dict, List]], reply_expected: bool) -> bool:
+        """
+        Sends the callback response to the requester if a reply-to was requested
+
+        :returns: True if a reply was sent
+        """
+        if response and properties.reply_to:
+            reply_to_headers = None
+            if "Reply-To-Headers" in properties.headers:
+                reply_to_headers = properties.headers["Reply-To-Headers"]
+            reply_cb = functools.partial(
+                self._publish_message,
+                message=response,
+                encoded=self._encode_body(response, properties.content_type),
+                routing_key=properties.reply_to,
+                reply_to_callback=properties.headers["Reply-To-Callback"],
+                reply_to_headers=reply_to_headers,
+                correlation_id=properties.correlation_id,
+            )
+            self._connection.ioloop.add_callback_threadsafe(reply_cb)
+            return True
+        if response and not properties.reply_to:
+            self._logger.warning("Callback returned data but no reply to was requested")
+        elif not response and reply_expected and properties.reply_to:
+            self._logger.error("Reply-to was requested but no data was returned from the callback")
+        return False
 
     def _on_reply_to(self, properties: BasicProperties, body: Union[Dict, List]) -> None:
         """Called when the message is a reply to. Calls the reply to callback based on the Reply-To-Callback header."""
+        callback = self._reply_to_callback(properties, body)
+        if callback is None:
+            return None
+        return callback(properties, body)
+
+    def _reply_to_callback(self, properties: BasicProperties, body: Union[Dict, List]) -> Optional[Callable]:
+        """
+        Resolves the request the reply is for, or finds the reply to callback named by the Reply-To-Callback header
+
+        :returns: The reply to callback, None if the reply resolved a request or cannot be processed
+        """
         self._logger.debug("Processing reply-to")
+        future = self._pop_pending_request(properties.correlation_id)
+        if future is not None:
+            self._logger.debug("Resolving request with correlation id %s", properties.correlation_id)
+            if not future.done():
+                future.set_result(body)
+            return None
+
         if properties.headers is None or "Reply-To-Callback" not in properties.headers:
             self._logger.error("Reply-to is missing the 'Reply-To-Callback' header. Cannot process reply-to")
             return None
@@ -483,17 +1532,66 @@ class Eventhub:
 
         callback_name = properties.headers["Reply-To-Callback"]
         self._logger.debug("Calling %s to process reply-to", callback_name)
-        return self._reply_to_callbacks[callback_name](properties, body)
+        return self._reply_to_callbacks[callback_name]
 
-    def _reject_message(self, delivery_tag: str) -> None:
+    def _reject_message(self, delivery_tag: int, channel: Optional[Channel]) -> None:
         """Rejects and dequeues the message."""
         self._logger.debug("Rejecting message %s", delivery_tag)
-        self._channel.basic_reject(delivery_tag, requeue=False)
+        if self._can_settle(channel):
+            channel.basic_reject(delivery_tag, requeue=False)
 
-    def _acknowledge_message(self, delivery_tag: str) -> None:
+    def _requeue_message(self, delivery_tag: int, channel: Optional[Channel]) -> None:
+        """Rejects the message and puts it back on the queue for another consumer."""
+        self._logger.debug("Requeueing message %s", delivery_tag)
+        if self._can_settle(channel):
+            channel.basic_reject(delivery_tag, requeue=True)
+
+    def _acknowledge_message(self, delivery_tag: int, channel: Optional[Channel]) -> None:
         """Acknowledges the message."""
         self._logger.debug("Acknowledging message %s", delivery_tag)
-        self._channel.basic_ack(delivery_tag)
+        if self._can_settle(channel):
+            channel.basic_ack(delivery_tag)
+
+    def _can_settle(self, channel: Optional[Channel]) -> bool:
+        """Deliveries can only be settled on the open channel they arrived on. The broker redelivers them otherwise."""
+        if channel is None or not channel.is_open:
+            self._logger.warning("Channel is not open, the broker will redeliver unsettled messages")
+            return False
+        return True
+
+    def _channel_for(self, basic_deliver: Basic.Deliver) -> Optional[Channel]:
+        """The channel the message was delivered on, None if it has closed since"""
+        return self._channels_by_consumer_tag.get(basic_deliver.consumer_tag)
+
+    def _coalescer_for(self, channel: Optional[Channel]) -> Optional[AckCoalescer]:
+        """The ack coalescer of a consumer channel, created when the channel opens. None when acks are not coalesced."""
+        return self._ack_coalescers.get(channel) if channel is not None else None
+
+    def _settle_threadsafe(self, basic_deliver: Basic.Deliver, ack: bool) -> None:
+        """Acknowledges or rejects the message from a worker thread. Hands the delivery to the ack coalescer when enabled."""
+        channel = self._channel_for(basic_deliver)
+        coalescer = self._ack_coalescers.get(channel)
+        if coalescer is None:
+            cb = functools.partial(self._acknowledge_message if ack else self._reject_message, basic_deliver.delivery_tag, channel)
+            self._connection.ioloop.add_callback_threadsafe(cb)
+        elif coalescer.settle(basic_deliver.delivery_tag, ack):
+            # only the first delivery settled since the last flush wakes up the ioloop
+            self._connection.ioloop.add_callback_threadsafe(self._schedule_ack_flush)
+
+    def _schedule_ack_flush(self) -> None:
+        """Flushes the coalesced acks now or after the configured flush interval"""
+        if self._ack_flush_interval_ms > 0:
+            self._connection.ioloop.call_later(self._ack_flush_interval_ms / 1000, self._flush_acks)
+        else:
+            self._flush_acks()
+
+    def _flush_acks(self) -> None:
+        """Sends the acks and rejects collected by the ack coalescers on their channels"""
+        for channel, coalescer in list(self._ack_coalescers.items()):
+            if not channel.is_open:
+                continue
+            frames = coalescer.flush(channel)
+            self._logger.debug("Flushed coalesced acks in %s frames, %s deliveries still pending", frames, len(coalescer))
 
     def run(self, mq_endpoint: str, username: str = "guest", password: str = "guest") -> None:  # nosec
         """
@@ -506,10 +1604,16 @@ class Eventhub:
         :param mq_endpoint: MQ endpoint
         """
         self.mq_endpoint = mq_endpoint
+        self._credentials = (username, password)
 
-        while not self._closing:
-            self._connection = self._connect(username, password)
-            self._connection.ioloop.start()
+        if self._metrics_port is not None and self._metrics_server is None:
+            self._metrics_server = MetricsServer(self._metrics.registry, self._metrics_port)
+            self._metrics_server.start()
+            self._logger.info("Serving metrics on port %s", self._metrics_server.port)
+
+        # the ioloop keeps running across reconnects, it stops once the service has stopped
+        self._connection = self._connect(username, password)
+        self._connection.ioloop.start()
 
     def publish_message_with_callbacks_campus(
         self,
@@ -521,7 +1625,8 @@ class Eventhub:
         correlation_id: Optional[str] = None,
         priority: Optional[int] = None,
         mandatory: bool = True,
-    ) -> str:
+        content_type: Optional[str] = None,
+    ) -> Union[str, Future]:
         """
         Ease of use function to automatically specify the campus name for the exchange
 
@@ -533,8 +1638,10 @@ class Eventhub:
         :param correlation_id: The message correlation ID to use
         :param priority: The priority of the message
         :param mandatory: If the message must be routable to a queue
+        :param content_type: Content type to encode the message with, such as 'application/msgpack'. Defaults to the content type of the Eventhub
 
-        :returns: The UUID used for the message ID
+        :raises ValueError: Raised when there is no serializer for the content type
+        :returns: The UUID used for the message ID, or a Future resolved with it when publisher confirms are enabled
         """
         return self.publish_message_with_callbacks(
             message,
@@ -546,6 +1653,7 @@ class Eventhub:
             correlation_id=correlation_id,
             priority=priority,
             mandatory=mandatory,
+            content_type=content_type,
         )
 
     def publish_message_with_callbacks(
@@ -559,9 +1667,15 @@ class Eventhub:
         correlation_id: Optional[str] = None,
         priority: Optional[int] = None,
         mandatory: bool = True,
-    ) -> str:
+        content_type: Optional[str] = None,
+    ) -> Union[str, Future]:
         """
-        Publishes a message to the MQ using a thread safe callback
+        Publishes a message to the MQ using a thread safe callback.
+
+        When publisher confirms are enabled a Future is returned instead of the message ID. It resolves with the message ID
+        once the broker has taken responsibility for the message and raises `MessageNackedException` if the broker nacks
+        it or the channel closes first, or `MessageReturnedException` if a mandatory message could not be routed.
+        Done callbacks added to the Future run on the ioloop thread and must not block.
 
         :param message: JSON message to send
         :param routing_key: Key used to route the message
@@ -572,14 +1686,18 @@ class Eventhub:
         :param correlation_id: The message correlation ID to use
         :param priority: The priority of the message
         :param mandatory: If the message must be routable to a queue
+        :param content_type: Content type to encode the message with, such as 'application/msgpack'. Defaults to the content type of the Eventhub
 
-        :returns: The UUID used for the message ID
+        :raises ValueError: Raised when there is no serializer for the content type
+        :returns: The UUID used for the message ID, or a Future resolved with it when publisher confirms are enabled
         """
         if not correlation_id:
             correlation_id = uuid.uuid4().hex
+        future = Future() if self._confirm_tracker is not None else None
         cb = functools.partial(
-            self._publish_message,
+            self._publish_or_fail,
             message=message,
+            encoded=self._encode_body(message, content_type),
             routing_key=routing_key,
             exchange=exchange,
             reply_to=reply_to,
@@ -588,9 +1706,136 @@ class Eventhub:
             correlation_id=correlation_id,
             priority=priority,
             mandatory=mandatory,
+            future=future,
         )
         self._connection.ioloop.add_callback_threadsafe(cb)
-        return correlation_id
+        return future if future is not None else correlation_id
+
+    def request(
+        self,
+        message: Union[Dict, List],
+        routing_key: str,
+        timeout: float = 300,
+        exchange: str = "",
+        reply_to_headers: Optional[Dict] = None,
+        priority: Optional[int] = None,
+        content_type: Optional[str] = None,
+    ) -> Future:
+        """
+        Sends a request and returns a Future resolved with the reply body once a reply with the same correlation ID arrives.
+        Thread safe and never blocks, so many requests can be in flight at once. Use `concurrent.futures.wait` to
+        gather them or `asyncio.wrap_future` to await them. The reply-to queue must be registered with
+        `enable_requests` or one of the `register_on_reply_to_callback` methods.
+
+        The Future raises `TimeoutError` if no reply arrives within `timeout` seconds and `RequestLimitException`
+        when `max_pending_requests` requests are already waiting for a reply.
+
+        :param message: JSON message to send
+        :param routing_key: Key used to route the message
+        :param timeout: Seconds to wait for the reply
+        :param exchange: The exchange to publish to
+        :param reply_to_headers: Headers added as part of the message properties that will be sent back with the reply
+        :param priority: The priority of the message
+        :param content_type: Content type to encode the message with. The reply is sent with the same content type
+
+        :raises AttributeError: Raised when the reply-to queue has not been registered
+        :raises ValueError: Raised when there is no serializer for the content type
+        :returns: Future resolved with the reply body
+        """
+        if self._reply_queue_name is None:
+            raise AttributeError("Cannot send requests without a reply-to queue. Register one with `enable_requests`")
+
+        correlation_id = uuid.uuid4().hex
+        encoded = self._encode_body(message, content_type)
+        future: Future = Future()
+        with self._pending_requests_lock:
+            if len(self._pending_requests) >= self._max_pending_requests:
+                future.set_exception(RequestLimitException(f"{len(self._pending_requests)} requests are already waiting for a reply"))
+                return future
+            self._pending_requests[correlation_id] = PendingRequest(future, None)
+
+        cb = functools.partial(
+            self._publish_request,
+            message=message,
+            encoded=encoded,
+            routing_key=routing_key,
+            timeout=timeout,
+            exchange=exchange,
+            reply_to_headers=reply_to_headers,
+            correlation_id=correlation_id,
+            priority=priority,
+        )
+        self._connection.ioloop.add_callback_threadsafe(cb)
+        return future
+
+    def _publish_request(self, timeout: float, correlation_id: str, **kwargs) -> None:
+        """Publishes the request and starts its timeout. Called on the ioloop thread."""
+        confirm = Future() if self._confirm_tracker is not None else None
+        if confirm is not None:
+            # fail the request right away if the broker never takes the message
+            confirm.add_done_callback(functools.partial(self._on_request_confirm, correlation_id=correlation_id))
+        self._publish_or_fail(
+            reply_to=True,
+            reply_to_callback=REQUEST_REPLY_CALLBACK,
+            correlation_id=correlation_id,
+            future=confirm,
+            **kwargs,
+        )
+        with self._pending_requests_lock:
+            pending = self._pending_requests.get(correlation_id)
+            # the request is already failed if the publish was dropped
+            if pending is not None:
+                timer = self._connection.ioloop.call_later(timeout, functools.partial(self._expire_request, correlation_id, timeout))
+                self._pending_requests[correlation_id] = pending._replace(timer=timer)
+
+    def _on_request_confirm(self, confirm: Future, correlation_id: str) -> None:
+        """Fails the request when the broker nacked or returned it"""
+        if confirm.exception() is None:
+            return
+        future = self._pop_pending_request(correlation_id)
+        if future is not None and not future.done():
+            future.set_exception(confirm.exception())
+
+    def _expire_request(self, correlation_id: str, timeout: float) -> None:
+        """Fails the request if no reply has arrived yet. Its timer has fired, so it is not stopped."""
+        with self._pending_requests_lock:
+            pending = self._pending_requests.pop(correlation_id, None)
+        if pending is not None and not pending.future.done():
+            self._logger.error("Request timed out before a reply was received, correlation id: %s", correlation_id)
+            pending.future.set_exception(TimeoutError(f"No reply received within {timeout} seconds"))
+
+    def _pop_pending_request(self, correlation_id: Optional[str]) -> Optional[Future]:
+        """Removes the request from the pending request table and stops its timeout. Thread safe."""
+        with self._pending_requests_lock:
+            pending = self._pending_requests.pop(correlation_id, None)
+        if pending is None:
+            return None
+        if pending.timer is not None:
+            cb = functools.partial(self._connection.ioloop.remove_timeout, pending.timer)
+            self._connection.ioloop.add_callback_threadsafe(cb)
+        return pending.future
+
+    def _fail_pending_requests(self, reason: str) -> None:
+        """Fails every request still waiting for a reply"""
+        with self._pending_requests_lock:
+            pending, self._pending_requests = self._pending_requests, {}
+        for future, timer in pending.values():
+            if timer is not None:
+                self._connection.ioloop.remove_timeout(timer)
+            if not future.done():
+                future.set_exception(TimeoutError(reason))
+
+    def _publish_or_fail(self, future: Optional[Future] = None, **kwargs) -> None:
+        """
+        Publishes the message with `_publish_message` on the ioloop thread. If it raises, the future is failed with the
+        error before it is raised, so callers waiting on the confirm are not left hanging.
+        """
+        try:
+            self._publish_message(future=future, **kwargs)
+        except (AttributeError, ValueError) as ex:
+            if future is not None and not future.done():
+                future.set_exception(ex)
+            raise
 
     def _publish_message(
         self,
@@ -602,7 +1847,10 @@ class Eventhub:
         reply_to_headers: Optional[Dict] = None,
         correlation_id: Optional[str] = None,
         priority: Optional[int] = None,
-        mandatory: bool = True
+        mandatory: bool = True,
+        future: Optional[Future] = None,
+        encoded: Optional[EncodedBody] = None,
+        content_type: Optional[str] = None,
     ) -> None:
         """
         Publishes a message to the MQ.
@@ -616,21 +1864,21 @@ class Eventhub:
         :param correlation_id: The message correlation ID to use
         :param priority: The priority of the message
         :param mandatory: If the message must be routable to a queue
+        :param future: Future resolved when the broker confirms the message. Only used when publisher confirms are enabled
+        :param encoded: The message encoded by `_encode_body`, so large messages are encoded, compressed and offloaded on
+            the calling thread instead of the ioloop. The message is encoded here when not set
+        :param content_type: Content type to encode the message with when it is not encoded yet. Defaults to the content type of the Eventhub
 
         :raises AttributeError: Raised when no reply_to callbacks have been registered and reply_to has been requested
         :raises ValueError: Raised when reply_to_callback is not set and reply_to is True
         """
-        if self._channel is None or not self._channel.is_open:
-            self._logger.error("Channel must be open to publish messages")
-            return
-
         if not correlation_id:
             correlation_id = uuid.uuid4().hex
 
         reply_to_queue = None
-        if reply_to and len(self._reply_to_callbacks) > 0:
+        if reply_to and self._reply_queue_name is not None:
             reply_to_queue = self._reply_queue_name # Set Queue Name from memory. We aren't sure they registered with the _campus or the normal function without this.
-        elif reply_to and len(self._reply_to_callbacks) == 0:
+        elif reply_to:
             raise AttributeError(
                 "Cannot set reply to when there are no reply_to callbacks registered. If you would"
                 "like to register a reply_to callback, use the function `register_on_reply_to_callback`"
@@ -652,30 +1900,264 @@ class Eventhub:
             else:
                 headers["Reply-To-Callback"] = reply_to_callback.__qualname__
 
+        if encoded is None:
+            encoded = self._encode_body(message, content_type)
+        if encoded.claim_check is not None:
+            if headers is None:
+                headers = {}
+            headers[CLAIM_CHECK_HEADER] = encoded.claim_check
         properties = pika.BasicProperties(
             app_id=self.__class__.__name__,
             user_id=self.username,
-            content_type="application/json",
-            content_encoding="utf-8",
+            content_type=encoded.content_type,
+            content_encoding=encoded.content_encoding,
             reply_to=reply_to_queue,
             correlation_id=correlation_id,
             priority=priority,
             headers=headers,
         )
+        self._send(BufferedPublish(exchange, routing_key, encoded.body, properties, mandatory, future))
+
+    def _send(self, publish: BufferedPublish) -> bool:
+        """
+        Sends the publish now, or buffers it until the publish channel is open and the topology is declared
 
+        :returns: False if the publish was dropped because it could not be buffered
+        """
+        # publishes wait for the topology so they never reach an exchange before it is declared, and queue behind
+        # publishes that are already buffered to keep their order
+        if self._channel is None or not self._channel.is_open or not self._topology_declared or self._publish_buffer or self._spool:
+            return self._buffer_publish(publish)
+        self._basic_publish(publish)
+        return True
+
+    def _encode_body(self, message: Union[Dict, List], content_type: Optional[str] = None) -> EncodedBody:
+        """
+        Encodes the message with the serializer for the content type, compresses it if it is larger than the
+        compression threshold and stores it in S3 if it is still larger than the claim check threshold.
+        Thread safe, called on the publishing thread.
+
+        :param content_type: Content type to encode the message with. Defaults to the content type of the Eventhub
+
+        :raises ValueError: Raised when there is no serializer for the content type
+        :raises ClaimCheckException: Raised when the body could not be stored in S3
+        :returns: The encoded message
+        """
+        content_type = content_type or self._content_type
+        serializer = self._serializers.get(content_type)
+        if serializer is None:
+            raise ValueError(f"No serializer for content type '{content_type}'. Must be one of {sorted(self._serializers)}")
+        body, content_encoding = self._compress(serializer.dumps(message), content_type)
+        if self._claim_check is None or len(body) <= self._claim_check_threshold:
+            return EncodedBody(body, content_type, content_encoding, None)
+        reference = self._claim_check.put(body)
+        self._metrics.claim_checks_stored.inc()
+        self._metrics.claim_check_bytes.inc(len(body))
+        return EncodedBody(b"", content_type, content_encoding, reference)
+
+    def _compress(self, body: bytes, content_type: str) -> Tuple[bytes, str]:
+        """
+        Compresses the body if it is larger than the compression threshold and gets smaller.
+        Uncompressed JSON bodies are labelled as UTF-8, other uncompressed bodies as identity since they are not text.
+
+        :param content_type: Content type the body is encoded with
+
+        :returns: The body and its content encoding
+        """
+        plain_encoding = PLAIN_ENCODING if content_type == JSON_CONTENT_TYPE else IDENTITY_ENCODING
+        if self._compressor is None or len(body) <= self._compression_threshold:
+            return body, plain_encoding
+        compressed = self._compressor.compress(body)
+        self._metrics.compressed_bytes_in.inc(len(body))
+        self._metrics.compression_ratio.observe(len(compressed) / len(body))
+        if len(compressed) >= len(body):
+            self._metrics.compressed_bytes_out.inc(len(body))
+            return body, plain_encoding
+        self._metrics.compressed_bytes_out.inc(len(compressed))
+        return compressed, self._compressor.name
+
+    def _basic_publish(self, publish: BufferedPublish) -> None:
+        """Sends an encoded message on the open publish channel."""
+        correlation_id = publish.properties.correlation_id
         try:
-            self._channel.basic_publish(exchange, routing_key, json.dumps(message), properties, mandatory=mandatory)
+            self._channel.basic_publish(
+                publish.exchange, publish.routing_key, publish.body, publish.properties, mandatory=publish.mandatory
+            )
+            if self._confirm_tracker is not None:
+                # every publish on the channel consumes a delivery tag, including replies nobody waits on
+                self._confirm_tracker.published(publish.future, result=correlation_id, correlation_id=correlation_id)
             self._logger.info(
                 "Published message to exchange '%s' with routing key '%s' and correlation id '%s'",
-                exchange,
-                routing_key,
+                publish.exchange,
+                publish.routing_key,
                 correlation_id,
             )
         except pika.exceptions.UnroutableError:
             self._logger.error("Message was unroutable")
+            if publish.future is not None and not publish.future.done():
+                publish.future.set_exception(MessageNackedException("Message was unroutable"))
+
+    def _buffer_publish(self, publish: BufferedPublish) -> bool:
+        """
+        Holds the publish until the publish channel is open, or drops it if the buffer is full or disabled.
+
+        :returns: False if the publish was dropped
+        """
+        if self._spool is not None:
+            return self._spool_publish(publish)
+        if self._publish_buffer is None or not self._publish_buffer.append(publish):
+            reason = "Channel must be open to publish messages" if self._publish_buffer is None else "Publish buffer is full"
+            self._logger.error("%s, dropping message with correlation id '%s'", reason, publish.properties.correlation_id)
+            self._metrics.publishes_dropped.inc()
+            if publish.future is not None and not publish.future.done():
+                publish.future.set_exception(MessageNackedException(reason))
+            return False
+        self._logger.debug("Buffered message with correlation id '%s' until the channel opens", publish.properties.correlation_id)
+        self._metrics.publish_buffer_depth.set(len(self._publish_buffer))
+        return True
+
+    def _flush_publish_buffer(self) -> None:
+        """Sends the buffered publishes in order while the publish channel stays open."""
+        if self._spool is not None:
+            self._replay_spool()
+        if not self._publish_buffer:
+            return
+        self._logger.info("Sending %s buffered messages", len(self._publish_buffer))
+        while self._publish_buffer and self._channel is not None and self._channel.is_open:
+            self._basic_publish(self._publish_buffer.popleft())
+        self._metrics.publish_buffer_depth.set(len(self._publish_buffer))
+
+    def _spool_publish(self, publish: BufferedPublish) -> bool:
+        """
+        Writes the publish to the spool, or drops it if the spool is full or cannot be written.
+
+        :returns: False if the publish was dropped
+        """
+        try:
+            position = self._spool.append(publish)
+        except (SpoolFullException, OSError) as ex:
+            self._logger.error("Could not spool message with correlation id '%s', dropping it: %s", publish.properties.correlation_id, ex)
+            self._metrics.publishes_dropped.inc()
+            if publish.future is not None and not publish.future.done():
+                publish.future.set_exception(MessageNackedException(str(ex)))
+            return False
+        if publish.future is not None:
+            self._spool_futures[position] = publish.future
+        self._metrics.spool_depth.set(len(self._spool))
+        return True
+
+    def _replay_spool(self) -> None:
+        """
+        Sends spooled publishes in order, one batch per ioloop turn so the ioloop keeps serving deliveries. With publisher
+        confirms publishes are committed as the broker confirms them, otherwise as soon as they are sent.
+        """
+        if self._spool_timer is not None:
+            # replaying now, a scheduled replay would run a second loop over the spool cursor
+            self._connection.ioloop.remove_timeout(self._spool_timer)
+            self._spool_timer = None
+        if self._channel is None or not self._channel.is_open or not self._topology_declared:
+            return
+        confirms = self._confirm_tracker is not None
+        limit = SPOOL_REPLAY_BATCH - len(self._spool_unconfirmed)
+        records = self._spool.read(limit) if limit > 0 else []
+        for position, publish in records:
+            future = None
+            if confirms:
+                future = Future()
+                self._spool_unconfirmed.append((position, future))
+                future.add_done_callback(self._on_spool_confirm)
+            self._basic_publish(publish._replace(future=future))
+        if records and not confirms:
+            self._commit_spool(records[-1][0])
+            if len(records) == limit:
+                self._schedule_spool_replay(0)
+
+    def _on_spool_confirm(self, _unused_future: Future) -> None:
+        """Commits the replayed publishes confirmed so far, or replays from the first one the broker did not take"""
+        committed = None
+        while self._spool_unconfirmed and self._spool_unconfirmed[0][1].done():
+            position, future = self._spool_unconfirmed.popleft()
+            ex = future.exception()
+            failed = ex is not None and not isinstance(ex, MessageReturnedException)
+            if failed and self._topology_declared:
+                # the channel is still open, so the broker nacked it
+                nacks = self._spool_nacks[position] = self._spool_nacks.get(position, 0) + 1
+                if nacks >= SPOOL_MAX_NACKS:
+                    self._logger.error("Dropping spooled message the broker nacked %s times: %s", nacks, ex)
+                    self._metrics.publishes_dropped.inc()
+                    failed = False
+            if failed:
+                # nacked or the channel closed. the spool keeps it and everything after it
+                self._logger.warning("Spooled message was not confirmed, replaying from it: %s", ex)
+                self._spool_unconfirmed.clear()
+                if committed is not None:
+                    self._commit_spool(committed)
+                self._spool.rewind()
+                self._schedule_spool_replay(CHANNEL_REOPEN_DELAY)
+                return
+            committed = position
+            self._resolve_spooled(position, future)
+        if committed is not None:
+            self._commit_spool(committed)
+            self._schedule_spool_replay(0)
+
+    def _resolve_spooled(self, position: SpoolPosition, confirm: Optional[Future]) -> None:
+        """Resolves the future returned for a spooled publish like its confirm, if anyone is waiting on it"""
+        future = self._spool_futures.pop(position, None)
+        if future is None or future.done() or confirm is None:
+            return
+        if confirm.exception() is not None:
+            future.set_exception(confirm.exception())
+        else:
+            future.set_result(confirm.result())
+
+    def _commit_spool(self, position: SpoolPosition) -> None:
+        """Marks spooled publishes up to the position as done"""
+        self._spool.commit(position)
+        self._spool_nacks = {nacked: nacks for nacked, nacks in self._spool_nacks.items() if nacked > position}
+        self._metrics.spool_depth.set(len(self._spool))
+
+    def _schedule_spool_replay(self, delay: float) -> None:
+        """Replays the next batch of spooled publishes after the delay, unless a replay is already scheduled"""
+        if self._spool_timer is None:
+            self._spool_timer = self._connection.ioloop.call_later(delay, self._on_spool_timer)
+
+    def _on_spool_timer(self) -> None:
+        """Called when a scheduled spool replay is due"""
+        self._spool_timer = None
+        self._replay_spool()
+
+    def _close_spool(self) -> None:
+        """Closes the spool. Publishes still in it are replayed the next time the service starts."""
+        if self._spool_futures:
+            self._logger.warning("%s spooled messages were not confirmed before stopping, they stay in the spool", len(self._spool_futures))
+        for future in self._spool_futures.values():
+            if not future.done():
+                future.set_exception(MessageNackedException("Eventhub stopped before the spooled message was confirmed"))
+        self._spool_futures = {}
+        self._spool_unconfirmed.clear()
+        self._spool.close()
+
+    def _fail_publish_buffer(self, reason: str) -> None:
+        """Drops every buffered publish, failing their futures"""
+        if not self._publish_buffer:
+            return
+        self._logger.warning("Dropping %s buffered messages: %s", len(self._publish_buffer), reason)
+        while self._publish_buffer:
+            publish = self._publish_buffer.popleft()
+            self._metrics.publishes_dropped.inc()
+            if publish.future is not None and not publish.future.done():
+                publish.future.set_exception(MessageNackedException(reason))
+        self._metrics.publish_buffer_depth.set(0)
 
     def register_on_message_callback_campus(
-        self, queue_name: str, bindings: Dict[str, Tuple[Dict, Callable]], max_priority: Optional[int] = None, 
+        self,
+        queue_name: str,
+        bindings: Dict[str, Tuple[Dict, Callable]],
+        max_priority: Optional[int] = None,
+        ordering_key: Optional[Union[str, Callable[[BasicProperties, Union[Dict, List]], Any]]] = None,
+        execution_mode: str = "thread",
+        retry_policy: Optional[RetryPolicy] = None,
     ) -> None:
         """
         Ease of use function to automatically specify the campus name for the exchange
@@ -683,12 +2165,18 @@ class Eventhub:
         :param queue_name: Name of the queue to create and listen to. Campus name will automatically be appended (ie. QUEUE_NAME-CAMPUS)
         :param bindings: Dict of routing keys and callbacks. The key should be the routing key and the value should be the callback for the routing key
         :param max_priority: Max priority of the queue. Can be 1-256. https://www.rabbitmq.com/priority.html
+        :param ordering_key: Process messages with the same key in order. See `register_on_message_callback`
+        :param execution_mode: 'thread' or 'process'. See `register_on_message_callback`
+        :param retry_policy: Retry failed messages after a delay. See `register_on_message_callback`
         """
         self.register_on_message_callback(
             f"{queue_name}-{self._campus}",
             bindings=bindings,
             exchange=self._campus.lower(),
             max_priority=max_priority,
+            ordering_key=ordering_key,
+            execution_mode=execution_mode,
+            retry_policy=retry_policy,
         )
 
     def register_on_message_callback(
@@ -700,6 +2188,9 @@ class Eventhub:
         exchange: Optional[Union[str, List[str]]] = [],
         passive_exchange: bool = True,
         max_priority: Optional[int] = None,
+        ordering_key: Optional[Union[str, Callable[[BasicProperties, Union[Dict, List]], Any]]] = None,
+        execution_mode: str = "thread",
+        retry_policy: Optional[RetryPolicy] = None,
     ) -> None:
         """
         Registers a callback for processing new messages.
@@ -710,7 +2201,43 @@ class Eventhub:
         :param exchange: Optional Name of the exchange to bind the queue to or List of exchanges to bind to
         :param passive_exchange: Passively create the exchange
         :param max_priority: Max priority of the queue. Can be 1-256. https://www.rabbitmq.com/priority.html
+        :param ordering_key: Messages with the same key are processed one at a time in delivery order, messages with different keys in parallel.
+            Either the name of a header, falling back to the top level body field of that name, or a callable taking the properties and decoded
+            message that returns the key. Reading the key from the body decodes it on the ioloop thread, so prefer a header for large messages.
+            Messages without a key are processed unordered
+        :param execution_mode: 'thread' runs callbacks on the thread pool. 'process' runs them in worker processes, for CPU bound callbacks.
+            Process callbacks must be module level functions and receive the raw body to decode in the worker. Replies and acks are still
+            sent from this process, and a worker that crashes only rejects the message it was processing
+        :param retry_policy: Messages whose callback raises are published to a TTL retry queue and come back after the
+            delay of their attempt, instead of being rejected. The attempt count is sent in the 'Retry-Attempt' header.
+            Messages that cannot be decoded and messages out of attempts are rejected, and dead-lettered if the policy has a dead letter exchange
         """
+        if execution_mode not in ("thread", "process"):
+            raise ValueError(f"Unknown execution mode '{execution_mode}'. Must be 'thread' or 'process'")
+        if execution_mode == "process":
+            if ordering_key is not None:
+                raise ValueError("Ordered callbacks cannot run in worker processes")
+            process_bindings = {}
+            for key, value in bindings.items():
+                binding = dict(value) if type(value) is dict else {"function": value, "sends_reply": True}
+                if inspect.iscoroutinefunction(binding["function"]):
+                    raise ValueError("Coroutine functions cannot run in worker processes")
+                binding["execution_mode"] = "process"
+                process_bindings[key] = binding
+            bindings = process_bindings
+            if self._process_executor is None:
+                self._process_executor = PreforkExecutor(self._process_workers or os.cpu_count() or 1)
+
+        if ordering_key is not None:
+            ordered_bindings = {}
+            for key, value in bindings.items():
+                binding = dict(value) if type(value) is dict else {"function": value, "sends_reply": True}
+                if inspect.iscoroutinefunction(binding["function"]):
+                    raise ValueError("Ordered callbacks run on the thread pool and cannot be coroutine functions")
+                binding["ordering_key"] = ordering_key
+                ordered_bindings[key] = binding
+            bindings = ordered_bindings
+
         for value in bindings.values():
             self._logger.debug("Registering on_message callback %s", value)
 
@@ -723,6 +2250,12 @@ class Eventhub:
         arguments = None
         if max_priority:
             arguments = QueueArguments(max_priority=max_priority)
+        if retry_policy is not None and retry_policy.dead_letter_exchange is not None:
+            arguments = QueueArguments(
+                max_priority=max_priority,
+                dead_letter_exchange=retry_policy.dead_letter_exchange,
+                dead_letter_routing_key=retry_policy.dead_letter_routing_key,
+            )
         for key in bindings:
             if type(bindings[key]) is dict:
                 pass
@@ -739,6 +2272,65 @@ class Eventhub:
             ),
             exchange_name=exchanges,
         )
+        if retry_policy is not None:
+            for retry_queue in retry_policy.retry_queues(queue_name, durable=durable_queue):
+                self._queue_manager.register_queue(retry_queue)
+            self._retry_policies[queue_name] = retry_policy
+
+    def register_on_batch_callback(
+        self,
+        queue_name: str,
+        bindings: Dict[str, Callable[[List[Tuple[BasicProperties, Union[Dict, List]]]], Optional[Iterable[int]]]],
+        max_batch: int = 100,
+        max_wait_ms: int = 1000,
+        auto_delete_queue: bool = False,
+        durable_queue: bool = True,
+        exchange: Optional[Union[str, List[str]]] = [],
+        passive_exchange: bool = True,
+        max_priority: Optional[int] = None,
+    ) -> None:
+        """
+        Registers callbacks that process messages in batches, useful for bulk writes to Humio, Postgres or S3.
+
+        Messages are accumulated per binding and the callback is called with a list of (properties, message) pairs once
+        `max_batch` messages have arrived or `max_wait_ms` has passed since the first one. The callback may return the
+        indexes of the items that failed, only those are rejected and the rest are acknowledged. Any other return value
+        rejects the whole batch. Batch callbacks cannot send replies and cannot be coroutine functions. Acks are coalesced so a contiguous batch is settled with a single multiple ack. This turns on ack
+        coalescing for every queue of the Eventhub, as if it was created with coalesce_acks=True, because batched and
+        unbatched queues can share a consumer channel and a multiple ack covers every earlier delivery on it.
+        The prefetch count should be at least `max_batch`, otherwise batches are only flushed by the timer.
+
+        :param queue_name: Name of the queue to create and listen to
+        :param bindings: Dict of routing keys and batch callbacks. The key should be the routing key and the value should be the callback for the routing key
+        :param max_batch: Most messages handed to the callback at once
+        :param max_wait_ms: Longest time in milliseconds a message waits for its batch to fill up
+        :param auto_delete_queue: Delete queue after service stops
+        :param durable_queue: Queue survives MQ reboots
+        :param exchange: Optional Name of the exchange to bind the queue to or List of exchanges to bind to
+        :param passive_exchange: Passively create the exchange
+        :param max_priority: Max priority of the queue. Can be 1-256. https://www.rabbitmq.com/priority.html
+
+        :raises ValueError: Raised when max_batch is less than 1
+        :raises TypeError: Raised when a batch callback is a coroutine function
+        """
+        if max_batch < 1:
+            raise ValueError("max_batch must be at least 1")
+        for cb in bindings.values():
+            if inspect.iscoroutinefunction(cb):
+                raise TypeError(f"Batch callback {cb.__qualname__} cannot be a coroutine function")
+        self._coalesce_acks = True
+        self.register_on_message_callback(
+            queue_name,
+            bindings={
+                key: {"function": cb, "sends_reply": False, "max_batch": max_batch, "max_wait_ms": max_wait_ms}
+                for key, cb in bindings.items()
+            },
+            auto_delete_queue=auto_delete_queue,
+            durable_queue=durable_queue,
+            exchange=exchange,
+            passive_exchange=passive_exchange,
+            max_priority=max_priority,
+        )
 
     def register_on_reply_to_callback(self, callback: Callable) -> None:
         """
@@ -751,19 +2343,7 @@ class Eventhub:
         self._logger.debug("Registering on reply_to callback: %s", callback.__qualname__)
         self._reply_to_callbacks[callback.__qualname__] = callback
 
-        # routing key is the same as the queue name
-        name = f"replyto.{self.connection_name}"
-        if self._reply_queue_name is None:
-            self._reply_queue_name = name
-        else:
-            if name != self._reply_queue_name:
-                raise Exception("You cannot use both register_on_reply_to_callback and register_on_reply_to_callback_campus in the same EDM. Please use one other other")
-
-        # call the same method for all reply-tos. The _reply_to_callbacks dict determines what other methods to call
-        # delete the queue when all subscribers have closed. We don't want to persist these messages
-        self._queue_manager.register_queue(
-            Queue(name, bindings={name: self._on_reply_to}, consume=True, auto_delete=True)
-        )
+        self._register_reply_queue(f"replyto.{self.connection_name}")
     
     def register_on_reply_to_callback_campus(self, callback: Callable) -> None:
         """
@@ -774,8 +2354,22 @@ class Eventhub:
         self._logger.debug("Registering on reply_to callback: %s", callback.__qualname__)
         self._reply_to_callbacks[callback.__qualname__] = callback
 
+        self._register_reply_queue(f"replyto.{self.connection_name}-{self._campus.lower()}")
+
+    def enable_requests(self, campus: bool = False) -> None:
+        """
+        Registers the reply-to queue used by `request` without registering a reply-to callback.
+
+        :param campus: Automatically specify the campus name in the name of the queue, like `register_on_reply_to_callback_campus`
+        """
+        if campus:
+            self._register_reply_queue(f"replyto.{self.connection_name}-{self._campus.lower()}")
+        else:
+            self._register_reply_queue(f"replyto.{self.connection_name}")
+
+    def _register_reply_queue(self, name: str) -> None:
+        """Registers the queue replies to this service are delivered to"""
         # routing key is the same as the queue name
-        name = f"replyto.{self.connection_name}-{self._campus.lower()}"
         if self._reply_queue_name is None:
             self._reply_queue_name = name
         else:
@@ -846,7 +2440,14 @@ class Eventhub:
 
     def _on_ready(self) -> None:
         """Called when all queues are registered and the service is ready to receive messages"""
-        self._logger.info("EDM ready")
+        if self._connection_opened_at is not None:
+            startup_seconds = time.perf_counter() - self._connection_opened_at
+            self._metrics.startup_seconds.set(startup_seconds)
+            self._logger.info("EDM ready %.3f seconds after the connection opened", startup_seconds)
+            # only the first time after connecting, not when the publish channel reopens
+            self._connection_opened_at = None
+        else:
+            self._logger.info("EDM ready")
         self._logger.debug("Calling on_ready callbacks. %s total", len(self._on_ready_callbacks))
         for cb in self._on_ready_callbacks:
             cb()
@@ -879,6 +2480,8 @@ def publish_message(
     """
     Sends a message on the eventhub to the exchange on the routing key
     Requires access to `/ces/eventhub/secrets/edm/credentials` and `/ces/eventhub/config/mq_endpoint in parameter store
+    Opens and closes a connection on every call, use a `Publisher` to send many messages.
+    Replies are received through RabbitMQ direct reply-to. https://www.rabbitmq.com/direct-reply-to.html
     :param exchange: The exchange to publish to. if not set then the campus environment variable will be used
     :param routing_key: The routing key to send the message to
     :param body: The body of the message to send
@@ -886,106 +2489,14 @@ def publish_message(
     :param timeout: The timeout to wait for a response in seconds
     :return: The dict of the reply if requested
     """
-
-    logger = cessoc_logging.getLogger("cessoc")
-
-    if exchange is None: # if there is no exchange, use the campus environment variable
-        exchange = os.getenv("CAMPUS").lower()
-    # Create connection
-    if not json_credentials:
-        json_credentials = ssm.get_value("/ces/eventhub/secrets/edm/credentials")
-    if not endpoint:
-        endpoint = ssm.get_value("/ces/eventhub/config/mq_endpoint")
-
-    credentials = pika.PlainCredentials(
-        json_credentials["username"], json_credentials["password"]
-    )
-    connection = pika.BlockingConnection(
-        pika.ConnectionParameters(
-            endpoint,
-            credentials=credentials,
-            ssl_options=pika.SSLOptions(context=ssl.create_default_context()),
-            client_properties={"connection_name": service_name},
-        )
-    )
-
-    # Create channel
-    channel = connection.channel()
-    channel.exchange_declare(
-        exchange, exchange_type="direct", passive=True, durable=True
-    )
-
-    # Setup the replyto queue
-    reply_to_queue = None
-    if reply_to:
-        reply_to_queue = f"replyto.{service_name}"
-        channel.queue_declare(reply_to_queue, exclusive=True, auto_delete=True)
-
-    # Setup some metadata
-    correlation_id = uuid.uuid4().hex
-    headers: Optional[Dict] = None
-    if reply_to:
-        if headers is None:
-            headers = {}
-        headers[
-            "Reply-To-Callback"
-        ] = "inline_blocking"  # Removing this errors out the replying EDM
-
-    properties = pika.BasicProperties(
-        app_id=service_name,
-        user_id="edm",
-        content_type="application/json",
-        content_encoding="utf-8",
-        reply_to=reply_to_queue,
-        correlation_id=correlation_id,
-        priority=None,
-        headers=headers,
-    )
-
-    # Publish the message
-    try:
-        channel.basic_publish(
-            exchange, routing_key, json.dumps(body), properties, mandatory=True
-        )
-        logger.info(
-            "Published message to exchange '%s' with routing key '%s' and correlation id '%s'",
-            exchange,
-            routing_key,
-            correlation_id,
-        )
-    except pika.exceptions.UnroutableError:
-        logger.error("Message was unroutable")
-
-    # Consume all messages on the response queue
-    if reply_to and reply_to_queue is not None:
-        start_time = int(time.time())
-        while start_time + timeout > int(
-            time.time()
-        ):  # Weird looping to accommodate timeout with a generator
-            method_frame, properties, reply_body = channel.basic_get(reply_to_queue)
-            if (method_frame is not None and properties is not None and reply_body is not None):
-                if (
-                    properties.correlation_id == correlation_id
-                ):  # Only accept the correlated reply
-                    logger.info(
-                        "Reply received with correlation id: %s", correlation_id
-                    )
-                    channel.basic_ack(method_frame.delivery_tag)
-                    channel.cancel()  # Re-queues anything it may have picked up
-                    channel.close()
-                    connection.close()
-                    return json.loads(reply_body)
-                else:  # Reject non-correlated messages
-                    logger.debug("Rejecting message")
-                    channel.basic_nack(method_frame.delivery_tag)
-                channel.cancel()
-                break
-        logger.error(
-            "Message timed out before a reply was received, correlation id: %s",
-            correlation_id,
-        )
-
-    # Clean up connection and channel
-    channel.close()
-    connection.close()
+    with Publisher(
+        service_name,
+        exchange=exchange,
+        json_credentials=json_credentials,
+        endpoint=endpoint,
+        pool_size=1,
+    ) as publisher:
+        if reply_to:
+            return publisher.request(routing_key, body, timeout=timeout)
+        publisher.publish(routing_key, body)
     return None
@@ -0,0 +1,93 @@
+"""Reconnect backoff and the buffer that holds outbound publishes while an Eventhub is disconnected"""
+
+import random
+from collections import deque
+from concurrent.futures import Future
+from typing import Deque, NamedTuple, Optional
+
+from pika.spec import BasicProperties
+
+
+class Backoff:
+    """
+    Exponential backoff with jitter.
+
+    The delay ceiling doubles with every attempt up to `maximum`. Each delay is half the ceiling plus a random share of
+    the other half, so replicas that lost the broker at the same moment spread their reconnects out instead of all
+    arriving together, while no replica retries sooner than half the ceiling.
+    """
+
+    def __init__(self, initial: float = 1.0, maximum: float = 60.0, multiplier: float = 2.0) -> None:
+        """
+        :param initial: Delay ceiling of the first attempt in seconds
+        :param maximum: Highest delay ceiling in seconds
+        :param multiplier: The ceiling is multiplied by this after every attempt
+        """
+        super().__init__()
+
+        if not 0 < initial <= maximum:
+            raise ValueError("Backoff delays must satisfy 0 < initial <= maximum")
+        if multiplier < 1:
+            raise ValueError("multiplier must be at least 1")
+        self._initial = initial
+        self._maximum = maximum
+        self._multiplier = multiplier
+        self._attempts = 0
+
+    @property
+    def attempts(self) -> int:
+        """Number of delays handed out since the last reset"""
+        return self._attempts
+
+    def next_delay(self) -> float:
+        """:returns: Seconds to wait before the next attempt"""
+        ceiling = min(self._maximum, self._initial * self._multiplier ** self._attempts)
+        self._attempts += 1
+        return ceiling / 2 + random.uniform(0, ceiling / 2)  # nosec
+
+    def reset(self) -> None:
+        """Starts over from the initial delay, called once an attempt succeeds"""
+        self._attempts = 0
+
+
+class BufferedPublish(NamedTuple):
+    """An encoded message waiting for the channel to open"""
+
+    exchange: str
+    routing_key: str
+    body: bytes
+    properties: BasicProperties
+    mandatory: bool
+    future: Optional[Future]
+
+
+class PublishBuffer:
+    """Bounded first in, first out queue of publishes. Only used from the ioloop thread."""
+
+    def __init__(self, max_messages: int) -> None:
+        """:param max_messages: Most publishes held at once"""
+        super().__init__()
+
+        self.max_messages = max_messages
+        self._publishes: Deque[BufferedPublish] = deque()
+
+    def append(self, publish: BufferedPublish) -> bool:
+        """
+        :param publish: Publish to hold
+        :returns: False if the buffer is full and the publish was not added
+        """
+        if len(self._publishes) >= self.max_messages:
+            return False
+        self._publishes.append(publish)
+        return True
+
+    def popleft(self) -> BufferedPublish:
+        """
+        :raises IndexError: if the buffer is empty
+        :returns: The oldest publish, removed from the buffer
+        """
+        return self._publishes.popleft()
+
+    def __len__(self) -> int:
+        """:returns: The number of publishes held"""
+        return len(self._publishes)
@@ -0,0 +1,85 @@
+"""Retry policy that delays failed messages in TTL retry queues instead of rejecting them right away"""
+
+from typing import List, Optional, Sequence
+
+from cessoc.rabbitmq.queue import Queue, QueueArguments
+
+# number of times the message failed so far, set on messages sent to a retry queue
+RETRY_ATTEMPT_HEADER = "Retry-Attempt"
+# exchange and routing key the message was first delivered with. Messages come back from a retry queue through the
+# default exchange with the queue name as the routing key, the original ones are restored from these headers
+RETRY_EXCHANGE_HEADER = "Retry-Exchange"
+RETRY_ROUTING_KEY_HEADER = "Retry-Routing-Key"
+
+
+class RetryPolicy:
+    """
+    How often and after which delays a message whose callback raised is processed again.
+
+    Every delay tier is a retry queue nobody consumes from. A failed message is published to the retry queue of its
+    tier and acknowledged. Once the queue TTL expires the broker dead-letters it back to the consumed queue through the
+    default exchange, so waiting retries cost no worker threads and the broker does not redeliver them in a hot loop.
+    Messages that fail max_attempts times are rejected, and dead-lettered to dead_letter_exchange if one is set.
+    """
+
+    def __init__(
+        self,
+        delays: Sequence[float] = (5, 30, 300),
+        max_attempts: Optional[int] = None,
+        dead_letter_exchange: Optional[str] = None,
+        dead_letter_routing_key: Optional[str] = None,
+    ) -> None:
+        """
+        :param delays: Seconds to wait before each retry. Retries after the last tier keep using the last delay
+        :param max_attempts: Times a message is processed before it is given up on, the first attempt included.
+            Defaults to one more than the number of delays
+        :param dead_letter_exchange: Exchange messages that are given up on are dead-lettered to. Set as an argument of
+            the consumed queue, so it cannot be added to an existing queue without deleting it first. Dropped when None
+        :param dead_letter_routing_key: Routing key messages are dead-lettered with. Defaults to their own routing key
+        """
+        super().__init__()
+
+        if not delays or any(delay <= 0 for delay in delays):
+            raise ValueError("Retry delays must be positive and at least one must be given")
+        self.delays = tuple(delays)
+        self.max_attempts = max_attempts if max_attempts is not None else len(self.delays) + 1
+        if self.max_attempts < 1:
+            raise ValueError("max_attempts must be at least 1")
+        self.dead_letter_exchange = dead_letter_exchange
+        self.dead_letter_routing_key = dead_letter_routing_key
+
+    def delay(self, attempt: int) -> float:
+        """
+        :param attempt: Number of times the message failed so far, starting at 1
+
+        :returns: Seconds to wait before the next attempt
+        """
+        return self.delays[min(attempt, len(self.delays)) - 1]
+
+    def retry_queue_name(self, queue_name: str, attempt: int) -> str:
+        """
+        Retry queues are named by their delay, so changing the delays declares new queues instead of redeclaring
+        existing ones with a different TTL, which the broker refuses.
+
+        :param queue_name: The consumed queue
+        :param attempt: Number of times the message failed so far, starting at 1
+
+        :returns: The name of the retry queue the message waits in
+        """
+        return f"{queue_name}.retry.{int(self.delay(attempt) * 1000)}ms"
+
+    def retry_queues(self, queue_name: str, durable: bool = True) -> List[Queue]:
+        """
+        :param queue_name: The consumed queue
+        :param durable: Retry queues survive broker restarts
+
+        :returns: One queue per delay tier. Messages expire from them back to the consumed queue
+        """
+        queues = {}
+        for attempt in range(1, len(self.delays) + 1):
+            name = self.retry_queue_name(queue_name, attempt)
+            arguments = QueueArguments(
+                message_ttl=int(self.delay(attempt) * 1000), dead_letter_exchange="", dead_letter_routing_key=queue_name
+            )
+            queues[name] = Queue(name, durable=durable, arguments=arguments)
+        return list(queues.values())
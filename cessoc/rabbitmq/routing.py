@@ -0,0 +1,85 @@
+"""Routing index to resolve a delivered routing key to the queue binding that matched it"""
+
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+
+class _RoutingNode:
+    """A word in a binding pattern"""
+
+    __slots__ = ("children", "binding")
+
+    def __init__(self) -> None:
+        self.children: Dict[str, "_RoutingNode"] = {}
+        # (registration order, binding key) of the pattern ending at this node
+        self.binding: Optional[Tuple[int, str]] = None
+
+
+class RoutingIndex:
+    """
+    Resolves routing keys to binding keys using topic exchange semantics. https://www.rabbitmq.com/tutorials/tutorial-five-python.html
+
+    Binding keys without wildcards are resolved with a single dict lookup. Binding keys with `*` (exactly one word) or
+    `#` (zero or more words) are compiled into a trie over the dot separated words, so a routing key is resolved in
+    time proportional to its number of words. When several patterns match, the one registered first wins.
+    """
+
+    def __init__(self, bindings: Optional[Dict[str, Any]]) -> None:
+        """:param bindings: Dict of binding keys and callbacks as registered on the queue"""
+        super().__init__()
+
+        self._exact: Dict[str, str] = {}
+        self._root = _RoutingNode()
+        self._has_patterns = False
+
+        for order, binding_key in enumerate(bindings or {}):
+            words = binding_key.split(".")
+            if "*" not in words and "#" not in words:
+                self._exact[binding_key] = binding_key
+                continue
+            self._has_patterns = True
+            node = self._root
+            for word in words:
+                node = node.children.setdefault(word, _RoutingNode())
+            if node.binding is None:
+                node.binding = (order, binding_key)
+
+    def match(self, routing_key: str) -> Optional[str]:
+        """
+        :param routing_key: The routing key the message was delivered with
+
+        :returns: The binding key that matched the routing key, None if nothing matched
+        """
+        binding_key = self._exact.get(routing_key)
+        if binding_key is not None or not self._has_patterns:
+            return binding_key
+
+        words = routing_key.split(".")
+        best: Optional[Tuple[int, str]] = None
+        # (node, index of the next word to consume, node is a '#') states still to explore
+        stack: List[Tuple[_RoutingNode, int, bool]] = [(self._root, 0, False)]
+        seen: Set[Tuple[int, int]] = set()
+        while stack:
+            node, index, is_hash = stack.pop()
+            state = (id(node), index)
+            if state in seen:
+                continue
+            seen.add(state)
+
+            if is_hash and index < len(words):
+                # '#' consumes one more word
+                stack.append((node, index + 1, True))
+            hash_child = node.children.get("#")
+            if hash_child is not None:
+                # '#' consumes zero words
+                stack.append((hash_child, index, True))
+            if index == len(words):
+                if node.binding is not None and (best is None or node.binding < best):
+                    best = node.binding
+                continue
+            child = node.children.get(words[index])
+            if child is not None:
+                stack.append((child, index + 1, False))
+            star_child = node.children.get("*")
+            if star_child is not None:
+                stack.append((star_child, index + 1, False))
+        return best[1] if best is not None else None
@@ -0,0 +1,262 @@
+"""Append-only disk spool that holds outbound publishes through long broker outages"""
+
+import mmap
+import os
+import struct
+import time
+import zlib
+from collections import deque
+from typing import BinaryIO, Deque, List, Optional, Tuple
+
+from pika.spec import BasicProperties
+
+from cessoc.rabbitmq.reconnect import BufferedPublish
+
+# position just past a record: (segment number, offset in the segment)
+SpoolPosition = Tuple[int, int]
+
+FSYNC_POLICIES = ("always", "interval", "never")
+
+# payload length and crc32 of the payload
+_RECORD_HEADER = struct.Struct("<II")
+# mandatory flag and the lengths of the exchange, routing key and encoded properties. the body is the rest of the payload
+_RECORD_FIELDS = struct.Struct("<?HHI")
+# committed segment number and offset
+_INDEX = struct.Struct("<QQ")
+_SEGMENT_SUFFIX = ".seg"
+
+
+class SpoolFullException(Exception):
+    """Raised when appending a publish would take the spool over its size cap"""
+
+
+def _encode(publish: BufferedPublish) -> bytes:
+    """Encodes the publish as a record, header included"""
+    exchange = publish.exchange.encode("utf-8")
+    routing_key = publish.routing_key.encode("utf-8")
+    properties = b"".join(publish.properties.encode())
+    payload = b"".join(
+        (_RECORD_FIELDS.pack(publish.mandatory, len(exchange), len(routing_key), len(properties)), exchange, routing_key, properties, publish.body)
+    )
+    return _RECORD_HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+
+
+def _decode(payload: bytes) -> BufferedPublish:
+    """Decodes the payload of a record"""
+    mandatory, exchange_length, routing_key_length, properties_length = _RECORD_FIELDS.unpack_from(payload)
+    offset = _RECORD_FIELDS.size
+    exchange = payload[offset:offset + exchange_length].decode("utf-8")
+    offset += exchange_length
+    routing_key = payload[offset:offset + routing_key_length].decode("utf-8")
+    offset += routing_key_length
+    properties = BasicProperties()
+    properties.decode(payload[offset:offset + properties_length])
+    offset += properties_length
+    return BufferedPublish(exchange, routing_key, payload[offset:], properties, mandatory, None)
+
+
+class Spool:
+    """
+    Publishes written to numbered segment files in a directory, replayed in the order they were written.
+
+    Records are read from a cursor that only moves forward once the publishes before it are committed, usually when
+    the broker confirmed them. The committed cursor is kept in a small memory mapped index file, so committing does not
+    cost a write call, and segments behind it are deleted. Records written past the committed cursor are replayed after
+    a restart, so a publish can be sent twice but is not lost. A record torn by a crash is truncated when the spool is opened.
+
+    Only one process may use a directory at a time. Must only be used from one thread, the Eventhub uses it from the ioloop thread.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        segment_bytes: int = 16 * 1024 * 1024,
+        max_bytes: int = 1024 * 1024 * 1024,
+        fsync: str = "interval",
+        fsync_interval: float = 1.0,
+    ) -> None:
+        """
+        :param directory: Directory for the segment and index files, created if it does not exist
+        :param segment_bytes: Size a segment grows to before a new one is started
+        :param max_bytes: Most bytes the segments can take up. Appends beyond it raise `SpoolFullException`
+        :param fsync: When written records are flushed to disk. 'always' after every record, 'interval' at most every
+            fsync_interval seconds, 'never' leaves it to the operating system
+        :param fsync_interval: Seconds between flushes with the 'interval' policy
+        """
+        super().__init__()
+
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError(f"fsync must be one of {', '.join(FSYNC_POLICIES)}")
+        if not 0 < segment_bytes <= max_bytes:
+            raise ValueError("Spool sizes must satisfy 0 < segment_bytes <= max_bytes")
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.max_bytes = max_bytes
+        self._fsync = fsync
+        self._fsync_interval = fsync_interval
+        self._last_sync = time.monotonic()
+        os.makedirs(directory, exist_ok=True)
+
+        index_path = os.path.join(directory, "index")
+        with open(index_path, "ab") as index_file:
+            if index_file.tell() < _INDEX.size:
+                index_file.write(b"\0" * (_INDEX.size - index_file.tell()))
+        self._index_file = open(index_path, "r+b")  # pylint: disable=consider-using-with
+        self._index = mmap.mmap(self._index_file.fileno(), _INDEX.size)
+        self._committed: SpoolPosition = _INDEX.unpack_from(self._index)
+
+        # publishes not committed yet, counted by _recover
+        self._pending = 0
+        self._segments = self._recover()
+        self._size = sum(os.path.getsize(self._segment_path(segment)) for segment in self._segments)
+        self._writer = open(self._segment_path(self._segments[-1]), "ab", buffering=0)  # pylint: disable=consider-using-with
+        self._reader: Optional[Tuple[int, BinaryIO]] = None
+        self._read: SpoolPosition = self._committed
+        # end positions of records read but not committed yet, in order
+        self._uncommitted: Deque[SpoolPosition] = deque()
+
+    def _segment_path(self, segment: int) -> str:
+        """Path of the segment file"""
+        return os.path.join(self.directory, f"{segment:016d}{_SEGMENT_SUFFIX}")
+
+    def _recover(self) -> List[int]:
+        """
+        Finds the segments, deletes the ones behind the committed cursor, counts the records waiting to be replayed and
+        truncates a torn record at the end of the last segment.
+
+        :returns: The segment numbers in order, at least one
+        """
+        segments = sorted(int(name[: -len(_SEGMENT_SUFFIX)]) for name in os.listdir(self.directory) if name.endswith(_SEGMENT_SUFFIX))
+        segment, offset = self._committed
+        for old in [old for old in segments if old < segment]:
+            os.remove(self._segment_path(old))
+            segments.remove(old)
+        if not segments:
+            segments = [segment]
+            open(self._segment_path(segment), "ab").close()  # pylint: disable=consider-using-with
+
+        for number in segments:
+            with open(self._segment_path(number), "r+b") as segment_file:
+                segment_file.seek(offset if number == segment else 0)
+                while self._read_record(segment_file) is not None:
+                    self._pending += 1
+                end = segment_file.tell()
+                if number == segments[-1] and end < os.fstat(segment_file.fileno()).st_size:
+                    segment_file.truncate(end)
+        return segments
+
+    @staticmethod
+    def _read_record(segment_file: BinaryIO) -> Optional[bytes]:
+        """Reads the next record, leaving the file at its end. Leaves the file at the record start and returns None if it is missing or torn."""
+        start = segment_file.tell()
+        header = segment_file.read(_RECORD_HEADER.size)
+        if len(header) == _RECORD_HEADER.size:
+            length, crc = _RECORD_HEADER.unpack(header)
+            payload = segment_file.read(length)
+            if len(payload) == length and zlib.crc32(payload) == crc:
+                return payload
+        segment_file.seek(start)
+        return None
+
+    def append(self, publish: BufferedPublish) -> SpoolPosition:
+        """
+        Writes the publish after the ones already in the spool. Its future is not stored.
+
+        :raises SpoolFullException: if the record does not fit under max_bytes
+        :returns: The position just past the record, the position read and committed for it
+        """
+        record = _encode(publish)
+        if self._size + len(record) > self.max_bytes:
+            raise SpoolFullException(f"Spool in {self.directory} is full ({self._size} of {self.max_bytes} bytes used)")
+        if self._writer.tell() and self._writer.tell() + len(record) > self.segment_bytes:
+            self._sync(force=True)
+            self._writer.close()
+            self._segments.append(self._segments[-1] + 1)
+            self._writer = open(self._segment_path(self._segments[-1]), "ab", buffering=0)  # pylint: disable=consider-using-with
+        self._writer.write(record)
+        self._size += len(record)
+        self._pending += 1
+        self._sync()
+        return self._segments[-1], self._writer.tell()
+
+    def _sync(self, force: bool = False) -> None:
+        """Flushes the active segment to disk as the fsync policy asks"""
+        if self._fsync == "never":
+            return
+        now = time.monotonic()
+        if force or self._fsync == "always" or now - self._last_sync >= self._fsync_interval:
+            os.fsync(self._writer.fileno())
+            self._last_sync = now
+
+    def read(self, max_records: int) -> List[Tuple[SpoolPosition, BufferedPublish]]:
+        """
+        Reads publishes after the ones already read.
+
+        :param max_records: Most publishes to read
+        :returns: Publishes and the position to commit once each is done with, in order
+        """
+        records = []
+        while len(records) < max_records:
+            segment, offset = self._read
+            if self._reader is None or self._reader[0] != segment:
+                if self._reader is not None:
+                    self._reader[1].close()
+                self._reader = (segment, open(self._segment_path(segment), "rb"))  # pylint: disable=consider-using-with
+            reader = self._reader[1]
+            reader.seek(offset)
+            payload = self._read_record(reader)
+            if payload is None:
+                if segment == self._segments[-1]:
+                    break
+                # the rest of this segment was read, continue with the next
+                self._read = (self._segments[self._segments.index(segment) + 1], 0)
+                continue
+            self._read = (segment, reader.tell())
+            self._uncommitted.append(self._read)
+            records.append((self._read, _decode(payload)))
+        return records
+
+    def commit(self, position: SpoolPosition) -> None:
+        """
+        Marks the publishes up to and including the one at the position as done. They are not replayed again.
+
+        :param position: A position returned by `read`
+        """
+        while self._uncommitted and self._uncommitted[0] <= position:
+            self._uncommitted.popleft()
+            self._pending -= 1
+        self._committed = max(self._committed, position)
+        _INDEX.pack_into(self._index, 0, *self._committed)
+        if self._fsync == "always":
+            self._index.flush()
+        # segments behind the committed one are not needed anymore
+        while self._segments[0] < self._committed[0]:
+            segment = self._segments.pop(0)
+            self._size -= os.path.getsize(self._segment_path(segment))
+            os.remove(self._segment_path(segment))
+
+    def rewind(self) -> None:
+        """Reads again from the committed position, for publishes that were read but never confirmed"""
+        self._read = self._committed
+        self._uncommitted.clear()
+
+    @property
+    def size(self) -> int:
+        """Bytes the segments take up"""
+        return self._size
+
+    def __len__(self) -> int:
+        """:returns: The number of publishes not committed yet"""
+        return self._pending
+
+    def close(self) -> None:
+        """Flushes the spool to disk and closes its files"""
+        if self._fsync != "never":
+            os.fsync(self._writer.fileno())
+            self._index.flush()
+        self._writer.close()
+        if self._reader is not None:
+            self._reader[1].close()
+            self._reader = None
+        self._index.close()
+        self._index_file.close()
@@ -0,0 +1,203 @@
+"""
+This module provides the serializers messages and events are encoded and decoded with, registered by name.
+Bodies are labelled with the content type of their serializer. The JSON codecs all serialize 'application/json', the
+standard library codec is always available and the orjson and msgspec codecs require their optional dependency.
+MessagePack requires the optional msgpack dependency and carries bytes values natively, so binary fields do not need to
+be base64 encoded with `util.bytes_to_str`.
+"""
+import abc
+import json
+from typing import Any, Dict, Iterable, Optional, Union
+
+JSON_CONTENT_TYPE = "application/json"
+MSGPACK_CONTENT_TYPE = "application/msgpack"
+
+
+class DeserializationError(ValueError):
+    """Raised when a body is not valid for its content type"""
+
+
+class Serializer(abc.ABC):
+    """
+    Base serializer. The name picks the serializer, the content type is the message property bodies it encodes are
+    labelled with.
+    """
+
+    name = ""
+    content_type = ""
+
+    @abc.abstractmethod
+    def loads(self, data: bytes) -> Any:
+        """
+        :param data: Encoded message body
+
+        :raises ValueError: if the body cannot be decoded
+        :returns: The decoded message
+        """
+
+    @abc.abstractmethod
+    def dumps(self, obj: Any) -> bytes:
+        """
+        :param obj: Message to encode
+
+        :returns: The encoded message body
+        """
+
+
+class JsonCodec(Serializer):
+    """Base JSON codec. Decodes straight from bytes and encodes to UTF-8 JSON bytes."""
+
+    content_type = JSON_CONTENT_TYPE
+
+    @abc.abstractmethod
+    def loads(self, data: Union[bytes, str]) -> Any:
+        """
+        :param data: UTF-8 encoded JSON document
+
+        :raises json.JSONDecodeError: if the document is not valid JSON
+        :returns: The decoded object
+        """
+
+    def dumps_str(self, obj: Any) -> str:
+        """
+        :param obj: Object to encode
+
+        :returns: The JSON document as a string
+        """
+        return self.dumps(obj).decode("utf-8")
+
+
+class StdlibJsonCodec(JsonCodec):
+    """Codec backed by the standard library json module"""
+
+    name = "json"
+
+    def loads(self, data: Union[bytes, str]) -> Any:
+        """json.loads detects the encoding of bytes itself, so the body is not copied into a str first"""
+        return json.loads(data, strict=False)
+
+    def dumps(self, obj: Any) -> bytes:
+        """Encodes with json.dumps"""
+        return json.dumps(obj).encode("utf-8")
+
+    def dumps_str(self, obj: Any) -> str:
+        """Skips the round trip through bytes"""
+        return json.dumps(obj)
+
+
+class OrjsonCodec(JsonCodec):
+    """Codec backed by orjson. https://github.com/ijl/orjson"""
+
+    name = "orjson"
+
+    def __init__(self) -> None:
+        """:raises ImportError: if orjson is not installed"""
+        super().__init__()
+        try:
+            import orjson  # pylint: disable=import-outside-toplevel
+        except ImportError as ex:
+            raise ImportError("The orjson codec requires the 'orjson' package. Install cessoc with the 'orjson' extra") from ex
+        self._orjson = orjson
+
+    def loads(self, data: Union[bytes, str]) -> Any:
+        """orjson.JSONDecodeError is a subclass of json.JSONDecodeError"""
+        return self._orjson.loads(data)
+
+    def dumps(self, obj: Any) -> bytes:
+        """Non-str dict keys are allowed to match the standard library"""
+        return self._orjson.dumps(obj, option=self._orjson.OPT_NON_STR_KEYS)
+
+
+class MsgspecCodec(JsonCodec):
+    """Codec backed by msgspec. https://jcristharif.com/msgspec/"""
+
+    name = "msgspec"
+
+    def __init__(self) -> None:
+        """:raises ImportError: if msgspec is not installed"""
+        super().__init__()
+        try:
+            import msgspec  # pylint: disable=import-outside-toplevel
+        except ImportError as ex:
+            raise ImportError("The msgspec codec requires the 'msgspec' package. Install cessoc with the 'msgspec' extra") from ex
+        self._decode_error = msgspec.DecodeError
+        self._decoder = msgspec.json.Decoder()
+        self._encoder = msgspec.json.Encoder()
+
+    def loads(self, data: Union[bytes, str]) -> Any:
+        """msgspec decode errors are raised as json.JSONDecodeError so callers only need to handle one type"""
+        try:
+            return self._decoder.decode(data)
+        except self._decode_error as ex:
+            raise json.JSONDecodeError(str(ex), "", 0) from ex
+
+    def dumps(self, obj: Any) -> bytes:
+        """Encodes with a reused msgspec encoder"""
+        return self._encoder.encode(obj)
+
+
+class MsgpackSerializer(Serializer):
+    """Serializer backed by msgpack. https://msgpack.org. bytes values round trip as bytes, str values as str."""
+
+    name = "msgpack"
+    content_type = MSGPACK_CONTENT_TYPE
+
+    def __init__(self) -> None:
+        """:raises ImportError: if msgpack is not installed"""
+        super().__init__()
+        try:
+            import msgpack  # pylint: disable=import-outside-toplevel
+        except ImportError as ex:
+            raise ImportError("The msgpack serializer requires the 'msgpack' package. Install cessoc with the 'msgpack' extra") from ex
+        self._msgpack = msgpack
+
+    def loads(self, data: bytes) -> Any:
+        """Map keys may be of any type JSON allows. Decode errors are raised as DeserializationError"""
+        try:
+            return self._msgpack.unpackb(data, raw=False, strict_map_key=False)
+        except (ValueError, TypeError, self._msgpack.UnpackException) as ex:
+            raise DeserializationError(f"Could not decode msgpack body: {ex}") from ex
+
+    def dumps(self, obj: Any) -> bytes:
+        """bytes are packed as the bin type and str as the str type, so they stay apart when decoded"""
+        return self._msgpack.packb(obj, use_bin_type=True)
+
+
+SERIALIZERS = {serializer.name: serializer for serializer in (StdlibJsonCodec, OrjsonCodec, MsgspecCodec, MsgpackSerializer)}
+
+
+def get_codec(codec: Optional[Union[str, JsonCodec]] = None) -> JsonCodec:
+    """
+    :param codec: Codec instance or the name of a codec ('json', 'orjson' or 'msgspec'). None returns the standard library codec
+
+    :raises ValueError: if the name is not the name of a JSON codec
+    :returns: The codec instance
+    """
+    if codec is None:
+        return StdlibJsonCodec()
+    if isinstance(codec, JsonCodec):
+        return codec
+    if codec not in SERIALIZERS or not issubclass(SERIALIZERS[codec], JsonCodec):
+        names = [name for name, serializer in SERIALIZERS.items() if issubclass(serializer, JsonCodec)]
+        raise ValueError(f"Unknown JSON codec '{codec}'. Must be one of {names}")
+    return SERIALIZERS[codec]()
+
+
+def get_serializers(json_codec: Optional[Union[str, JsonCodec]] = None, serializers: Iterable[Serializer] = ()) -> Dict[str, Serializer]:
+    """
+    :param json_codec: Codec JSON bodies are encoded and decoded with
+    :param serializers: Additional serializers. They replace the built in serializer for the same content type
+
+    :returns: The serializers keyed by content type. Built in serializers whose dependency is not installed are left out
+    """
+    registry: Dict[str, Serializer] = {JSON_CONTENT_TYPE: get_codec(json_codec)}
+    for serializer in SERIALIZERS.values():
+        if serializer.content_type in registry:
+            continue
+        try:
+            registry[serializer.content_type] = serializer()
+        except ImportError:
+            continue
+    for serializer in serializers:
+        registry[serializer.content_type] = serializer
+    return registry
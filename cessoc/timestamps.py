@@ -7,9 +7,14 @@ class ItemNotFoundException(Exception):
     pass
 
 
+def table_name() -> str:
+    """The name of the timestamps table of the current stage"""
+    return "cessoc-timestamps-" + os.environ["STAGE"]
+
+
 def get(key: str) -> dict:
     dynamodb = boto3.resource('dynamodb')
-    table = dynamodb.Table("cessoc-timestamps-" + os.environ["STAGE"])
+    table = dynamodb.Table(table_name())
     response = table.get_item(
         Key={"key": key}
     )
@@ -21,7 +26,7 @@ def get(key: str) -> dict:
 def put(key: str, values: dict) -> None:
     """Inserts a key. Will overwrite everything at the key if the key exists."""
     dynamodb = boto3.resource('dynamodb')
-    table = dynamodb.Table("cessoc-timestamps-" + os.environ["STAGE"])
+    table = dynamodb.Table(table_name())
     values["key"] = key # Adding the key to the request
     table.put_item(
         Item=values
@@ -31,7 +36,7 @@ def put(key: str, values: dict) -> None:
 def update(key: str, values: dict) -> None:
     """Updates individual columns at the key value. Will insert if the key does not exist."""
     dynamodb = boto3.resource('dynamodb')
-    table = dynamodb.Table("cessoc-timestamps-" + os.environ["STAGE"])
+    table = dynamodb.Table(table_name())
     table.update_item(
         Key={"key": key},
         UpdateExpression=_createUpdateExpression(values),
@@ -6,6 +6,8 @@ import base64
 
 def bytes_to_str(value: bytes) -> str:
     """
+    Base64 encodes bytes so they fit in a JSON message. Not needed for messages published as 'application/msgpack', which carry bytes as is.
+
     :param value: A bytes object
     :return: The string representation of the bytes
     """
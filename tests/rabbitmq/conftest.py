@@ -0,0 +1,148 @@
+import pytest
+from pika.spec import BasicProperties, Basic
+from cessoc.rabbitmq import rabbitmq as rabbit
+
+
+class MockIoloop:
+    """Queues callbacks until run is called"""
+
+    def __init__(self):
+        self.callbacks = []
+        self.timers = []
+        self.stopped = False
+
+    def add_callback_threadsafe(self, callback):
+        self.callbacks.append(callback)
+
+    def call_later(self, delay, callback):
+        self.timers.append(callback)
+        return callback
+
+    def remove_timeout(self, timer):
+        self.timers.remove(timer)
+
+    def stop(self):
+        self.stopped = True
+
+    def run(self):
+        while self.callbacks:
+            self.callbacks.pop(0)()
+
+    def fire_timers(self):
+        timers, self.timers = self.timers, []
+        for callback in timers:
+            callback()
+
+
+class MockConnection:
+    """Connection with a mock ioloop"""
+
+    is_closing = False
+    is_closed = False
+
+    def __init__(self):
+        self.ioloop = MockIoloop()
+
+    @property
+    def is_open(self):
+        return not self.is_closed
+
+    def close(self):
+        self.is_closed = True
+
+
+class MockChannel:
+    """
+    Records the frames sent on the channel. Declarations keep their callbacks so confirmations can be sent later
+    with `confirm_all`.
+    """
+
+    is_open = True
+
+    def __init__(self, record_properties=False):
+        """
+        :param record_properties: Record the properties of publishes along with their body
+        """
+        self.frames = []
+        self.callbacks = []
+        self.record_properties = record_properties
+
+    def basic_ack(self, delivery_tag, multiple=False):
+        self.frames.append(("ack", delivery_tag, multiple))
+
+    def basic_reject(self, delivery_tag, requeue=True):
+        self.frames.append(("reject", delivery_tag, requeue))
+
+    def basic_publish(self, exchange, routing_key, body, properties, mandatory=True):
+        if self.record_properties:
+            self.frames.append(("publish", routing_key, body, properties))
+        else:
+            self.frames.append(("publish", routing_key, body))
+
+    def exchange_declare(self, exchange, callback, **kwargs):
+        self.frames.append(("exchange_declare", exchange))
+        self.callbacks.append(callback)
+
+    def queue_declare(self, queue, callback, **kwargs):
+        self.frames.append(("queue_declare", queue))
+        self.callbacks.append(callback)
+
+    def queue_bind(self, queue, exchange, routing_key, callback):
+        self.frames.append(("queue_bind", queue, exchange, routing_key))
+        self.callbacks.append(callback)
+
+    def confirm_all(self):
+        callbacks, self.callbacks = self.callbacks, []
+        for callback in callbacks:
+            callback(None)
+
+    def add_on_close_callback(self, callback):
+        pass
+
+    def add_on_cancel_callback(self, callback):
+        pass
+
+    def basic_qos(self, prefetch_count, callback=None, global_qos=False):
+        self.frames.append(("qos", prefetch_count, global_qos))
+
+    def basic_consume(self, queue, on_message_callback):
+        self.frames.append(("consume", queue))
+        return f"ctag.{queue}"
+
+    def basic_cancel(self, consumer_tag, callback=None):
+        self.frames.append(("cancel", consumer_tag))
+        self.callbacks.append(callback)
+
+
+@pytest.fixture(scope="function")
+def eventhub():
+    """Eventhub wired to a mock connection, consuming and publishing on the same mock channel"""
+    hub = rabbit.Eventhub(prefetch_count=10)
+    hub._connection = MockConnection()
+    hub._channel = MockChannel()
+    open_consumer_channel(hub, hub._channel)
+    hub._channels_by_consumer_tag["ctag"] = hub._channel
+    hub._topology_declared = True
+    return hub
+
+
+def open_consumer_channel(hub, channel, index=0):
+    """Opens the consumer channel like the broker would, without keeping the QoS frame"""
+    hub._on_consumer_channel_open(channel, index=index)
+    channel.frames.clear()
+
+
+def deliver(hub, queue_name, delivery_tag, body, routing_key="test", **properties):
+    """Delivers a JSON message to the queue"""
+    properties.setdefault("headers", {})
+    properties.setdefault("content_encoding", "utf-8")
+    properties.setdefault("content_type", "application/json")
+    props = BasicProperties(**properties)
+    basic_deliver = Basic.Deliver(consumer_tag="ctag", delivery_tag=delivery_tag, routing_key=routing_key)
+    hub._on_message(hub._channels_by_consumer_tag["ctag"], basic_deliver, props, body, hub._queue_manager.queues[queue_name])
+
+
+def wait_for_tasks(hub):
+    """Waits for the worker threads and runs the callbacks they scheduled on the ioloop"""
+    hub._thread_pool_executor.shutdown(wait=True)
+    hub._connection.ioloop.run()
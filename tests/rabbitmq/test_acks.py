@@ -0,0 +1,84 @@
+import pytest
+from cessoc.rabbitmq.acks import AckCoalescer
+
+
+class MockChannel:
+    """Records the frames sent to settle deliveries"""
+
+    def __init__(self):
+        self.frames = []
+
+    def basic_ack(self, delivery_tag, multiple=False):
+        self.frames.append(("ack", delivery_tag, multiple))
+
+    def basic_reject(self, delivery_tag, requeue=True):
+        self.frames.append(("reject", delivery_tag, requeue))
+
+
+@pytest.fixture(scope="function")
+def coalescer():
+    """Coalescer with deliveries 1-5 pending"""
+    ack_coalescer = AckCoalescer()
+    for tag in range(1, 6):
+        ack_coalescer.delivered(tag)
+    return ack_coalescer
+
+
+@pytest.fixture(scope="function")
+def channel():
+    """Default mock channel"""
+    return MockChannel()
+
+
+class TestAckCoalescer:
+    """AckCoalescer Class Test Cases"""
+
+    def test_settle_requests_one_flush(self, coalescer):
+        """Only the first settle since the last flush should request a flush"""
+        assert coalescer.settle(1) is True
+        assert coalescer.settle(2) is False
+        coalescer.flush(MockChannel())
+        assert coalescer.settle(3) is True
+
+    def test_contiguous_acks_single_frame(self, coalescer, channel):
+        """Contiguous acks should be sent as one multiple ack"""
+        for tag in range(1, 6):
+            coalescer.settle(tag)
+        assert coalescer.flush(channel) == 1
+        assert channel.frames == [("ack", 5, True)]
+        assert len(coalescer) == 0
+
+    def test_reject_splits_run(self, coalescer, channel):
+        """A reject in the run must not be covered by a multiple ack"""
+        coalescer.settle(1)
+        coalescer.settle(2)
+        coalescer.settle(3, ack=False)
+        coalescer.settle(4)
+        coalescer.flush(channel)
+        assert channel.frames == [("ack", 2, True), ("reject", 3, False), ("ack", 4, True)]
+
+    def test_out_of_order_settled_individually(self, coalescer, channel):
+        """Tags finishing after an unsettled tag should be settled one by one"""
+        coalescer.settle(2)
+        coalescer.settle(4, ack=False)
+        coalescer.flush(channel)
+        assert channel.frames == [("ack", 2, False), ("reject", 4, False)]
+        assert len(coalescer) == 3
+
+    def test_head_finishing_later(self, coalescer, channel):
+        """Once the head finishes the remaining contiguous run is acked together"""
+        coalescer.settle(3)
+        coalescer.flush(channel)
+        coalescer.settle(1)
+        coalescer.settle(2)
+        coalescer.flush(channel)
+        assert channel.frames == [("ack", 3, False), ("ack", 2, True)]
+
+    def test_reset_ignores_stale_tags(self, coalescer, channel):
+        """Tags settled for a replaced channel must not be sent"""
+        coalescer.reset()
+        coalescer.delivered(1)
+        coalescer.settle(4)
+        assert coalescer.flush(channel) == 0
+        assert channel.frames == []
+        assert len(coalescer) == 1
@@ -0,0 +1,107 @@
+import asyncio
+import threading
+from pika.spec import BasicProperties
+from cessoc.rabbitmq.async_eventhub import AsyncEventhub
+from tests.rabbitmq.conftest import MockChannel, MockConnection, deliver
+
+
+class TestAsyncEventhub:
+    """AsyncEventhub Class Test Cases"""
+
+    def test_init(self):
+        """Test if the class instantiates"""
+        AsyncEventhub()
+
+    def test_reply_to_callbacks_off_the_loop(self):
+        """Regular reply-to callbacks run off the event loop thread, coroutine callbacks on it"""
+        eventhub = AsyncEventhub()
+        threads = {}
+
+        def sync_reply(properties, message):
+            threads["sync"] = threading.get_ident()
+            return message
+
+        async def async_reply(properties, message):
+            threads["async"] = threading.get_ident()
+            return message
+
+        eventhub._reply_to_callbacks = {"sync": sync_reply, "async": async_reply}
+        for name in ("sync", "async"):
+            properties = BasicProperties(correlation_id="id", headers={"Reply-To-Callback": name})
+            assert eventhub.loop.run_until_complete(eventhub._on_reply_to(properties, {"id": 1})) == {"id": 1}
+        assert threads["async"] == threading.get_ident()
+        assert threads["sync"] != threading.get_ident()
+
+    def test_coroutine_callbacks_run_concurrently(self):
+        """Coroutine callbacks should all be in flight at once on the event loop"""
+        eventhub = AsyncEventhub(prefetch_count=50)
+        eventhub._connection = MockConnection()
+        eventhub._channel = MockChannel()
+        eventhub._channels_by_consumer_tag["ctag"] = eventhub._channel
+        in_flight = []
+
+        async def callback(properties, message):
+            in_flight.append(message["id"])
+            await asyncio.sleep(0.05)
+            if message["id"] == 0:
+                raise ValueError("failed")
+
+        eventhub.register_on_message_callback("test", {"test": callback})
+
+        async def main():
+            for i in range(50):
+                deliver(eventhub, "test", i + 1, b'{"id": %d}' % i)
+            # messages are decoded in the executor before their callback starts
+            await asyncio.sleep(0.02)
+            assert len(in_flight) == 50
+            await asyncio.gather(*eventhub._tasks)
+
+        eventhub.loop.run_until_complete(main())
+        eventhub._connection.ioloop.run()
+        assert sorted(tag for frame, tag, _ in eventhub._channel.frames if frame == "ack") == list(range(2, 51))
+        assert [tag for frame, tag, _ in eventhub._channel.frames if frame == "reject"] == [1]
+
+    def test_claim_check_off_the_loop(self):
+        """A slow claim check store does not hold up coroutine callbacks of other messages"""
+        release = threading.Event()
+
+        class SlowStore:
+            """Blocks until released, like a slow S3 call"""
+
+            def get(self, reference):
+                release.wait(5)
+                return b'{"id": 1}'
+
+            def put(self, body):
+                release.wait(5)
+                return "s3://bucket/claim-check/reply"
+
+        eventhub = AsyncEventhub(claim_check=SlowStore(), claim_check_threshold=0)
+        eventhub._connection = MockConnection()
+        eventhub._channel = MockChannel(record_properties=True)
+        eventhub._channels_by_consumer_tag["ctag"] = eventhub._channel
+        eventhub._claim_check_reader = eventhub._claim_check
+        eventhub._topology_declared = True
+        received = []
+
+        async def callback(properties, message):
+            received.append(message["id"])
+            return message
+
+        eventhub.register_on_message_callback("test", {"test": callback})
+
+        async def main():
+            deliver(eventhub, "test", 1, b"", reply_to="reply", headers={"Claim-Check": "s3://bucket/claim-check/1", "Reply-To-Callback": "cb"})
+            deliver(eventhub, "test", 2, b'{"id": 2}', reply_to="reply", headers={"Reply-To-Callback": "cb"})
+            await asyncio.sleep(0.1)
+            # the second message was handled while the first waited on S3, its reply waits on S3 too
+            assert received == [2]
+            release.set()
+            await asyncio.gather(*eventhub._tasks)
+
+        eventhub.loop.run_until_complete(main())
+        eventhub._connection.ioloop.run()
+        assert received == [2, 1]
+        assert sorted(tag for frame, tag, *_ in eventhub._channel.frames if frame == "ack") == [1, 2]
+        replies = [frame[3] for frame in eventhub._channel.frames if frame[0] == "publish"]
+        assert [properties.headers["Claim-Check"] for properties in replies] == ["s3://bucket/claim-check/reply"] * 2
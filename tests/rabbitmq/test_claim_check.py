@@ -0,0 +1,95 @@
+import io
+import pickle
+import pytest
+from botocore.exceptions import ClientError
+from cessoc.rabbitmq.claim_check import LIFECYCLE_RULE_ID, ClaimCheckException, ClaimCheckStore, parse_reference
+
+
+class FakeS3Client:
+    """In-memory stand-in for the boto3 S3 client calls the store makes"""
+
+    def __init__(self):
+        self.objects = {}
+        self.lifecycle = None
+
+    @staticmethod
+    def _error(code, operation):
+        return ClientError({"Error": {"Code": code, "Message": code}}, operation)
+
+    def put_object(self, Bucket, Key, Body):
+        self.objects[(Bucket, Key)] = bytes(Body)
+
+    def get_object(self, Bucket, Key):
+        if (Bucket, Key) not in self.objects:
+            raise self._error("NoSuchKey", "GetObject")
+        return {"Body": io.BytesIO(self.objects[(Bucket, Key)])}
+
+    def delete_object(self, Bucket, Key):
+        self.objects.pop((Bucket, Key), None)
+
+    def get_bucket_lifecycle_configuration(self, Bucket):
+        if self.lifecycle is None:
+            raise self._error("NoSuchLifecycleConfiguration", "GetBucketLifecycleConfiguration")
+        return {"Rules": self.lifecycle}
+
+    def put_bucket_lifecycle_configuration(self, Bucket, LifecycleConfiguration):
+        self.lifecycle = LifecycleConfiguration["Rules"]
+
+
+class TestClaimCheckStore:
+    """ClaimCheckStore Class Test Cases"""
+
+    def test_default_bucket(self, monkeypatch):
+        """Bodies go to the ETL bucket of the stage and campus"""
+        monkeypatch.setenv("STAGE", "dev")
+        monkeypatch.setenv("CAMPUS", "byu")
+        assert ClaimCheckStore(client=FakeS3Client()).bucket == "ces-soc-etl-dev-byu"
+
+    def test_put_get_delete(self):
+        """Stored bodies are fetched by reference and gone once deleted"""
+        store = ClaimCheckStore(bucket="bucket", client=FakeS3Client())
+        reference = store.put(b"\x00large body")
+        assert reference.startswith("s3://bucket/claim-check/")
+        assert store.get(reference) == b"\x00large body"
+        store.delete(reference)
+        with pytest.raises(ClaimCheckException):
+            store.get(reference)
+
+    def test_reference_outside_store(self):
+        """References to other buckets or outside the prefix are refused without calling S3"""
+        client = FakeS3Client()
+        client.objects[("secrets", "claim-check/key")] = b"secret"
+        client.objects[("bucket", "config/key")] = b"secret"
+        store = ClaimCheckStore(bucket="bucket", client=client)
+        for reference in ("s3://secrets/claim-check/key", "s3://bucket/config/key", "s3://bucket/claim-check/../config/key"):
+            with pytest.raises(ClaimCheckException):
+                store.get(reference)
+            with pytest.raises(ClaimCheckException):
+                store.delete(reference)
+        assert len(client.objects) == 2
+
+    def test_invalid_reference(self):
+        """References must point into S3"""
+        with pytest.raises(ClaimCheckException):
+            parse_reference("https://example.com/key")
+        assert parse_reference("s3://bucket/a/b") == ("bucket", "a/b")
+
+    def test_lifecycle_keeps_other_rules(self):
+        """The expiration rule is added once and other rules on the bucket are kept"""
+        client = FakeS3Client()
+        store = ClaimCheckStore(bucket="bucket", client=client)
+        store.configure_lifecycle(7)
+        client.lifecycle.append({"ID": "other", "Status": "Enabled"})
+        store.configure_lifecycle(3)
+        assert [rule["ID"] for rule in client.lifecycle] == ["other", LIFECYCLE_RULE_ID]
+        assert client.lifecycle[1]["Expiration"] == {"Days": 3}
+        assert client.lifecycle[1]["Filter"] == {"Prefix": "claim-check/"}
+
+    def test_picklable(self):
+        """The client is left behind when the store is passed to a worker process"""
+        pickled = pickle.dumps(ClaimCheckStore(bucket="bucket", endpoint_url="http://localhost:9000", client=FakeS3Client()))
+        # round trips a store the test pickled itself, as the worker process pool does
+        store = pickle.loads(pickled)  # nosec B301
+        assert store.bucket == "bucket"
+        assert store.endpoint_url == "http://localhost:9000"
+        assert store._client is None
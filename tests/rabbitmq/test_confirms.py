@@ -0,0 +1,74 @@
+from concurrent.futures import Future
+import pytest
+from pika.frame import Method
+from pika.spec import Basic
+from cessoc.rabbitmq.confirms import ConfirmTracker, MessageNackedException, MessageReturnedException
+
+
+@pytest.fixture(scope="function")
+def tracker():
+    """Default confirm tracker"""
+    return ConfirmTracker()
+
+
+def ack(delivery_tag, multiple=False):
+    """Builds a Basic.Ack confirm frame"""
+    return Method(1, Basic.Ack(delivery_tag=delivery_tag, multiple=multiple))
+
+
+def nack(delivery_tag, multiple=False):
+    """Builds a Basic.Nack confirm frame"""
+    return Method(1, Basic.Nack(delivery_tag=delivery_tag, multiple=multiple))
+
+
+class TestConfirmTracker:
+    """ConfirmTracker Class Test Cases"""
+
+    def test_delivery_tags_count_every_publish(self, tracker):
+        """Publishes without a future still consume a delivery tag"""
+        assert tracker.published() == 1
+        assert tracker.published(Future(), "id") == 2
+        assert len(tracker) == 1
+
+    def test_ack_resolves_future(self, tracker):
+        """Ack should resolve the future with its result"""
+        future = Future()
+        tracker.published(future, "id")
+        tracker.on_confirm(ack(1))
+        assert future.result(timeout=0) == "id"
+        assert len(tracker) == 0
+
+    def test_nack_fails_future(self, tracker):
+        """Nack should fail the future"""
+        future = Future()
+        tracker.published(future, "id")
+        tracker.on_confirm(nack(1))
+        with pytest.raises(MessageNackedException):
+            future.result(timeout=0)
+
+    def test_multiple_ack(self, tracker):
+        """A multiple ack resolves every future up to and including the delivery tag"""
+        futures = [Future() for _ in range(3)]
+        for i, future in enumerate(futures):
+            tracker.published(future, i)
+        tracker.on_confirm(ack(2, multiple=True))
+        assert futures[0].done() and futures[1].done()
+        assert not futures[2].done()
+
+    def test_returned_fails_future(self, tracker):
+        """A returned message fails even though the broker acks it afterwards"""
+        future = Future()
+        tracker.published(future, "id", correlation_id="id")
+        tracker.returned("id", "NO_ROUTE")
+        tracker.on_confirm(ack(1))
+        with pytest.raises(MessageReturnedException):
+            future.result(timeout=0)
+
+    def test_fail_all(self, tracker):
+        """Closing the channel fails pending futures and restarts numbering"""
+        future = Future()
+        tracker.published(future, "id")
+        tracker.fail_all("closed")
+        with pytest.raises(MessageNackedException):
+            future.result(timeout=0)
+        assert tracker.published() == 1
@@ -0,0 +1,109 @@
+import pytest
+from cessoc.rabbitmq import dedup
+from cessoc.rabbitmq.dedup import DedupStore, DynamoDBDedupStore, MemoryDedupStore, SqliteDedupStore
+
+
+class FakeTable:
+    """In-memory stand-in for the DynamoDB table calls the store makes"""
+
+    def __init__(self):
+        self.items = {}
+
+    def get_item(self, Key):
+        item = self.items.get(Key["key"])
+        return {"Item": item} if item is not None else {}
+
+    def put_item(self, Item):
+        self.items[Item["key"]] = Item
+
+
+def test_store_is_abstract():
+    """Stores must implement seen and add"""
+    with pytest.raises(TypeError):
+        DedupStore()
+
+
+class TestMemoryDedupStore:
+    """MemoryDedupStore Class Test Cases"""
+
+    def test_seen_after_add(self):
+        """Added keys are seen, others are not"""
+        store = MemoryDedupStore()
+        store.add("a")
+        assert store.seen("a")
+        assert not store.seen("b")
+
+    def test_least_recently_used_dropped(self):
+        """Keys looked up recently are kept over older ones once the store is full"""
+        store = MemoryDedupStore(max_entries=2)
+        store.add("a")
+        store.add("b")
+        assert store.seen("a")
+        store.add("c")
+        assert len(store) == 2
+        assert store.seen("a")
+        assert not store.seen("b")
+
+    def test_expired(self, monkeypatch):
+        """Keys are forgotten ttl seconds after they are added"""
+        now = [100.0]
+        monkeypatch.setattr(dedup.time, "monotonic", lambda: now[0])
+        store = MemoryDedupStore(ttl=10)
+        store.add("a")
+        now[0] += 10
+        assert not store.seen("a")
+        assert len(store) == 0
+
+    def test_invalid(self):
+        """At least one key must fit"""
+        with pytest.raises(ValueError):
+            MemoryDedupStore(max_entries=0)
+
+
+class TestSqliteDedupStore:
+    """SqliteDedupStore Class Test Cases"""
+
+    def test_survives_reopen(self, tmp_path):
+        """Keys are kept in the file across stores"""
+        path = str(tmp_path / "dedup.db")
+        store = SqliteDedupStore(path)
+        store.add("a")
+        store.close()
+        store = SqliteDedupStore(path)
+        assert store.seen("a")
+        assert not store.seen("b")
+        store.close()
+
+    def test_expired_purged(self, tmp_path, monkeypatch):
+        """Expired keys are not seen and are deleted on the next purge"""
+        now = [1000.0]
+        monkeypatch.setattr(dedup.time, "time", lambda: now[0])
+        monkeypatch.setattr(dedup, "SQLITE_PURGE_INTERVAL", 2)
+        store = SqliteDedupStore(str(tmp_path / "dedup.db"), ttl=10)
+        store.add("a")
+        now[0] += 10
+        assert not store.seen("a")
+        store.add("b")
+        assert store._connection.execute("SELECT key FROM processed").fetchall() == [("b",)]
+        store.close()
+
+
+class TestDynamoDBDedupStore:
+    """DynamoDBDedupStore Class Test Cases"""
+
+    def test_seen_after_add(self, monkeypatch):
+        """Keys are stored with the prefix and a whole second expiry"""
+        monkeypatch.setattr(dedup.time, "time", lambda: 1000.5)
+        table = FakeTable()
+        store = DynamoDBDedupStore(ttl=60, table=table)
+        store.add("a")
+        assert table.items == {"dedup:a": {"key": "dedup:a", "expires_at": 1060}}
+        assert store.seen("a")
+        assert not store.seen("b")
+
+    def test_expired(self, monkeypatch):
+        """Keys DynamoDB has not deleted yet are not seen once expired"""
+        table = FakeTable()
+        table.items["dedup:a"] = {"key": "dedup:a", "expires_at": 999}
+        monkeypatch.setattr(dedup.time, "time", lambda: 1000)
+        assert not DynamoDBDedupStore(table=table).seen("a")
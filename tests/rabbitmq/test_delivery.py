@@ -0,0 +1,52 @@
+import pickle
+import pytest
+from pika.spec import Basic, BasicProperties
+from cessoc.rabbitmq.delivery import DeliveryContext
+
+
+@pytest.fixture(scope="function")
+def context():
+    """Context of a message delivered from the 'campus' exchange"""
+    properties = BasicProperties(correlation_id="abc", priority=3, headers={"Reply-To-Callback": "cb"})
+    deliver = Basic.Deliver(consumer_tag="ctag", delivery_tag=7, redelivered=True, exchange="campus", routing_key="alert.new")
+    return DeliveryContext(properties, deliver)
+
+
+class TestDeliveryContext:
+    """DeliveryContext Class Test Cases"""
+
+    def test_reads_properties_and_delivery(self, context):
+        """Message properties and the delivery information are read like attributes of the properties"""
+        assert context.correlation_id == "abc"
+        assert context.priority == 3
+        assert context.headers["Reply-To-Callback"] == "cb"
+        assert context.reply_to is None
+        assert context.exchange == "campus"
+        assert context.routing_key == "alert.new"
+        assert context.delivery_tag == 7
+        assert context.redelivered
+
+    def test_not_copied(self, context):
+        """The properties are wrapped, not copied"""
+        assert context.headers is context.properties.headers
+
+    def test_read_only(self, context):
+        """Attributes cannot be set or deleted"""
+        with pytest.raises(AttributeError):
+            context.routing_key = "other"
+        with pytest.raises(AttributeError):
+            context.custom = 1
+        with pytest.raises(AttributeError):
+            del context.headers
+
+    def test_unknown_attribute(self, context):
+        """Reading an attribute that is not a message property raises AttributeError"""
+        with pytest.raises(AttributeError):
+            context.missing  # pylint: disable=pointless-statement
+
+    def test_pickle(self, context):
+        """Contexts survive pickling for worker processes"""
+        # loads only what the test pickled itself
+        restored = pickle.loads(pickle.dumps(context))  # nosec B301
+        assert restored.routing_key == "alert.new"
+        assert restored.headers == {"Reply-To-Callback": "cb"}
@@ -0,0 +1,160 @@
+import operator
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from cessoc.rabbitmq.executors import OrderedExecutor, PreforkExecutor, PriorityExecutor, RemoteTraceback, WorkerCrashedException
+from cessoc.rabbitmq.metrics import MetricsRegistry
+
+
+@pytest.fixture(scope="function")
+def pool():
+    """Thread pool the executors run on"""
+    pool = ThreadPoolExecutor(max_workers=4)
+    yield pool
+    pool.shutdown(wait=True)
+
+
+@pytest.fixture(scope="module")
+def prefork():
+    """Single worker process pool"""
+    executor = PreforkExecutor(1)
+    yield executor
+    executor.shutdown(wait=True)
+
+
+class TestOrderedExecutor:
+    """OrderedExecutor Class Test Cases"""
+
+    def test_same_key_runs_in_order(self, pool):
+        """Submissions with the same key run serially in submission order"""
+        executor = OrderedExecutor(pool, lanes=4)
+        order = []
+
+        def work(i):
+            time.sleep(0.001 * (5 - i))
+            order.append(i)
+
+        futures = [executor.submit("host-1", work, i) for i in range(5)]
+        for future in futures:
+            future.result(timeout=5)
+        assert order == [0, 1, 2, 3, 4]
+
+    def test_different_keys_run_in_parallel(self, pool):
+        """Submissions on different lanes run at the same time"""
+        executor = OrderedExecutor(pool, lanes=4)
+        keys = ["a", "b", "c", "d"]
+        assert len({executor.lane(key) for key in keys[:2]}) == 2
+        barrier = threading.Barrier(2, timeout=5)
+        futures = [executor.submit(key, barrier.wait) for key in keys[:2]]
+        for future in futures:
+            future.result(timeout=5)
+
+    def test_lane_full(self, pool):
+        """A full lane still takes submissions and reports when it has room again"""
+        available = threading.Event()
+        executor = OrderedExecutor(pool, lanes=1, max_lane_depth=1, on_available=available.set)
+        release = threading.Event()
+        executor.submit("a", release.wait, 5)
+        # wait for the first submission to start so it no longer counts towards the lane depth
+        while len(executor):
+            time.sleep(0.001)
+        assert not executor.full("a")
+        executor.submit("a", lambda: None)
+        last = executor.submit("a", lambda: "last")
+        assert executor.full("a")
+        assert executor.full()
+        release.set()
+        assert last.result(timeout=5) == "last"
+        assert available.is_set()
+        assert not executor.full()
+
+    def test_exception_sets_future(self, pool):
+        """Exceptions are set on the future and the lane keeps running"""
+        executor = OrderedExecutor(pool, lanes=1)
+        failed = executor.submit("a", lambda: 1 / 0)
+        ok = executor.submit("a", lambda: "ok")
+        with pytest.raises(ZeroDivisionError):
+            failed.result(timeout=5)
+        assert ok.result(timeout=5) == "ok"
+
+
+class TestPriorityExecutor:
+    """PriorityExecutor Class Test Cases"""
+
+    @pytest.fixture(scope="function")
+    def single(self):
+        """Single thread pool so submissions wait for each other"""
+        pool = ThreadPoolExecutor(max_workers=1)
+        yield pool
+        pool.shutdown(wait=True)
+
+    def test_highest_priority_first(self, single):
+        """Waiting submissions run by priority, then arrival order"""
+        executor = PriorityExecutor(single)
+        release = threading.Event()
+        executor.submit(0, release.wait, 5)
+        order = []
+        futures = [executor.submit(priority, order.append, name) for priority, name in [(1, "low"), (5, "high"), (None, "none"), (5, "high2")]]
+        release.set()
+        for future in futures:
+            future.result(timeout=5)
+        assert order == ["high", "high2", "low", "none"]
+
+    def test_aging(self, single):
+        """Submissions that waited long enough overtake newer higher priorities"""
+        executor = PriorityExecutor(single, aging_seconds=0.01)
+        release = threading.Event()
+        executor.submit(0, release.wait, 5)
+        order = []
+        futures = [executor.submit(0, order.append, "old")]
+        time.sleep(0.1)
+        futures.append(executor.submit(5, order.append, "new"))
+        release.set()
+        for future in futures:
+            future.result(timeout=5)
+        assert order == ["old", "new"]
+
+    def test_depth_gauge(self, single):
+        """The depth gauge counts waiting submissions per priority"""
+        gauge = MetricsRegistry().gauge("depth", "Depth", ("priority",))
+        executor = PriorityExecutor(single, depth_gauge=gauge)
+        release = threading.Event()
+        executor.submit(0, release.wait, 5)
+        while len(executor):
+            time.sleep(0.001)
+        last = [executor.submit(3, lambda: None) for _ in range(2)][-1]
+        assert gauge.get(priority="3") == 2
+        release.set()
+        last.result(timeout=5)
+        assert gauge.get(priority="3") == 0
+
+
+class TestPreforkExecutor:
+    """PreforkExecutor Class Test Cases"""
+
+    def test_result(self, prefork):
+        """Results are sent back from the worker"""
+        assert prefork.submit(operator.add, 1, 2).result(timeout=30) == 3
+
+    def test_exception_has_remote_traceback(self, prefork):
+        """Exceptions are raised with the worker traceback as the cause"""
+        with pytest.raises(ValueError) as ex:
+            prefork.submit(int, "not a number").result(timeout=30)
+        assert isinstance(ex.value.__cause__, RemoteTraceback)
+
+    def test_crash_fails_only_its_submission(self, prefork):
+        """A worker that dies only fails its own submission and is replaced"""
+        crashed = prefork.submit(os._exit, 1)
+        after = prefork.submit(operator.add, 2, 2)
+        with pytest.raises(WorkerCrashedException):
+            crashed.result(timeout=30)
+        assert after.result(timeout=30) == 4
+
+    def test_unpicklable_job(self, prefork):
+        """Jobs that cannot be pickled fail without affecting the worker"""
+        with pytest.raises(Exception):
+            prefork.submit(lambda: None).result(timeout=30)
+        assert prefork.submit(operator.add, 1, 1).result(timeout=30) == 2
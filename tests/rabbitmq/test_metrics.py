@@ -0,0 +1,75 @@
+import urllib.request
+
+import pytest
+from cessoc.rabbitmq import metrics
+from cessoc.rabbitmq.metrics import MetricsRegistry, MetricsServer
+
+
+@pytest.fixture(scope="function")
+def registry():
+    """Empty metrics registry"""
+    return MetricsRegistry()
+
+
+class TestMetrics:
+    """Counter, Gauge and Histogram Test Cases"""
+
+    def test_metric_is_abstract(self):
+        """Metric types must render their samples"""
+        with pytest.raises(TypeError):
+            metrics._Metric("name", "documentation")
+
+    def test_counter_labels(self, registry):
+        """Counters keep a value per label set"""
+        counter = registry.counter("received_total", "Received", ("queue",))
+        counter.inc(queue="a")
+        counter.inc(2, queue="a")
+        counter.inc(queue="b")
+        assert counter.get(queue="a") == 3
+        assert 'received_total{queue="b"} 1' in registry.render()
+
+    def test_gauge(self, registry):
+        """Gauges go up and down"""
+        gauge = registry.gauge("in_flight", "In flight")
+        gauge.inc(3)
+        gauge.dec()
+        assert gauge.get() == 2
+        gauge.set(0.5)
+        assert "in_flight 0.5" in registry.render()
+
+    def test_histogram_cumulative_buckets(self, registry):
+        """Histogram buckets are cumulative and end with +Inf"""
+        histogram = registry.histogram("latency_seconds", "Latency", buckets=(0.1, 1.0))
+        for value in (0.05, 0.5, 5):
+            histogram.observe(value)
+        text = registry.render()
+        assert 'latency_seconds_bucket{le="0.1"} 1' in text
+        assert 'latency_seconds_bucket{le="1.0"} 2' in text
+        assert 'latency_seconds_bucket{le="+Inf"} 3' in text
+        assert "latency_seconds_count 3" in text
+        assert "# TYPE latency_seconds histogram" in text
+
+    def test_label_values_escaped(self, registry):
+        """Quotes and backslashes in label values are escaped"""
+        registry.counter("c_total", "C", ("key",)).inc(key='a"b\\c')
+        assert 'c_total{key="a\\"b\\\\c"} 1' in registry.render()
+
+    def test_register_existing(self, registry):
+        """Registering the same name returns the existing metric"""
+        assert registry.counter("c_total", "C") is registry.counter("c_total", "C")
+
+
+class TestMetricsServer:
+    """MetricsServer Class Test Cases"""
+
+    def test_serves_metrics(self, registry):
+        """GET /metrics returns the registry in Prometheus text format"""
+        registry.counter("c_total", "C").inc()
+        server = MetricsServer(registry, 0, host="127.0.0.1")
+        server.start()
+        try:
+            with urllib.request.urlopen(f"http://127.0.0.1:{server.port}/metrics", timeout=5) as response:  # nosec
+                assert response.headers["Content-Type"].startswith("text/plain; version=0.0.4")
+                assert "c_total 1" in response.read().decode("utf-8")
+        finally:
+            server.stop()
@@ -0,0 +1,62 @@
+import pytest
+from cessoc.rabbitmq.prefetch import PrefetchTuner
+
+
+class Interval:
+    """Accumulates histogram totals like the Eventhub metrics"""
+
+    def __init__(self, tuner):
+        self.tuner = tuner
+        self.totals = [0, 0.0, 0, 0.0]
+
+    def run(self, messages, latency, wait, peak_in_flight):
+        """Reports an interval of messages with the given handler latency and queue wait"""
+        self.tuner.record_in_flight(peak_in_flight)
+        self.totals[0] += messages
+        self.totals[1] += messages * latency
+        self.totals[2] += messages
+        self.totals[3] += messages * wait
+        return self.tuner.update(*self.totals)
+
+
+class TestPrefetchTuner:
+    """PrefetchTuner Class Test Cases"""
+
+    def test_increase_when_saturated(self):
+        """The prefetch count grows by one while every prefetched message is in use"""
+        tuner = PrefetchTuner(4, minimum=1, maximum=6)
+        interval = Interval(tuner)
+        assert interval.run(100, 0.01, 0.0, 4) == 5
+        assert interval.run(100, 0.01, 0.0, 5) == 6
+        # capped at the maximum
+        assert interval.run(100, 0.01, 0.0, 6) == 6
+
+    def test_hold_when_not_saturated(self):
+        """The prefetch count stays when not all prefetched messages are used"""
+        tuner = PrefetchTuner(4)
+        assert Interval(tuner).run(100, 0.01, 0.0, 2) == 4
+
+    def test_decrease_when_hoarding(self):
+        """The prefetch count halves when messages wait locally for a worker"""
+        tuner = PrefetchTuner(8, minimum=3)
+        interval = Interval(tuner)
+        assert interval.run(100, 0.01, 0.02, 8) == 4
+        # floored at the minimum
+        assert interval.run(100, 0.01, 0.02, 4) == 3
+
+    def test_decrease_when_latency_climbs(self):
+        """The prefetch count halves when handler latency climbs above the baseline"""
+        tuner = PrefetchTuner(8)
+        interval = Interval(tuner)
+        interval.run(100, 0.01, 0.0, 8)
+        assert interval.run(100, 0.05, 0.0, 9) == 4
+
+    def test_idle_interval(self):
+        """Intervals without completed messages do not change the prefetch count"""
+        tuner = PrefetchTuner(4)
+        assert Interval(tuner).run(0, 0.0, 0.0, 4) == 4
+
+    def test_invalid_bounds(self):
+        """Bounds must be ordered"""
+        with pytest.raises(ValueError):
+            PrefetchTuner(4, minimum=5, maximum=2)
@@ -0,0 +1,135 @@
+import json
+import pika
+import pytest
+from cessoc.rabbitmq.publisher import Publisher
+
+
+class MockBlockingChannel:
+    """Records declares and publishes"""
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.is_closed = False
+        self.is_open = True
+        self.consumers = {}
+
+    def basic_consume(self, queue, on_message_callback, auto_ack=False):
+        self.consumers[queue] = on_message_callback
+        return "ctag"
+
+    def basic_cancel(self, consumer_tag):
+        self.consumers = {}
+
+    def exchange_declare(self, exchange, **kwargs):
+        self.connection.declared.append(exchange)
+
+    def basic_publish(self, exchange, routing_key, body, properties, mandatory=True):
+        if self.connection.fail_publish_at == len(self.connection.published):
+            self.connection.fail_publish_at = None
+            self.connection.is_closed = True
+            raise pika.exceptions.StreamLostError("lost")
+        self.connection.published.append((exchange, routing_key, json.loads(body), properties.correlation_id))
+        if properties.reply_to and json.loads(body).get("reply", True):
+            # replies arrive in reverse order of the requests
+            self.connection.replies.insert(0, (self.consumers[properties.reply_to], properties.correlation_id, body))
+
+
+class MockBlockingConnection:
+    """Tracks every connection opened"""
+
+    opened = []
+    # index of the publish the next connection opened fails on
+    fail_next_publish_at = None
+
+    def __init__(self, parameters):
+        self.parameters = parameters
+        self.declared = []
+        self.published = []
+        self.replies = []
+        self.is_closed = False
+        self.fail_publish_at = MockBlockingConnection.fail_next_publish_at
+        MockBlockingConnection.fail_next_publish_at = None
+        MockBlockingConnection.opened.append(self)
+
+    @property
+    def is_open(self):
+        return not self.is_closed
+
+    def channel(self):
+        return MockBlockingChannel(self)
+
+    def process_data_events(self, time_limit=None):
+        if self.is_closed:
+            raise pika.exceptions.ConnectionClosed(320, "closed")
+        if self.replies:
+            callback, correlation_id, body = self.replies.pop(0)
+            callback(None, None, pika.BasicProperties(correlation_id="unrelated"), b"{}")
+            callback(None, None, pika.BasicProperties(correlation_id=correlation_id), body)
+
+    def close(self):
+        self.is_closed = True
+
+
+@pytest.fixture(scope="function")
+def publisher(monkeypatch):
+    """Publisher with mock connections"""
+    MockBlockingConnection.opened = []
+    monkeypatch.setattr(pika, "BlockingConnection", MockBlockingConnection)
+    return Publisher("test", exchange="byu", json_credentials={"username": "edm", "password": "pw"}, endpoint="localhost")  # nosec
+
+
+class TestPublisher:
+    """Publisher Class Test Cases"""
+
+    def test_publish_many_one_connection(self, publisher):
+        """A batch of messages should reuse one connection"""
+        correlation_ids = publisher.publish_many("test", [{"id": i} for i in range(100)])
+        assert len(MockBlockingConnection.opened) == 1
+        connection = MockBlockingConnection.opened[0]
+        assert [message for _, _, message, _ in connection.published] == [{"id": i} for i in range(100)]
+        assert [correlation_id for _, _, _, correlation_id in connection.published] == correlation_ids
+
+    def test_connection_reused_between_calls(self, publisher):
+        """Connections and declared exchanges should be cached between calls"""
+        publisher.publish("test", {"id": 1})
+        publisher.publish("test", {"id": 2})
+        assert len(MockBlockingConnection.opened) == 1
+        assert MockBlockingConnection.opened[0].declared == ["byu"]
+
+    def test_lost_connection_retried(self, publisher):
+        """A lost connection should be replaced and the batch resumed where it stopped"""
+        MockBlockingConnection.fail_next_publish_at = 0
+        publisher.publish_many("test", [{"id": 1}, {"id": 2}])
+        assert len(MockBlockingConnection.opened) == 2
+        assert [message for _, _, message, _ in MockBlockingConnection.opened[1].published] == [{"id": 1}, {"id": 2}]
+
+    def test_closed_idle_connection_replaced(self, publisher):
+        """Idle connections closed by the broker should not be reused"""
+        publisher.publish("test", {"id": 1})
+        MockBlockingConnection.opened[0].is_closed = True
+        publisher.publish("test", {"id": 2})
+        assert len(MockBlockingConnection.opened) == 2
+
+    def test_close(self, publisher):
+        """Closing the publisher closes idle connections"""
+        with publisher:
+            publisher.publish("test", {"id": 1})
+        assert MockBlockingConnection.opened[0].is_closed
+
+    def test_request_many_matches_replies(self, publisher):
+        """Replies should be matched to their request by correlation ID regardless of order"""
+        replies = publisher.request_many("test", [{"id": 1}, {"id": 2}, {"id": 3}], timeout=1)
+        assert replies == [{"id": 1}, {"id": 2}, {"id": 3}]
+        assert len(MockBlockingConnection.opened) == 1
+
+    def test_request_many_lost_connection(self, publisher):
+        """Requests already sent are not sent again on the new connection, their replies are lost with the old one"""
+        MockBlockingConnection.fail_next_publish_at = 1
+        replies = publisher.request_many("test", [{"id": 1}, {"id": 2}, {"id": 3}], timeout=1)
+        assert replies == [None, {"id": 2}, {"id": 3}]
+        assert [message for _, _, message, _ in MockBlockingConnection.opened[0].published] == [{"id": 1}]
+        assert [message for _, _, message, _ in MockBlockingConnection.opened[1].published] == [{"id": 2}, {"id": 3}]
+
+    def test_request_timeout(self, publisher):
+        """Requests without a reply should return None after the timeout"""
+        assert publisher.request("test", {"reply": False}, timeout=0.01) is None
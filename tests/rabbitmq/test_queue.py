@@ -72,6 +72,17 @@ class TestQueueArguments:
         queue_arguments.max_priority = 1
         assert queue_arguments.arguments == {"x-max-priority": 1}
 
+    def test_get_arguments_dead_letter(self):
+        """TTL and dead letter arguments should be included, the default exchange as an empty string"""
+        arguments = QueueArguments(message_ttl=5000, dead_letter_exchange="", dead_letter_routing_key="test")
+        assert arguments.arguments == {"x-message-ttl": 5000, "x-dead-letter-exchange": "", "x-dead-letter-routing-key": "test"}
+        assert arguments != QueueArguments(message_ttl=5000)
+
+    def test_negative_message_ttl(self):
+        """Message TTL cannot be negative"""
+        with pytest.raises(ValueError):
+            QueueArguments(message_ttl=-1)
+
 
 class TestQueue:
     """Queue Class Test Cases"""
@@ -237,3 +248,11 @@ class TestQueueDefinitionManager:
         queue_manager.register_queue(queue, ["test1", "test2"])
         assert queue_manager.queue_bindings["test1"][-1].name == "test"
         assert queue_manager.queue_bindings["test2"][-1].name == "test"
+
+    def test_routing_index_cached(self, queue_manager):
+        """The routing index should be built once per queue registration"""
+        qu = Queue("wildcard", bindings={"alert.*": "callback"})
+        queue_manager.register_queue(qu)
+        index = queue_manager.routing_index(qu)
+        assert queue_manager.routing_index(qu) is index
+        assert index.match("alert.create") == "alert.*"
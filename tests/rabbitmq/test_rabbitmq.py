@@ -1,10 +1,25 @@
 import datetime
+import gzip
+import json
+import os
+import threading
+import time
+from concurrent.futures import Executor, Future
 from dateutil.tz import tzutc
 import pytest
 import boto3
 from botocore.exceptions import ClientError, ParamValidationError
 
+from pika.frame import Method
+from pika.spec import BasicProperties, Basic
 from cessoc.rabbitmq import rabbitmq as rabbit
+from cessoc.rabbitmq.claim_check import ClaimCheckStore
+from cessoc.rabbitmq.dedup import MemoryDedupStore
+from cessoc.rabbitmq.executors import OrderedExecutor
+from cessoc.rabbitmq.retry import RetryPolicy
+from cessoc.rabbitmq.spool import Spool
+from tests.rabbitmq.conftest import MockChannel, MockConnection, deliver, open_consumer_channel, wait_for_tasks
+from tests.rabbitmq.test_claim_check import FakeS3Client
 
 
 class MockBoto3Client:
@@ -127,3 +142,761 @@ class TestEDM:
 
     def test_edm(self):
         rabbit.Eventhub()
+
+
+def process_callback(properties, message):
+    """Module level callback so it can be pickled to a worker process"""
+    if message.get("fail"):
+        raise ValueError("failed")
+    return {"routing_key": properties.routing_key, "pid": os.getpid()}
+
+
+class TestEventhubBatch:
+    """Eventhub batch callback Test Cases"""
+
+    def test_full_batch_single_ack(self, eventhub):
+        """A full batch should be processed together and acked with one frame"""
+        batches = []
+        eventhub.register_on_batch_callback("test", {"test": batches.append}, max_batch=3)
+        open_consumer_channel(eventhub, eventhub._channel)
+        for tag in range(1, 4):
+            deliver(eventhub, "test", tag, b'{"id": %d}' % tag)
+        wait_for_tasks(eventhub)
+        assert [message["id"] for _, message in batches[0]] == [1, 2, 3]
+        assert eventhub._channel.frames == [("ack", 3, True)]
+
+    def test_partial_batch_flushed_by_timer(self, eventhub):
+        """A partial batch should be processed once max_wait_ms passes"""
+        batches = []
+        eventhub.register_on_batch_callback("test", {"test": batches.append}, max_batch=10)
+        open_consumer_channel(eventhub, eventhub._channel)
+        deliver(eventhub, "test", 1, b'{"id": 1}')
+        assert not batches
+        eventhub._connection.ioloop.fire_timers()
+        wait_for_tasks(eventhub)
+        assert len(batches[0]) == 1
+
+    def test_failed_items_rejected(self, eventhub):
+        """Only the items reported as failed should be rejected"""
+        eventhub.register_on_batch_callback("test", {"test": lambda items: [1]}, max_batch=3)
+        open_consumer_channel(eventhub, eventhub._channel)
+        for tag in range(1, 4):
+            deliver(eventhub, "test", tag, b'{}')
+        wait_for_tasks(eventhub)
+        assert eventhub._channel.frames == [("ack", 1, True), ("reject", 2, False), ("ack", 3, True)]
+
+    @pytest.mark.parametrize("result", [True, 1, [3], ["0"]])
+    def test_invalid_result_rejects_batch(self, eventhub, result):
+        """A callback that does not return the indexes of failed items gets the whole batch rejected"""
+        eventhub.register_on_batch_callback("test", {"test": lambda items: result}, max_batch=3)
+        open_consumer_channel(eventhub, eventhub._channel)
+        for tag in range(1, 4):
+            deliver(eventhub, "test", tag, b'{}')
+        wait_for_tasks(eventhub)
+        assert eventhub._channel.frames == [("reject", 1, False), ("reject", 2, False), ("reject", 3, False)]
+
+    def test_coroutine_callback_refused(self, eventhub):
+        """Batch callbacks are not awaited, so coroutine functions are refused"""
+        async def callback(items):
+            pass
+
+        with pytest.raises(TypeError):
+            eventhub.register_on_batch_callback("test", {"test": callback})
+
+    def test_waiting_batch_not_covered_by_later_ack(self, eventhub):
+        """A message waiting in a batch is not acked by a multiple ack of a later message on the same channel"""
+        eventhub.register_on_batch_callback("batch", {"test": lambda items: [0]}, max_batch=10)
+        eventhub.register_on_message_callback("plain", {"test": lambda props, msg: None})
+        open_consumer_channel(eventhub, eventhub._channel)
+        deliver(eventhub, "batch", 1, b"{}")
+        deliver(eventhub, "plain", 2, b"{}")
+        wait_for_tasks(eventhub)
+        assert eventhub._channel.frames == [("ack", 2, False)]
+        eventhub._thread_pool_executor = rabbit.ThreadPoolExecutor(max_workers=1)
+        eventhub._connection.ioloop.fire_timers()
+        wait_for_tasks(eventhub)
+        assert eventhub._channel.frames == [("ack", 2, False), ("reject", 1, False)]
+
+
+class InlineExecutor(Executor):
+    """Runs submissions on the calling thread, so they finish before submit returns"""
+
+    def submit(self, fn, *args, **kwargs):
+        future = Future()
+        future.set_result(fn(*args, **kwargs))
+        return future
+
+
+class TestEventhubAckCoalescing:
+    """Eventhub ack coalescing Test Cases"""
+
+    def test_delivery_finishing_before_submit_returns(self, eventhub):
+        """A delivery settled before the dispatcher gets control back is still coalesced and leaves nothing pending"""
+        eventhub._coalesce_acks = True
+        open_consumer_channel(eventhub, eventhub._channel)
+        eventhub._thread_pool_executor = InlineExecutor()
+        eventhub.register_on_message_callback("test", {"test": lambda props, msg: None})
+        for tag in (1, 2):
+            deliver(eventhub, "test", tag, b"{}")
+        eventhub._connection.ioloop.run()
+        assert eventhub._channel.frames == [("ack", 2, True)]
+        assert len(eventhub._ack_coalescers[eventhub._channel]) == 0
+
+
+class TestEventhubRequest:
+    """Eventhub request/response Test Cases"""
+
+    def test_request_requires_reply_queue(self, eventhub):
+        """Requests need a reply-to queue"""
+        with pytest.raises(AttributeError):
+            eventhub.request({"id": 1}, "test")
+
+    def test_reply_resolves_future(self, eventhub):
+        """A reply with the request correlation ID resolves the future"""
+        eventhub.enable_requests()
+        future = eventhub.request({"id": 1}, "test")
+        eventhub._connection.ioloop.run()
+        assert eventhub._channel.frames[0][:2] == ("publish", "test")
+        correlation_id = next(iter(eventhub._pending_requests))
+        assert len(eventhub._connection.ioloop.timers) == 1
+        eventhub._on_reply_to(BasicProperties(correlation_id=correlation_id, headers={}), {"reply": True})
+        assert future.result(timeout=0) == {"reply": True}
+        assert not eventhub._pending_requests
+        # the timeout is stopped
+        eventhub._connection.ioloop.run()
+        assert eventhub._connection.ioloop.timers == []
+
+    def test_request_timeout(self, eventhub):
+        """Requests without a reply fail once the timeout passes"""
+        eventhub.enable_requests()
+        future = eventhub.request({"id": 1}, "test", timeout=1)
+        eventhub._connection.ioloop.run()
+        eventhub._connection.ioloop.fire_timers()
+        with pytest.raises(TimeoutError):
+            future.result(timeout=0)
+
+    def test_pending_request_limit(self, eventhub):
+        """Requests beyond max_pending_requests fail right away"""
+        eventhub._max_pending_requests = 1
+        eventhub.enable_requests()
+        eventhub.request({"id": 1}, "test")
+        with pytest.raises(rabbit.RequestLimitException):
+            eventhub.request({"id": 2}, "test").result(timeout=0)
+
+
+class TestEventhubMetrics:
+    """Eventhub metrics Test Cases"""
+
+    def test_ack_and_reject_counted_per_routing_key(self, eventhub):
+        """Acked and rejected messages are counted per queue and routing key"""
+        eventhub.register_on_message_callback("test", {"ok": lambda props, msg: None, "fail": lambda props, msg: 1 / 0})
+        deliver(eventhub, "test", 1, b"{}", routing_key="ok")
+        deliver(eventhub, "test", 2, b"{}", routing_key="fail")
+        wait_for_tasks(eventhub)
+        metrics = eventhub.metrics
+        assert metrics.received.get(queue="test", routing_key="ok") == 1
+        assert metrics.acked.get(queue="test", routing_key="ok") == 1
+        assert metrics.rejected.get(queue="test", routing_key="fail") == 1
+        assert metrics.handler_seconds.count(queue="test", routing_key="ok") == 1
+        assert metrics.queued_seconds.count(queue="test") == 2
+        assert metrics.in_flight.get() == 0
+
+    def test_reply_counted(self, eventhub):
+        """Replies sent to requesters are counted"""
+        eventhub.register_on_message_callback("test", {"test": lambda props, msg: {"reply": True}})
+        deliver(eventhub, "test", 1, b"{}", reply_to="reply", headers={"Reply-To-Callback": "cb"})
+        wait_for_tasks(eventhub)
+        assert eventhub.metrics.replies.get(queue="test", routing_key="test") == 1
+
+
+class TestEventhubStop:
+    """Eventhub shutdown Test Cases"""
+
+    def test_stop_when_idle(self, eventhub):
+        """Stopping without in-flight messages closes right away"""
+        eventhub.stop()
+        eventhub._connection.ioloop.run()
+        assert eventhub._connection.is_closed
+        assert eventhub._connection.ioloop.stopped
+
+    def test_task_check_deprecated(self, eventhub):
+        """The old positional task_check still stops the service, with a warning"""
+        with pytest.warns(DeprecationWarning):
+            eventhub.stop(2)
+        eventhub._connection.ioloop.run()
+        assert eventhub._connection.is_closed
+
+    def test_stop_drains_when_last_task_finishes(self, eventhub):
+        """Stopping waits for in-flight messages and closes once the last one is settled"""
+        release = threading.Event()
+        eventhub.register_on_message_callback("test", {"test": lambda props, msg: release.wait(5) and None})
+        deliver(eventhub, "test", 1, b"{}")
+        eventhub.stop()
+        eventhub._connection.ioloop.run()
+        assert not eventhub._connection.is_closed
+        release.set()
+        assert eventhub.wait_until_idle(timeout=5)
+        eventhub._connection.ioloop.run()
+        assert eventhub._channel.frames == [("ack", 1, False)]
+        assert eventhub._connection.is_closed
+
+    def test_deadline_requeues_unfinished(self, eventhub):
+        """Messages still being processed at the deadline are requeued"""
+        release = threading.Event()
+        eventhub.register_on_message_callback("test", {"test": lambda props, msg: release.wait(5) and None})
+        deliver(eventhub, "test", 1, b"{}")
+        eventhub.stop(deadline=1)
+        eventhub._connection.ioloop.run()
+        eventhub._connection.ioloop.fire_timers()
+        assert eventhub._channel.frames == [("reject", 1, True)]
+        assert eventhub._connection.is_closed
+        release.set()
+
+
+class TestEventhubOrdering:
+    """Eventhub ordering key Test Cases"""
+
+    def test_same_key_processed_in_order(self, eventhub):
+        """Messages with the same ordering key header are processed in delivery order"""
+        order = []
+
+        def callback(properties, message):
+            time.sleep(0.001 * (5 - message["id"]))
+            order.append(message["id"])
+
+        eventhub.register_on_message_callback("test", {"test": callback}, ordering_key="host")
+        for i in range(5):
+            deliver(eventhub, "test", i + 1, b'{"id": %d}' % i, headers={"host": "a"})
+        wait_for_tasks(eventhub)
+        assert order == [0, 1, 2, 3, 4]
+        assert eventhub._channel.frames == [("ack", tag, False) for tag in range(1, 6)]
+
+    def test_key_from_body(self, eventhub):
+        """The ordering key falls back to the body field"""
+        assert eventhub._ordering_key("host", BasicProperties(headers={}), b'{"host": "a"}') == "a"
+        assert eventhub._ordering_key(lambda props, msg: msg["id"], BasicProperties(), b'{"id": 1}') == 1
+        assert eventhub._ordering_key("host", BasicProperties(), b"not json") is None
+
+    def test_full_lane_pauses_consumer(self, eventhub):
+        """A full lane pauses the consumer instead of requeueing, and consuming resumes once it drains"""
+        eventhub._ordered_executor = OrderedExecutor(eventhub._thread_pool_executor, 1, 1, eventhub._on_lane_available)
+        release = threading.Event()
+        eventhub.register_on_message_callback("test", {"test": lambda props, msg: release.wait(5) and None}, ordering_key="host")
+        eventhub._queue_manager.queues["test"].consumer_tag = "ctag"
+        eventhub._queue_channels["test"] = 0
+        deliver(eventhub, "test", 1, b"{}", headers={"host": "a"})
+        while len(eventhub._ordered_executor):
+            time.sleep(0.001)
+        deliver(eventhub, "test", 2, b"{}", headers={"host": "a"})
+        assert eventhub._channel.frames == [("cancel", "ctag")]
+        eventhub._channel.confirm_all()
+        release.set()
+        wait_for_tasks(eventhub)
+        assert eventhub._channel.frames[1:] == [("ack", 1, False), ("consume", "test"), ("ack", 2, False)]
+        assert not eventhub._paused_queues
+
+    def test_coroutine_rejected(self, eventhub):
+        """Coroutine callbacks cannot be ordered"""
+        async def callback(properties, message):
+            pass
+
+        with pytest.raises(ValueError):
+            eventhub.register_on_message_callback("test", {"test": callback}, ordering_key="host")
+
+
+class TestEventhubProcess:
+    """Eventhub process execution mode Test Cases"""
+
+    def test_process_callback(self, eventhub):
+        """Callbacks run in a worker process and their replies and acks are sent from this process"""
+        eventhub._process_workers = 1
+        eventhub.register_on_message_callback("test", {"test": process_callback}, execution_mode="process")
+        deliver(eventhub, "test", 1, b"{}", reply_to="reply", headers={"Reply-To-Callback": "cb"})
+        deliver(eventhub, "test", 2, b'{"fail": true}')
+        eventhub._process_executor.shutdown(wait=True)
+        eventhub._connection.ioloop.run()
+        reply = json.loads(eventhub._channel.frames[0][2])
+        assert reply["routing_key"] == "test"
+        assert reply["pid"] != os.getpid()
+        assert eventhub._channel.frames[1:] == [("ack", 1, False), ("reject", 2, False)]
+
+    def test_unknown_execution_mode(self, eventhub):
+        """Only thread and process execution modes exist"""
+        with pytest.raises(ValueError):
+            eventhub.register_on_message_callback("test", {"test": process_callback}, execution_mode="fiber")
+
+
+class TestEventhubChannels:
+    """Eventhub consumer and publish channel Test Cases"""
+
+    def test_settled_on_delivering_channel(self, eventhub):
+        """Messages are settled on the channel they were delivered on, replies are published on the publish channel"""
+        consumer = MockChannel()
+        eventhub._channels_by_consumer_tag["ctag"] = consumer
+        eventhub.register_on_message_callback("test", {"test": lambda props, msg: {"reply": True}})
+        deliver(eventhub, "test", 1, b"{}", reply_to="reply", headers={"Reply-To-Callback": "cb"})
+        wait_for_tasks(eventhub)
+        assert consumer.frames == [("ack", 1, False)]
+        assert eventhub._channel.frames[0][:2] == ("publish", "reply")
+
+    def test_queues_spread_over_consumer_channels(self):
+        """Queues are assigned to consumer channels round robin"""
+        hub = rabbit.Eventhub(consumer_channels=2)
+        for name in ("a", "b", "c"):
+            hub.register_on_message_callback(name, {"test": lambda props, msg: None})
+        assert [hub._consumer_channel_index(queue) for queue in hub._queue_manager.queues.values()] == [0, 1, 0]
+
+    def test_consumer_channel_closed_reopens_alone(self, eventhub):
+        """A closed consumer channel is reopened and its queues consume again without closing the connection"""
+        eventhub.register_on_message_callback("test", {"test": lambda props, msg: None})
+        queue = eventhub._queue_manager.queues["test"]
+        queue.consumer_tag = "ctag"
+        eventhub._queue_channels["test"] = 0
+        eventhub._on_consumer_channel_closed(eventhub._channel, Exception("closed"), index=0)
+        assert queue.consumer_tag is None
+        assert eventhub._pending_consumers[0] == [queue]
+        assert "ctag" not in eventhub._channels_by_consumer_tag
+        assert not eventhub._connection.is_closed
+        assert len(eventhub._connection.ioloop.timers) == 1
+
+
+class TestEventhubCompression:
+    """Eventhub compressed message body Test Cases"""
+
+    def test_large_bodies_compressed(self):
+        """Bodies over the threshold are gzipped and labelled, smaller ones are sent as plain UTF-8 JSON"""
+        hub = rabbit.Eventhub(compression="gzip", compression_threshold=100)
+        hub._connection = MockConnection()
+        hub._channel = MockChannel(record_properties=True)
+        hub._topology_declared = True
+        large = {"events": [{"ip": "10.0.0.1", "action": "allow"}] * 50}
+        hub._publish_message(large, "test")
+        hub._publish_message({"small": True}, "test")
+        (_, _, compressed, properties), (_, _, plain, plain_properties) = hub._channel.frames
+        assert properties.content_encoding == "gzip"
+        assert json.loads(gzip.decompress(compressed)) == large
+        assert plain_properties.content_encoding == "utf-8"
+        assert json.loads(plain) == {"small": True}
+        assert hub.metrics.compressed_bytes_out.get() == len(compressed)
+        assert hub.metrics.compression_ratio.count() == 1
+
+    def test_incompressible_bodies_sent_plain(self):
+        """Bodies that do not get smaller are sent uncompressed"""
+        hub = rabbit.Eventhub(compression="gzip", compression_threshold=0)
+        assert hub._encode_body({"a": 1}) == (b'{"a": 1}', "application/json", "utf-8", None)
+
+    def test_compressed_message_decompressed(self, eventhub):
+        """Compressed deliveries reach the callback decoded, plain ones still work"""
+        received = []
+        eventhub.register_on_message_callback("test", {"test": lambda props, msg: received.append(msg)})
+        deliver(eventhub, "test", 1, gzip.compress(b'{"index": 1}'), content_encoding="gzip")
+        deliver(eventhub, "test", 2, b'{"index": 2}')
+        wait_for_tasks(eventhub)
+        assert sorted(message["index"] for message in received) == [1, 2]
+        assert sorted(eventhub._channel.frames) == [("ack", 1, False), ("ack", 2, False)]
+
+    def test_corrupt_or_unknown_encoding_rejected(self, eventhub):
+        """Bodies that cannot be decompressed and unknown content encodings are rejected"""
+        eventhub.register_on_message_callback("test", {"test": lambda props, msg: None})
+        deliver(eventhub, "test", 1, b'{"index": 1}', content_encoding="gzip")
+        deliver(eventhub, "test", 2, b'{"index": 2}', content_encoding="br")
+        wait_for_tasks(eventhub)
+        assert sorted(eventhub._channel.frames) == [("reject", 1, False), ("reject", 2, False)]
+
+
+class TestEventhubSerializers:
+    """Eventhub content type Test Cases"""
+
+    def test_msgpack_consumed_and_replied(self, eventhub):
+        """msgpack messages reach the callback with bytes intact and the reply is sent as msgpack"""
+        msgpack = pytest.importorskip("msgpack")
+        eventhub._channel = MockChannel(record_properties=True)
+        eventhub.register_on_message_callback("test", {"test": lambda props, msg: {"echo": msg["raw"]}})
+        deliver(
+            eventhub,
+            "test",
+            1,
+            msgpack.packb({"raw": b"\x00\xff"}),
+            content_type="application/msgpack",
+            content_encoding="identity",
+            reply_to="reply",
+            headers={"Reply-To-Callback": "cb"},
+        )
+        wait_for_tasks(eventhub)
+        _, routing_key, body, properties = eventhub._channel.frames[0]
+        assert routing_key == "reply"
+        assert properties.content_type == "application/msgpack"
+        assert properties.content_encoding == "identity"
+        assert msgpack.unpackb(body) == {"echo": b"\x00\xff"}
+
+    def test_content_type_per_publish(self, eventhub):
+        """Each publish can pick its content type, the default stays JSON"""
+        msgpack = pytest.importorskip("msgpack")
+        eventhub._channel = MockChannel(record_properties=True)
+        eventhub._publish_message({"index": 1}, "test", content_type="application/msgpack")
+        eventhub._publish_message({"index": 2}, "test")
+        (_, _, packed, packed_properties), (_, _, plain, plain_properties) = eventhub._channel.frames
+        assert packed_properties.content_type == "application/msgpack"
+        assert packed_properties.content_encoding == "identity"
+        assert msgpack.unpackb(packed) == {"index": 1}
+        assert plain_properties.content_type == "application/json"
+        assert plain_properties.content_encoding == "utf-8"
+        assert json.loads(plain) == {"index": 2}
+        with pytest.raises(ValueError):
+            eventhub._encode_body({}, "application/xml")
+
+    def test_unknown_content_type_rejected(self, eventhub):
+        """Messages with a content type that has no serializer are rejected"""
+        eventhub.register_on_message_callback("test", {"test": lambda props, msg: None})
+        deliver(eventhub, "test", 1, b"<xml/>", content_type="application/xml")
+        assert eventhub._channel.frames == [("reject", 1, False)]
+
+
+class TestEventhubClaimCheck:
+    """Eventhub S3 claim check Test Cases"""
+
+    def test_large_body_offloaded(self):
+        """Bodies over the threshold are stored in S3 and only the reference is published"""
+        store = ClaimCheckStore(bucket="bucket", client=FakeS3Client())
+        hub = rabbit.Eventhub(claim_check=store, claim_check_threshold=20)
+        hub._connection = MockConnection()
+        hub._channel = MockChannel(record_properties=True)
+        hub._topology_declared = True
+        hub._publish_message({"data": "x" * 100}, "test")
+        hub._publish_message({"small": True}, "test")
+        (_, _, body, properties), (_, _, small, small_properties) = hub._channel.frames
+        assert body == b""
+        assert json.loads(store.get(properties.headers["Claim-Check"])) == {"data": "x" * 100}
+        assert json.loads(small) == {"small": True}
+        assert small_properties.headers is None
+        assert hub.metrics.claim_checks_stored.get() == 1
+
+    def test_claim_check_fetched_before_callback(self, eventhub):
+        """The callback receives the stored body, bodies that expired are rejected"""
+        store = ClaimCheckStore(bucket="bucket", client=FakeS3Client())
+        eventhub._claim_check_reader = store
+        received = []
+        eventhub.register_on_message_callback("test", {"test": lambda props, msg: received.append(msg)})
+        reference = store.put(gzip.compress(b'{"index": 1}'))
+        deliver(eventhub, "test", 1, b"", content_encoding="gzip", headers={"Claim-Check": reference})
+        deliver(eventhub, "test", 2, b"", headers={"Claim-Check": "s3://bucket/expired"})
+        wait_for_tasks(eventhub)
+        assert received == [{"index": 1}]
+        assert sorted(eventhub._channel.frames) == [("ack", 1, False), ("reject", 2, False)]
+        assert eventhub.metrics.claim_checks_fetched.get() == 1
+
+
+class TestEventhubRetry:
+    """Eventhub retry policy Test Cases"""
+
+    @staticmethod
+    def fail(props, msg):
+        raise ConnectionError("humio is down")
+
+    def test_retry_queues_registered(self, eventhub):
+        """The retry queues are declared along with the queue, which gets the dead letter exchange"""
+        eventhub.register_on_message_callback("q", {"key": self.fail}, retry_policy=RetryPolicy(delays=(1, 60), dead_letter_exchange="parking"))
+        queues = eventhub._queue_manager.queues
+        assert queues["q"].arguments == {"x-dead-letter-exchange": "parking"}
+        assert queues["q.retry.1000ms"].arguments["x-dead-letter-routing-key"] == "q"
+        assert queues["q.retry.60000ms"].arguments["x-message-ttl"] == 60000
+
+    def test_failed_message_retried_then_rejected(self, eventhub):
+        """A failure publishes the message to its retry queue and acks it, the last attempt is rejected"""
+        eventhub._channel = MockChannel(record_properties=True)
+        eventhub.username = "etl"
+        eventhub.register_on_message_callback("q", {"key": self.fail}, retry_policy=RetryPolicy(delays=(1,), max_attempts=2))
+        deliver(eventhub, "q", 1, b"{}", routing_key="key", user_id="producer")
+        wait_for_tasks(eventhub)
+        _, routing_key, body, properties = eventhub._channel.frames[0]
+        assert (routing_key, body) == ("q.retry.1000ms", b"{}")
+        assert properties.headers["Retry-Attempt"] == 1
+        assert properties.headers["Retry-Routing-Key"] == "key"
+        assert properties.user_id == "etl"
+        assert eventhub._channels_by_consumer_tag["ctag"].frames == [("ack", 1, False)]
+        assert eventhub.metrics.retried.get(queue="q", routing_key="key") == 1
+
+        # expired back to the queue through the default exchange
+        eventhub._thread_pool_executor = rabbit.ThreadPoolExecutor(max_workers=1)
+        received = []
+        eventhub._queue_manager.queues["q"].bindings["key"] = lambda props, msg: received.append(props.routing_key) or self.fail(props, msg)
+        basic_deliver = Basic.Deliver(consumer_tag="ctag", delivery_tag=2, exchange="", routing_key="q")
+        eventhub._on_message(eventhub._channels_by_consumer_tag["ctag"], basic_deliver, properties, body, eventhub._queue_manager.queues["q"])
+        wait_for_tasks(eventhub)
+        assert received == ["key"]
+        assert len(eventhub._channel.frames) == 1
+        assert eventhub._channels_by_consumer_tag["ctag"].frames[1] == ("reject", 2, False)
+
+    def test_dropped_retry_rejected(self, eventhub):
+        """A retry that could not be sent or buffered rejects the message instead of acking it"""
+        eventhub._channel = None
+        eventhub._publish_buffer = None
+        eventhub.register_on_message_callback("q", {"key": self.fail}, retry_policy=RetryPolicy(delays=(1,), max_attempts=2))
+        deliver(eventhub, "q", 1, b"{}", routing_key="key")
+        wait_for_tasks(eventhub)
+        assert eventhub._channels_by_consumer_tag["ctag"].frames == [("reject", 1, False)]
+        assert eventhub.metrics.retried.get(queue="q", routing_key="key") == 0
+        assert eventhub.metrics.publishes_dropped.get() == 1
+
+    def test_undecodable_message_not_retried(self, eventhub):
+        """Messages that cannot be decoded are rejected right away"""
+        eventhub.register_on_message_callback("q", {"key": lambda props, msg: None}, retry_policy=RetryPolicy())
+        deliver(eventhub, "q", 1, b"not json", routing_key="key")
+        wait_for_tasks(eventhub)
+        assert eventhub._channel.frames == [("reject", 1, False)]
+
+
+class TestEventhubDedup:
+    """Eventhub dedup store Test Cases"""
+
+    def test_duplicate_acked_without_callback(self, eventhub):
+        """A redelivered message is acked without running the callback again"""
+        eventhub._dedup = MemoryDedupStore()
+        received = []
+        eventhub.register_on_message_callback("q", {"test": lambda props, msg: received.append(msg)})
+        deliver(eventhub, "q", 1, b'{"a": 1}', correlation_id="id")
+        wait_for_tasks(eventhub)
+        eventhub._thread_pool_executor = rabbit.ThreadPoolExecutor(max_workers=1)
+        deliver(eventhub, "q", 2, b'{"a": 1}', correlation_id="id")
+        wait_for_tasks(eventhub)
+        assert received == [{"a": 1}]
+        assert eventhub._channel.frames == [("ack", 1, False), ("ack", 2, False)]
+        assert eventhub.metrics.dedup_misses.get(queue="q") == 1
+        assert eventhub.metrics.dedup_hits.get(queue="q") == 1
+
+    def test_failed_message_not_remembered(self, eventhub):
+        """Messages whose callback raised are processed again, messages without a key are always processed"""
+        eventhub._dedup = MemoryDedupStore()
+        eventhub._dedup_key = lambda props: props.headers.get("id")
+        calls = []
+
+        def fail(props, msg):
+            calls.append(props.headers.get("id"))
+            raise ValueError("bad")
+
+        eventhub.register_on_message_callback("q", {"test": fail})
+        deliver(eventhub, "q", 1, b"{}", headers={"id": "a"})
+        deliver(eventhub, "q", 2, b"{}", headers={"id": "a"})
+        deliver(eventhub, "q", 3, b"{}")
+        wait_for_tasks(eventhub)
+        assert calls.count("a") == 2 and calls.count(None) == 1
+        assert len(eventhub._dedup) == 0
+
+
+class TestEventhubConfirms:
+    """Eventhub publisher confirm Test Cases"""
+
+    def test_invalid_publish_fails_future(self, eventhub):
+        """A publish that raises on the ioloop fails its confirm future"""
+        eventhub._confirm_tracker = rabbit.ConfirmTracker()
+        future = eventhub.publish_message_with_callbacks({}, "test", reply_to=True, reply_to_callback="cb")
+        with pytest.raises(AttributeError):
+            eventhub._connection.ioloop.run()
+        with pytest.raises(AttributeError):
+            future.result(timeout=0)
+        assert eventhub._channel.frames == []
+
+
+class TestEventhubReconnect:
+    """Eventhub reconnect and publish buffer Test Cases"""
+
+    def test_connection_lost_schedules_reconnect(self, eventhub):
+        """A lost connection is reopened after a backoff delay instead of stopping the ioloop"""
+        eventhub._on_connection_closed(None, Exception("lost"))
+        assert not eventhub._connection.ioloop.stopped
+        assert eventhub._reconnect_timer == eventhub._reconnect
+        assert eventhub._reconnect_backoff.attempts == 1
+
+    def test_connection_closed_while_stopping(self, eventhub):
+        """The ioloop stops when the connection closes because the service is stopping"""
+        eventhub._closing = True
+        eventhub._on_connection_closed(None, Exception("closed"))
+        assert eventhub._connection.ioloop.stopped
+        assert eventhub._reconnect_timer is None
+
+    def test_fatal_open_error_stops(self, eventhub):
+        """Authentication errors are not retried"""
+        eventhub._on_connection_open_error(None, rabbit.pika.exceptions.ProbableAuthenticationError())
+        assert eventhub._closing
+        assert eventhub._reconnect_timer is None
+
+    def test_max_reconnect_attempts(self):
+        """The service stops once max_reconnect_attempts consecutive attempts have failed"""
+        hub = rabbit.Eventhub(max_reconnect_attempts=2)
+        hub._connection = MockConnection()
+        for _ in range(2):
+            hub._on_connection_open_error(None, Exception("refused"))
+        assert not hub._closing
+        hub._on_connection_open_error(None, Exception("refused"))
+        assert hub._closing
+        assert hub._reconnect_backoff.attempts == 2
+
+    def test_topology_declared_in_one_pass(self, eventhub):
+        """Exchanges, queues and bindings are all sent before any is confirmed, consuming starts as queues are confirmed"""
+        eventhub.register_on_message_callback("test", {"a.b": lambda props, msg: None}, exchange="campus")
+        channel = MockChannel()
+        eventhub._channel = channel
+        eventhub._topology_declared = False
+        started = []
+        eventhub._request_consumer = started.append
+        eventhub._declare_topology()
+        assert channel.frames == [
+            ("exchange_declare", "campus"),
+            ("queue_declare", "test"),
+            ("queue_bind", "test", "campus", "a.b"),
+        ]
+        assert eventhub._topology_pending == 3
+        channel.confirm_all()
+        assert started == [eventhub._queue_manager.queues["test"]]
+        assert eventhub._topology_declared
+
+    def test_publishes_buffered_until_topology_declared(self, eventhub):
+        """Publishes made while disconnected are sent in order once the topology is declared on the new channel"""
+        eventhub._channel = None
+        eventhub._topology_declared = False
+        for index in range(3):
+            eventhub._publish_message({"index": index}, "test")
+        assert len(eventhub._publish_buffer) == 3
+        assert eventhub.metrics.publish_buffer_depth.get() == 3
+
+        channel = MockChannel()
+        eventhub._channel = channel
+        eventhub._declare_topology()
+        # published after the buffered messages
+        eventhub._publish_message({"index": 3}, "test")
+        assert [json.loads(frame[2])["index"] for frame in channel.frames] == [0, 1, 2, 3]
+        assert eventhub.metrics.publish_buffer_depth.get() == 0
+
+    def test_full_buffer_drops_publish(self):
+        """Publishes beyond the buffer size fail their confirm future"""
+        hub = rabbit.Eventhub(publish_buffer_size=1, publisher_confirms=True)
+        hub._connection = MockConnection()
+        first, second = rabbit.Future(), rabbit.Future()
+        hub._publish_message({}, "test", future=first)
+        hub._publish_message({}, "test", future=second)
+        assert not first.done()
+        with pytest.raises(rabbit.MessageNackedException):
+            second.result(timeout=0)
+        assert hub.metrics.publishes_dropped.get() == 1
+
+        hub._final_stop()
+        with pytest.raises(rabbit.MessageNackedException):
+            first.result(timeout=0)
+
+
+@pytest.fixture(scope="function")
+def spooled(tmp_path):
+    """Disconnected Eventhub with publisher confirms that spools publishes to a temporary directory"""
+    hub = rabbit.Eventhub(publisher_confirms=True, spool=Spool(str(tmp_path)))
+    hub._connection = MockConnection()
+    return hub
+
+
+def sent_indexes(channel):
+    """The index field of the messages published on the channel"""
+    return [json.loads(frame[2])["index"] for frame in channel.frames]
+
+
+class TestEventhubSpool:
+    """Eventhub disk spool Test Cases"""
+
+    def test_replayed_and_committed_on_confirm(self, spooled):
+        """Spooled publishes are sent once the topology is declared and leave the spool when confirmed"""
+        futures = [rabbit.Future() for _ in range(3)]
+        for index in range(2):
+            spooled._publish_message({"index": index}, "test", future=futures[index])
+        assert len(spooled._spool) == 2
+        assert spooled.metrics.spool_depth.get() == 2
+
+        channel = MockChannel()
+        spooled._channel = channel
+        spooled._declare_topology()
+        assert sent_indexes(channel) == [0, 1]
+        # waits in the spool behind the unconfirmed publishes
+        spooled._publish_message({"index": 2}, "test", future=futures[2])
+        assert sent_indexes(channel) == [0, 1]
+
+        spooled._confirm_tracker.on_confirm(Method(1, Basic.Ack(delivery_tag=2, multiple=True)))
+        assert futures[0].result(timeout=0)
+        assert not futures[2].done()
+        assert len(spooled._spool) == 1
+        spooled._connection.ioloop.fire_timers()
+        assert sent_indexes(channel) == [0, 1, 2]
+
+    def test_nack_replays(self, spooled):
+        """A nacked publish and the ones after it are sent again"""
+        for index in range(2):
+            spooled._publish_message({"index": index}, "test")
+        channel = MockChannel()
+        spooled._channel = channel
+        spooled._declare_topology()
+        spooled._confirm_tracker.on_confirm(Method(1, Basic.Nack(delivery_tag=1)))
+        assert len(spooled._spool) == 2
+        spooled._connection.ioloop.fire_timers()
+        assert sent_indexes(channel) == [0, 1, 0, 1]
+
+    def test_direct_replay_cancels_scheduled_one(self, spooled):
+        """Replaying when the channel reopens takes over from a replay that was scheduled"""
+        spooled._publish_message({"index": 0}, "test")
+        channel = MockChannel()
+        spooled._channel = channel
+        spooled._declare_topology()
+        spooled._confirm_tracker.on_confirm(Method(1, Basic.Nack(delivery_tag=1)))
+        assert spooled._connection.ioloop.timers
+        spooled._flush_publish_buffer()
+        assert spooled._connection.ioloop.timers == []
+        assert spooled._spool_timer is None
+        assert sent_indexes(channel) == [0, 0]
+
+    def test_poison_publish_dropped(self, spooled):
+        """A publish the broker keeps nacking is dropped so the ones behind it are sent"""
+        future = rabbit.Future()
+        spooled._publish_message({"index": 0}, "test", future=future)
+        spooled._publish_message({"index": 1}, "test")
+        channel = MockChannel()
+        spooled._channel = channel
+        spooled._declare_topology()
+        delivery_tag = 0
+        for _ in range(rabbit.SPOOL_MAX_NACKS):
+            delivery_tag += 2
+            spooled._confirm_tracker.on_confirm(Method(1, Basic.Nack(delivery_tag=delivery_tag - 1)))
+            spooled._confirm_tracker.on_confirm(Method(1, Basic.Ack(delivery_tag=delivery_tag)))
+            spooled._connection.ioloop.fire_timers()
+        with pytest.raises(rabbit.MessageNackedException):
+            future.result(timeout=0)
+        assert spooled.metrics.publishes_dropped.get() == 1
+        assert len(spooled._spool) == 0
+        assert sent_indexes(channel) == [0, 1] * rabbit.SPOOL_MAX_NACKS
+        assert spooled._spool_nacks == {}
+
+
+class TestEventhubStartup:
+    """Eventhub QoS and readiness Test Cases"""
+
+    def test_single_qos_per_consumer_channel(self, eventhub):
+        """A consumer channel sets its QoS once and starts every queue waiting for it right behind it"""
+        eventhub._consumer_channels[0] = None
+        for name in ("a", "b", "c"):
+            eventhub.register_on_message_callback(name, {"test": lambda props, msg: None})
+            eventhub._request_consumer(eventhub._queue_manager.queues[name])
+        channel = MockChannel()
+        eventhub._on_consumer_channel_open(channel, index=0)
+        assert channel.frames == [("qos", 10, False), ("consume", "a"), ("consume", "b"), ("consume", "c")]
+
+    def test_ready_once_all_consumers_started(self, eventhub):
+        """The ready callbacks run when the last consumer starts, and again after a lost consumer restarts"""
+        ready = []
+        eventhub.register_on_ready_callback(lambda: ready.append(True))
+        for name in ("a", "b"):
+            eventhub.register_on_message_callback(name, {"test": lambda props, msg: None})
+        eventhub._channel = MockChannel()
+        eventhub._consumer_channels[0] = MockChannel()
+        eventhub._declare_topology()
+        eventhub._channel.confirm_all()
+        assert ready == [True]
+        assert eventhub.metrics.topology_seconds.get() > 0
+
+        eventhub._on_consumer_channel_closed(eventhub._consumer_channels[0], Exception("closed"), index=0)
+        assert not eventhub._is_ready()
+        eventhub._on_consumer_channel_open(MockChannel(), index=0)
+        assert ready == [True, True]
@@ -0,0 +1,51 @@
+import pytest
+from pika.spec import BasicProperties
+from cessoc.rabbitmq.reconnect import Backoff, BufferedPublish, PublishBuffer
+
+
+class TestBackoff:
+    """Backoff Class Test Cases"""
+
+    def test_delays_grow_with_jitter(self):
+        """Each delay lies between half and all of a ceiling that doubles per attempt"""
+        backoff = Backoff(initial=1.0, maximum=8.0)
+        for ceiling in (1.0, 2.0, 4.0, 8.0, 8.0):
+            assert ceiling / 2 <= backoff.next_delay() <= ceiling
+        assert backoff.attempts == 5
+
+    def test_delays_are_spread(self):
+        """Replicas starting at the same moment get different delays"""
+        delays = {Backoff(initial=10.0).next_delay() for _ in range(20)}
+        assert len(delays) > 1
+
+    def test_reset(self):
+        """A reset starts over from the initial delay"""
+        backoff = Backoff(initial=1.0, maximum=60.0)
+        for _ in range(5):
+            backoff.next_delay()
+        backoff.reset()
+        assert backoff.attempts == 0
+        assert backoff.next_delay() <= 1.0
+
+    def test_invalid_bounds(self):
+        """The initial delay must be positive and not above the maximum"""
+        with pytest.raises(ValueError):
+            Backoff(initial=0)
+        with pytest.raises(ValueError):
+            Backoff(initial=10.0, maximum=1.0)
+
+
+class TestPublishBuffer:
+    """PublishBuffer Class Test Cases"""
+
+    def test_bounded_fifo(self):
+        """Publishes come out in order and the buffer refuses publishes beyond its size"""
+        buffer = PublishBuffer(2)
+        publishes = [BufferedPublish("", str(index), b"{}", BasicProperties(), True, None) for index in range(3)]
+        assert buffer.append(publishes[0])
+        assert buffer.append(publishes[1])
+        assert not buffer.append(publishes[2])
+        assert len(buffer) == 2
+        assert buffer.popleft() is publishes[0]
+        assert buffer.popleft() is publishes[1]
+        assert not buffer
@@ -0,0 +1,33 @@
+import pytest
+from cessoc.rabbitmq.retry import RetryPolicy
+
+
+class TestRetryPolicy:
+    """RetryPolicy Class Test Cases"""
+
+    def test_delays_per_attempt(self):
+        """Each attempt waits in its tier, attempts past the last tier reuse it"""
+        policy = RetryPolicy(delays=(1, 10), max_attempts=5)
+        assert [policy.delay(attempt) for attempt in (1, 2, 3, 4)] == [1, 10, 10, 10]
+        assert policy.retry_queue_name("test", 1) == "test.retry.1000ms"
+
+    def test_default_max_attempts(self):
+        """By default every tier is used once after the first attempt"""
+        assert RetryPolicy(delays=(1, 10, 60)).max_attempts == 4
+
+    def test_retry_queues(self):
+        """One retry queue per distinct delay, expiring back to the consumed queue through the default exchange"""
+        queues = RetryPolicy(delays=(0.5, 5, 5)).retry_queues("test")
+        assert [queue.name for queue in queues] == ["test.retry.500ms", "test.retry.5000ms"]
+        assert queues[0].arguments == {"x-message-ttl": 500, "x-dead-letter-exchange": "", "x-dead-letter-routing-key": "test"}
+        assert not queues[0].consume
+        assert queues[0].durable
+
+    def test_invalid(self):
+        """Delays must be positive and at least one attempt must be allowed"""
+        with pytest.raises(ValueError):
+            RetryPolicy(delays=())
+        with pytest.raises(ValueError):
+            RetryPolicy(delays=(0,))
+        with pytest.raises(ValueError):
+            RetryPolicy(max_attempts=0)
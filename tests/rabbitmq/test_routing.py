@@ -0,0 +1,55 @@
+import pytest
+from cessoc.rabbitmq.routing import RoutingIndex
+
+
+@pytest.fixture(scope="function")
+def index():
+    """Index with exact and wildcard bindings"""
+    return RoutingIndex({
+        "alert.create": "exact",
+        "alert.*": "star",
+        "host.#": "hash",
+        "*.user.#.done": "mixed",
+        "#": "catch_all",
+    })
+
+
+class TestRoutingIndex:
+    """RoutingIndex Class Test Cases"""
+
+    def test_exact_match(self, index):
+        """Exact bindings win over patterns"""
+        assert index.match("alert.create") == "alert.create"
+
+    def test_star_matches_one_word(self, index):
+        """'*' matches exactly one word"""
+        assert index.match("alert.update") == "alert.*"
+
+    def test_hash_matches_zero_words(self, index):
+        """'#' matches zero words"""
+        assert index.match("host") == "host.#"
+
+    def test_hash_matches_many_words(self, index):
+        """'#' matches many words"""
+        assert index.match("host.a.b.c") == "host.#"
+
+    def test_mixed_pattern(self, index):
+        """'*' and '#' combined in one pattern"""
+        assert index.match("byu.user.done") == "*.user.#.done"
+        assert index.match("byu.user.a.b.done") == "*.user.#.done"
+
+    def test_first_registered_wins(self, index):
+        """When several patterns match the first registered binding is used"""
+        assert index.match("alert.update") == "alert.*"
+        assert index.match("other.key") == "#"
+
+    def test_no_match(self):
+        """Unmatched routing keys return None"""
+        index = RoutingIndex({"alert.*": "star", "exact": "exact"})
+        assert index.match("alert.a.b") is None
+        assert index.match("alert") is None
+        assert index.match("missing") is None
+
+    def test_no_bindings(self):
+        """Queues without bindings match nothing"""
+        assert RoutingIndex(None).match("anything") is None
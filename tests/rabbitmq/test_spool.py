@@ -0,0 +1,89 @@
+import os
+import pytest
+from pika.spec import BasicProperties
+from cessoc.rabbitmq.reconnect import BufferedPublish
+from cessoc.rabbitmq.spool import Spool, SpoolFullException
+
+
+def publish(index):
+    """Builds a publish with a 50 byte body"""
+    properties = BasicProperties(correlation_id=str(index), headers={"index": index})
+    return BufferedPublish("campus", f"key.{index}", b"x" * 50, properties, True, None)
+
+
+class TestSpool:
+    """Spool Class Test Cases"""
+
+    def test_replays_in_order(self, tmp_path):
+        """Publishes are read back in order with their properties"""
+        spool = Spool(str(tmp_path))
+        for index in range(3):
+            spool.append(publish(index))
+        records = spool.read(10)
+        assert [record.routing_key for _, record in records] == ["key.0", "key.1", "key.2"]
+        assert records[1][1].properties.headers == {"index": 1}
+        assert records[1][1].body == b"x" * 50
+        assert records[1][1].mandatory
+        assert len(spool) == 3
+
+    def test_commit_and_rewind(self, tmp_path):
+        """Rewinding reads again from the last commit"""
+        spool = Spool(str(tmp_path))
+        for index in range(4):
+            spool.append(publish(index))
+        records = spool.read(3)
+        spool.commit(records[0][0])
+        spool.rewind()
+        assert [record.routing_key for _, record in spool.read(10)] == ["key.1", "key.2", "key.3"]
+        assert len(spool) == 3
+
+    def test_segments_roll_and_are_deleted(self, tmp_path):
+        """Segments fill up to segment_bytes and are deleted once committed past"""
+        spool = Spool(str(tmp_path), segment_bytes=200, max_bytes=10000)
+        for index in range(6):
+            spool.append(publish(index))
+        assert len([name for name in os.listdir(tmp_path) if name.endswith(".seg")]) == 3
+        records = spool.read(10)
+        assert len(records) == 6
+        spool.commit(records[3][0])
+        assert len([name for name in os.listdir(tmp_path) if name.endswith(".seg")]) == 2
+        assert len(spool) == 2
+
+    def test_size_cap(self, tmp_path):
+        """Appends beyond max_bytes are refused"""
+        spool = Spool(str(tmp_path), segment_bytes=200, max_bytes=200)
+        spool.append(publish(0))
+        spool.append(publish(1))
+        with pytest.raises(SpoolFullException):
+            spool.append(publish(2))
+
+    def test_reopen_replays_uncommitted(self, tmp_path):
+        """Only publishes after the committed position are replayed after a restart"""
+        spool = Spool(str(tmp_path), fsync="always")
+        for index in range(3):
+            spool.append(publish(index))
+        spool.commit(spool.read(1)[0][0])
+        spool.close()
+
+        spool = Spool(str(tmp_path))
+        assert len(spool) == 2
+        assert [record.routing_key for _, record in spool.read(10)] == ["key.1", "key.2"]
+
+    def test_torn_record_truncated(self, tmp_path):
+        """A record only partly written before a crash is dropped when the spool is opened"""
+        spool = Spool(str(tmp_path))
+        spool.append(publish(0))
+        spool.close()
+        segment = [name for name in os.listdir(tmp_path) if name.endswith(".seg")][0]
+        with open(os.path.join(tmp_path, segment), "ab") as segment_file:
+            segment_file.write(b"\x40\x00\x00\x00\x01")
+
+        spool = Spool(str(tmp_path))
+        assert len(spool) == 1
+        spool.append(publish(1))
+        assert [record.routing_key for _, record in spool.read(10)] == ["key.0", "key.1"]
+
+    def test_invalid_fsync(self, tmp_path):
+        """Unknown fsync policies are rejected"""
+        with pytest.raises(ValueError):
+            Spool(str(tmp_path), fsync="sometimes")
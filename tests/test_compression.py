@@ -0,0 +1,68 @@
+import pytest
+from cessoc import compression
+
+
+BODY = b'{"events": [' + b",".join(b'{"ip": "10.0.0.%d", "action": "allow"}' % (index % 256) for index in range(500)) + b"]}"
+
+
+def test_get_compressor_disabled():
+    """None disables compression"""
+    assert compression.get_compressor(None) is None
+
+
+def test_get_compressor_unknown():
+    """Unknown compressor names should raise"""
+    with pytest.raises(ValueError):
+        compression.get_compressor("brotli")
+
+
+def test_get_compressor_instance():
+    """Compressor instances should be returned as is"""
+    instance = compression.GzipCompressor()
+    assert compression.get_compressor(instance) is instance
+
+
+@pytest.mark.parametrize("name", list(compression.COMPRESSORS))
+def test_round_trip(name):
+    """Every installed compressor should shrink a repetitive body and decompress it by its content encoding"""
+    try:
+        compressor = compression.get_compressor(name)
+    except ImportError:
+        pytest.skip(f"{name} is not installed")
+    compressed = compressor.compress(BODY)
+    assert len(compressed) < len(BODY)
+    assert compressor.decompress(compressed) == BODY
+    assert compression.decompress(compressed, compressor.name) == BODY
+    assert compressor.name in compression.supported_encodings()
+
+
+def test_compressor_is_abstract():
+    """Compressors must implement compress and decompress"""
+    with pytest.raises(TypeError):
+        compression.Compressor()
+
+
+def test_gzip_is_deterministic():
+    """The same body compresses to the same bytes"""
+    compressor = compression.GzipCompressor()
+    assert compressor.compress(BODY) == compressor.compress(BODY)
+
+
+def test_plain_bodies_pass_through():
+    """UTF-8, identity and bodies without a content encoding are returned as is"""
+    assert compression.decompress(BODY, "utf-8") is BODY
+    assert compression.decompress(BODY, "identity") is BODY
+    assert compression.decompress(BODY, None) is BODY
+    assert {"utf-8", "identity"} <= compression.supported_encodings()
+
+
+def test_corrupt_body():
+    """Bodies that are not valid for their content encoding raise DecompressionError"""
+    with pytest.raises(compression.DecompressionError):
+        compression.decompress(BODY, "gzip")
+
+
+def test_unknown_encoding():
+    """Unknown content encodings raise"""
+    with pytest.raises(ValueError):
+        compression.decompress(BODY, "br")
@@ -0,0 +1,87 @@
+import json
+import pytest
+from cessoc import serialization
+
+
+MESSAGE = {"test": True, "list": [1, 2.5, "three"], "nested": {"key": None}}
+JSON_CODECS = [name for name, serializer in serialization.SERIALIZERS.items() if issubclass(serializer, serialization.JsonCodec)]
+
+
+def test_get_codec_default():
+    """Default codec should be the standard library"""
+    assert isinstance(serialization.get_codec(), serialization.StdlibJsonCodec)
+
+
+@pytest.mark.parametrize("name", ["yaml", "msgpack"])
+def test_get_codec_unknown(name):
+    """Names that are not JSON codecs should raise"""
+    with pytest.raises(ValueError):
+        serialization.get_codec(name)
+
+
+def test_get_codec_instance():
+    """Codec instances should be returned as is"""
+    instance = serialization.StdlibJsonCodec()
+    assert serialization.get_codec(instance) is instance
+
+
+@pytest.mark.parametrize("base", [serialization.Serializer, serialization.JsonCodec])
+def test_base_is_abstract(base):
+    """Serializers and codecs must implement loads and dumps"""
+    with pytest.raises(TypeError):
+        base()
+
+
+@pytest.mark.parametrize("name", JSON_CODECS)
+def test_round_trip(name):
+    """Every installed codec should decode from bytes and encode to bytes"""
+    try:
+        json_codec = serialization.get_codec(name)
+    except ImportError:
+        pytest.skip(f"{name} is not installed")
+    encoded = json_codec.dumps(MESSAGE)
+    assert isinstance(encoded, bytes)
+    assert json.loads(encoded) == MESSAGE
+    assert json_codec.loads(json.dumps(MESSAGE).encode("utf-8")) == MESSAGE
+    assert json.loads(json_codec.dumps_str(MESSAGE)) == MESSAGE
+
+
+@pytest.mark.parametrize("name", JSON_CODECS)
+def test_invalid_json(name):
+    """Every installed codec should raise json.JSONDecodeError on invalid documents"""
+    try:
+        json_codec = serialization.get_codec(name)
+    except ImportError:
+        pytest.skip(f"{name} is not installed")
+    with pytest.raises(json.JSONDecodeError):
+        json_codec.loads(b"{not json")
+
+
+def test_json_serializer_is_codec():
+    """JSON bodies are encoded with the configured codec"""
+    serializers = serialization.get_serializers("json")
+    serializer = serializers["application/json"]
+    assert isinstance(serializer, serialization.StdlibJsonCodec)
+    assert json.loads(serializer.dumps(MESSAGE)) == MESSAGE
+    assert serializer.loads(json.dumps(MESSAGE).encode("utf-8")) == MESSAGE
+
+
+def test_custom_serializer_replaces_built_in():
+    """Serializers passed in take over their content type"""
+    custom = serialization.StdlibJsonCodec()
+    assert serialization.get_serializers(serializers=[custom])["application/json"] is custom
+
+
+def test_msgpack_round_trip():
+    """bytes values survive the round trip as bytes and str values as str"""
+    pytest.importorskip("msgpack")
+    serializer = serialization.get_serializers()["application/msgpack"]
+    message = {"raw": b"\x00\xff", "text": "é", 1: [1, 2.5, None]}
+    assert serializer.loads(serializer.dumps(message)) == message
+
+
+def test_msgpack_invalid_body():
+    """Bodies that are not valid msgpack raise DeserializationError"""
+    pytest.importorskip("msgpack")
+    with pytest.raises(serialization.DeserializationError):
+        serialization.MsgpackSerializer().loads(b"\xc1")